@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# --------------------------------------------------------------
+# Start-up time of SCT command-line tools
+#
+# For each tool, report the wall time of "sct_tool -h" (best of several runs) and the import time of the script, as
+# measured by "python -X importtime" (Python >= 3.7), with the packages that take the most time to import.
+#
+# Usage:
+#     python dev/benchmark_importtime.py [-budget 1.0] [sct_label_utils sct_image ...]
+# Exit status is 1 if a tool exceeds the budget.
+# --------------------------------------------------------------
+
+from __future__ import print_function, division
+
+import os, sys, time, subprocess, argparse
+
+path_sct = os.environ.get("SCT_DIR", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+path_scripts = os.path.join(path_sct, "scripts")
+
+# tools benchmarked by default: small tools, which should start quickly
+DEFAULT_TOOLS = ['sct_label_utils', 'sct_image', 'sct_maths', 'sct_crop_image', 'sct_apply_transfo',
+                 'sct_concat_transfo', 'sct_register_multimodal', 'sct_process_segmentation']
+
+
+def get_env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([path_sct, path_scripts] + env.get('PYTHONPATH', '').split(os.pathsep))
+    env.setdefault('MPLBACKEND', 'Agg')
+    return env
+
+
+def time_help(tool, repeat):
+    """
+    :return: best wall time (s) of "python scripts/tool.py -h"
+    """
+    list_time = []
+    for i in range(repeat):
+        time_start = time.time()
+        subprocess.call([sys.executable, os.path.join(path_scripts, tool + '.py'), '-h'], env=get_env(),
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        list_time.append(time.time() - time_start)
+    return min(list_time)
+
+
+def importtime(tool):
+    """
+    :return: total import time of the script (s), and cumulative import time (s) of each top-level package
+    """
+    p = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(tool)], env=get_env(),
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    _, err = p.communicate()
+    total, packages = 0., {}
+    for line in err.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        if name == tool:
+            total = int(cumulative) / 1e6
+        elif depth <= 1:
+            # modules imported by the script itself, or by its interpreter start-up
+            package = name.split('.')[0]
+            packages[package] = packages.get(package, 0) + int(cumulative) / 1e6
+    return total, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start-up time of SCT command-line tools")
+    parser.add_argument('tools', nargs='*', default=DEFAULT_TOOLS, help="tools to benchmark, or 'all'")
+    parser.add_argument('-budget', type=float, default=1., help="maximum start-up time (s)")
+    parser.add_argument('-repeat', type=int, default=3, help="number of runs of each tool")
+    parser.add_argument('-top', type=int, default=3, help="number of packages reported for each tool")
+    args = parser.parse_args()
+
+    tools = args.tools
+    if tools == ['all']:
+        tools = sorted(os.path.splitext(f)[0] for f in os.listdir(path_scripts)
+                       if f.startswith('sct_') and f.endswith('.py'))
+
+    status = 0
+    print("{:<36} {:>8} {:>8}  {}".format('tool', '-h (s)', 'import', 'slowest imports (s)'))
+    for tool in tools:
+        time_h = time_help(tool, args.repeat)
+        total, packages = importtime(tool)
+        slowest = sorted(packages.items(), key=lambda x: -x[1])[:args.top]
+        print("{:<36} {:>8.2f} {:>8.2f}  {}{}".format(
+            tool, time_h, total, ', '.join('{}={:.2f}'.format(*x) for x in slowest),
+            '  OVER BUDGET' if time_h > args.budget else ''))
+        if time_h > args.budget:
+            status = 1
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
@@ -29,12 +29,14 @@ import scipy.interpolate
 import sct_utils as sct
 from sct_convert import convert
 from spinalcordtoolbox.image import Image
+from spinalcordtoolbox import profiling
 from sct_image import split_data, concat_data
 import sct_apply_transfo
 
 #=======================================================================================================================
 # moco Function
 #=======================================================================================================================
+@profiling.span('moco')
 def moco(param):
 
     # retrieve parameters
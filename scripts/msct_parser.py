@@ -338,6 +338,18 @@ class Parser:
             doc_sourceforge.generate()
             exit(1)
 
+        # generic flag available to all functions: write a JSON profile of the run. See spinalcordtoolbox.profiling
+        if "-profile" in arguments and "-profile" not in self.options:
+            from spinalcordtoolbox import profiling
+            index = arguments.index("-profile")
+            # the output path is optional: the next argument is another flag if it starts with "-"
+            if index + 1 < len(arguments) and not arguments[index + 1].startswith('-'):
+                profiling.enable(arguments[index + 1])
+                arguments = arguments[:index] + arguments[index + 2:]
+            else:
+                profiling.enable(os.getcwd())
+                arguments = arguments[:index] + arguments[index + 1:]
+
         # initialize results
         dictionary = dict()
 
@@ -20,13 +20,15 @@ from __future__ import division, absolute_import
 
 import sys, os, shutil, logging
 from math import asin, cos, sin, acos
+from multiprocessing import cpu_count
 import numpy as np
 
 from scipy import ndimage
 from scipy.io import loadmat
-from nibabel import load, Nifti1Image, save
+from nibabel import load
 
 from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.warp import DisplacementFieldWriter
 import sct_utils as sct
 from sct_convert import convert
 from sct_register_multimodal import Paramreg
@@ -56,8 +58,9 @@ def register_slicewise(fname_src,
         del fname_src
         del fname_dest  # to be sure it is not missused later
 
-    # create temporary folder
-    path_tmp = sct.tmp_create(basename="register", verbose=verbose)
+    # create temporary folder: inputs and mask, two displacement fields (3 components), in float32 on the grid of dest
+    nbytes = sct.nifti_nbytes(fname_dest_im if im_and_seg else fname_dest, itemsize=4)
+    path_tmp = sct.tmp_create(basename="register", verbose=verbose, size=11 * nbytes)
 
     # copy data to temp folder
     sct.printv('\nCopy input data to temp folder...', verbose)
@@ -152,22 +155,8 @@ def register2d_centermassrot(fname_src, fname_dest, fname_warp='warp_forward.nii
     sct.printv('  voxel size:  ' + str(px) + 'mm x ' + str(py) + 'mm x ' + str(pz) + 'mm', verbose)
 
     if rot == 1 or rot == 0:
-        # Split source volume along z
-        sct.printv('\nSplit input volume...', verbose)
-        from sct_image import split_data
         im_src = Image('src.nii')
-        split_source_list = split_data(im_src, 2)
-        for im in split_source_list:
-            im.save()
-
-        # Split destination volume along z
-        sct.printv('\nSplit destination volume...', verbose)
         im_dest = Image('dest.nii')
-        split_dest_list = split_data(im_dest, 2)
-        for im in split_dest_list:
-            im.save()
-
-        # display image
         data_src = im_src.data
         data_dest = im_dest.data
         if len(data_src.shape) == 2:
@@ -178,30 +167,10 @@ def register2d_centermassrot(fname_src, fname_dest, fname_warp='warp_forward.nii
             data_src = data_src.reshape(new_shape)
             data_dest = data_dest.reshape(new_shape)
     elif rot == 2:  # im and seg case
-        # Split source volume along z
-        sct.printv('\nSplit input volume...', verbose)
-        from sct_image import split_data
         im_src_im = Image('src_im.nii')
-        split_source_list = split_data(im_src_im, 2)
-        for im in split_source_list:
-            im.save()
         im_src_seg = Image('src_seg.nii')
-        split_source_list = split_data(im_src_seg, 2)
-        for im in split_source_list:
-            im.save()
-
-        # Split destination volume along z
-        sct.printv('\nSplit destination volume...', verbose)
         im_dest_im = Image('dest_im.nii')
-        split_dest_list = split_data(im_dest_im, 2)
-        for im in split_dest_list:
-            im.save()
         im_dest_seg = Image('dest_seg.nii')
-        split_dest_list = split_data(im_dest_seg, 2)
-        for im in split_dest_list:
-            im.save()
-
-        # display image
         data_src_im = im_src_im.data
         data_dest_im = im_dest_im.data
         data_src_seg = im_src_seg.data
@@ -214,40 +183,31 @@ def register2d_centermassrot(fname_src, fname_dest, fname_warp='warp_forward.nii
     pca_src = [None] * nz
     coord_dest = [None] * nz
     pca_dest = [None] * nz
-    centermass_src = np.zeros([nz, 2])
-    centermass_dest = np.zeros([nz, 2])
-    # displacement_forward = np.zeros([nz, 2])
-    # displacement_inverse = np.zeros([nz, 2])
     angle_src_dest = np.zeros(nz)
-    z_nonzero = []
 
     if rot == 1 or rot == 0:
-        # Loop across slices
-        for iz in range(0, nz):
-            try:
-                # compute PCA and get center or mass
-                coord_src[iz], pca_src[iz], centermass_src[iz, :] = compute_pca(data_src[:, :, iz])
-                coord_dest[iz], pca_dest[iz], centermass_dest[iz, :] = compute_pca(data_dest[:, :, iz])
-                # compute (src,dest) angle for first eigenvector
-                if rot == 1:
-                    eigenv_src = pca_src[iz].components_.T[0][0], pca_src[iz].components_.T[1][0]  # pca_src.components_.T[0]
-                    eigenv_dest = pca_dest[iz].components_.T[0][0], pca_dest[iz].components_.T[1][0]  # pca_dest.components_.T[0]
-                    # Make sure first element is always positive (to prevent sign flipping)
-                    if eigenv_src[0] <= 0:
-                        eigenv_src = tuple([i * (-1) for i in eigenv_src])
-                    if eigenv_dest[0] <= 0:
-                        eigenv_dest = tuple([i * (-1) for i in eigenv_dest])
-                    angle_src_dest[iz] = angle_between(eigenv_src, eigenv_dest)
-                    # check if ratio between the two eigenvectors is high enough to prevent poor robustness
-                    if pca_src[iz].explained_variance_ratio_[0] / pca_src[iz].explained_variance_ratio_[1] < pca_eigenratio_th:
-                        angle_src_dest[iz] = 0
-                    if pca_dest[iz].explained_variance_ratio_[0] / pca_dest[iz].explained_variance_ratio_[1] < pca_eigenratio_th:
-                        angle_src_dest[iz] = 0
-                # append to list of z_nonzero
-                z_nonzero.append(iz)
-            # if one of the slice is empty, ignore it
-            except ValueError:
-                sct.printv('WARNING: Slice #' + str(iz) + ' is empty. It will be ignored.', verbose, 'warning')
+        # compute PCA and get center of mass, for all slices at once
+        centermass_src, eigenvectors_src, eigenvalues_src = compute_pca_slicewise(data_src)
+        centermass_dest, eigenvectors_dest, eigenvalues_dest = compute_pca_slicewise(data_dest)
+        # if one of the slice is empty, ignore it
+        mask_nonzero = ~np.isnan(centermass_src[:, 0]) & ~np.isnan(centermass_dest[:, 0])
+        for iz in np.flatnonzero(~mask_nonzero):
+            sct.printv('WARNING: Slice #' + str(iz) + ' is empty. It will be ignored.', verbose, 'warning')
+        z_nonzero = np.flatnonzero(mask_nonzero)
+        # compute (src,dest) angle for first eigenvector
+        if rot == 1:
+            eigenv_src = eigenvectors_src[z_nonzero, :, 0]
+            eigenv_dest = eigenvectors_dest[z_nonzero, :, 0]
+            # Make sure first element is always positive (to prevent sign flipping)
+            eigenv_src[eigenv_src[:, 0] <= 0] *= -1
+            eigenv_dest[eigenv_dest[:, 0] <= 0] *= -1
+            # signed angle between unit vectors (see angle_between())
+            sign_angle = np.sign(eigenv_src[:, 0] * eigenv_dest[:, 1] - eigenv_src[:, 1] * eigenv_dest[:, 0])
+            angle_src_dest[z_nonzero] = sign_angle * np.arccos(np.clip(np.sum(eigenv_src * eigenv_dest, axis=1), -1, 1))
+            # check if ratio between the two eigenvectors is high enough to prevent poor robustness
+            with np.errstate(divide='ignore'):
+                angle_src_dest[z_nonzero[eigenvalues_src[z_nonzero, 0] / eigenvalues_src[z_nonzero, 1] < pca_eigenratio_th]] = 0
+                angle_src_dest[z_nonzero[eigenvalues_dest[z_nonzero, 0] / eigenvalues_dest[z_nonzero, 1] < pca_eigenratio_th]] = 0
 
     elif rot == 2:  # im and seg case
 
@@ -300,35 +260,35 @@ def register2d_centermassrot(fname_src, fname_dest, fname_warp='warp_forward.nii
         fname_src = fname_src_im
         # back to original names for the rest of the process
 
-    warp_x = np.zeros(data_dest.shape)
-    warp_y = np.zeros(data_dest.shape)
-    warp_inv_x = np.zeros(data_src.shape)
-    warp_inv_y = np.zeros(data_src.shape)
-
-    # construct 3D warping matrix
-    for iz in z_nonzero:
-        # TODO: replace the thing below with "tqdm-like" logger-based function
-        # sct.no_new_line_log('{}/{}..'.format(iz + 1, nz))
-        # get indices of x and y coordinates
-        row, col = np.indices((nx, ny))
-        # build 2xn array of coordinates in pixel space
-        coord_init_pix = np.array([row.ravel(), col.ravel(), np.array(np.ones(len(row.ravel())) * iz)]).T
-        # convert coordinates to physical space
-        coord_init_phy = np.array(im_src.transfo_pix2phys(coord_init_pix))
-        # get centermass coordinates in physical space
-        centermass_src_phy = im_src.transfo_pix2phys([[centermass_src[iz, :].T[0], centermass_src[iz, :].T[1], iz]])[0]
-        centermass_dest_phy = im_src.transfo_pix2phys([[centermass_dest[iz, :].T[0], centermass_dest[iz, :].T[1], iz]])[0]
-        # build rotation matrix
-        R = np.matrix(((cos(angle_src_dest[iz]), sin(angle_src_dest[iz])), (-sin(angle_src_dest[iz]), cos(angle_src_dest[iz]))))
-        # build 3D rotation matrix
-        R3d = np.eye(3)
-        R3d[0:2, 0:2] = R
-        # apply forward transformation (in physical space)
-        coord_forward_phy = np.array(np.dot((coord_init_phy - np.transpose(centermass_dest_phy)), R3d) + np.transpose(centermass_src_phy))
-        # apply inverse transformation (in physical space)
-        coord_inverse_phy = np.array(np.dot((coord_init_phy - np.transpose(centermass_src_phy)), R3d.T) + np.transpose(centermass_dest_phy))
-        # display rotations
-        if verbose == 2 and not angle_src_dest[iz] == 0:
+    # physical coordinates of the voxels (in the source space), and of the centers of mass
+    affine = im_src.hdr.get_best_affine()
+    coord_init_phy = np.tensordot(affine[:3, :3], np.indices(data_src.shape[:3]), axes=1) \
+                     + affine[:3, 3].reshape(3, 1, 1, 1)
+    centermass_src_phy = np.dot(affine[:3, :3], np.c_[np.nan_to_num(centermass_src), np.arange(nz)].T) \
+                         + affine[:3, 3:]
+    centermass_dest_phy = np.dot(affine[:3, :3], np.c_[np.nan_to_num(centermass_dest), np.arange(nz)].T) \
+                          + affine[:3, 3:]
+    cos_angle, sin_angle = np.cos(angle_src_dest), np.sin(angle_src_dest)
+
+    # construct 3D warping matrix, for all slices at once (rotation R = ((cos, sin), (-sin, cos)) in the axial plane)
+    # forward transformation (in physical space): (p - centermass_dest).R + centermass_src
+    dx, dy = coord_init_phy[0] - centermass_dest_phy[0], coord_init_phy[1] - centermass_dest_phy[1]
+    warp_x = dx * cos_angle - dy * sin_angle + centermass_src_phy[0] - coord_init_phy[0]
+    warp_y = dx * sin_angle + dy * cos_angle + centermass_src_phy[1] - coord_init_phy[1]
+    # inverse transformation (in physical space): (p - centermass_src).R^T + centermass_dest
+    dx, dy = coord_init_phy[0] - centermass_src_phy[0], coord_init_phy[1] - centermass_src_phy[1]
+    warp_inv_x = dx * cos_angle + dy * sin_angle + centermass_dest_phy[0] - coord_init_phy[0]
+    warp_inv_y = -dx * sin_angle + dy * cos_angle + centermass_dest_phy[1] - coord_init_phy[1]
+    # no displacement for ignored slices
+    for warp_xy in [warp_x, warp_y, warp_inv_x, warp_inv_y]:
+        warp_xy[..., ~mask_nonzero] = 0
+
+    # display rotations
+    if verbose == 2:
+        for iz in z_nonzero[angle_src_dest[z_nonzero] != 0]:
+            coord_src[iz], pca_src[iz], _ = compute_pca(data_src[:, :, iz])
+            coord_dest[iz], pca_dest[iz], _ = compute_pca(data_dest[:, :, iz])
+            R = np.matrix(((cos(angle_src_dest[iz]), sin(angle_src_dest[iz])), (-sin(angle_src_dest[iz]), cos(angle_src_dest[iz]))))
             # compute new coordinates
             coord_src_rot = coord_src[iz] * R
             coord_dest_rot = coord_dest[iz] * R.T
@@ -380,17 +340,11 @@ def register2d_centermassrot(fname_src, fname_dest, fname_warp='warp_forward.nii
             plt.savefig(os.path.join(path_qc, 'register2d_centermassrot_pca_z' + str(iz) + '.png'))
             plt.close()
 
-        # construct 3D warping matrix
-        warp_x[:, :, iz] = np.array([coord_forward_phy[i, 0] - coord_init_phy[i, 0] for i in range(nx * ny)]).reshape((nx, ny))
-        warp_y[:, :, iz] = np.array([coord_forward_phy[i, 1] - coord_init_phy[i, 1] for i in range(nx * ny)]).reshape((nx, ny))
-        warp_inv_x[:, :, iz] = np.array([coord_inverse_phy[i, 0] - coord_init_phy[i, 0] for i in range(nx * ny)]).reshape((nx, ny))
-        warp_inv_y[:, :, iz] = np.array([coord_inverse_phy[i, 1] - coord_init_phy[i, 1] for i in range(nx * ny)]).reshape((nx, ny))
-
     logger.info('\n Done')
 
     # Generate forward warping field (defined in destination space)
-    generate_warping_field(fname_dest, warp_x, warp_y, fname_warp, verbose)
-    generate_warping_field(fname_src, warp_inv_x, warp_inv_y, fname_warp_inv, verbose)
+    generate_warping_field(fname_dest, warp_x, warp_y, fname_warp, verbose, compresslevel=0)
+    generate_warping_field(fname_src, warp_inv_x, warp_inv_y, fname_warp_inv, verbose, compresslevel=0)
 
 
 def register2d_columnwise(fname_src, fname_dest, fname_warp='warp_forward.nii.gz', fname_warp_inv='warp_inverse.nii.gz', verbose=0, path_qc='./', smoothWarpXY=1):
@@ -398,9 +352,10 @@ def register2d_columnwise(fname_src, fname_dest, fname_warp='warp_forward.nii.gz
     Column-wise non-linear registration of segmentations. Based on an idea from Allan Martin.
     - Assumes src/dest are segmentations (not necessarily binary), and already registered by center of mass
     - Assumes src/dest are in RPI orientation.
-    - Split along Z, then for each slice:
+    - For each slice:
     - scale in R-L direction to match src/dest
-    - loop across R-L columns and register by (i) matching center of mass and (ii) scaling.
+    - register each R-L column by (i) matching center of mass and (ii) scaling.
+    All slices and columns are processed at once.
     :param fname_src:
     :param fname_dest:
     :param fname_warp:
@@ -408,6 +363,7 @@ def register2d_columnwise(fname_src, fname_dest, fname_warp='warp_forward.nii.gz
     :param verbose:
     :return:
     """
+    from skimage.transform import warp
 
     # initialization
     th_nonzero = 0.5  # values below are considered zero
@@ -424,22 +380,9 @@ def register2d_columnwise(fname_src, fname_dest, fname_warp='warp_forward.nii.gz
     sct.printv('  matrix size: ' + str(nx) + ' x ' + str(ny) + ' x ' + str(nz), verbose)
     sct.printv('  voxel size:  ' + str(px) + 'mm x ' + str(py) + 'mm x ' + str(pz) + 'mm', verbose)
 
-    # Split source volume along z
-    sct.printv('\nSplit input volume...', verbose)
-    from sct_image import split_data
+    # open image
     im_src = Image('src.nii')
-    split_source_list = split_data(im_src, 2)
-    for im in split_source_list:
-        im.save()
-
-    # Split destination volume along z
-    sct.printv('\nSplit destination volume...', verbose)
     im_dest = Image('dest.nii')
-    split_dest_list = split_data(im_dest, 2)
-    for im in split_dest_list:
-        im.save()
-
-    # open image
     data_src = im_src.data
     data_dest = im_dest.data
 
@@ -451,212 +394,124 @@ def register2d_columnwise(fname_src, fname_dest, fname_warp='warp_forward.nii.gz
         data_src = data_src.reshape(new_shape)
         data_dest = data_dest.reshape(new_shape)
 
-    # initialize forward warping field (defined in destination space)
-    warp_x = np.zeros(data_dest.shape)
-    warp_y = np.zeros(data_dest.shape)
+    # threshold at 0.5
+    data_src[data_src < th_nonzero] = 0
+    data_dest[data_dest < th_nonzero] = 0
 
-    # initialize inverse warping field (defined in source space)
-    warp_inv_x = np.zeros(data_src.shape)
-    warp_inv_y = np.zeros(data_src.shape)
+    # get indices of x, y and z coordinates
+    row, col, coord_z = np.indices((nx, ny, nz))
 
-    # Loop across slices
     sct.printv('\nEstimate columnwise transformation...', verbose)
-    for iz in range(0, nz):
-        sct.printv(str(iz) + '/' + str(nz) + '..',)
-
-        # PREPARE COORDINATES
-        # ============================================================
-        # get indices of x and y coordinates
-        row, col = np.indices((nx, ny))
-        # build 2xn array of coordinates in pixel space
-        # ordering of indices is as follows:
-        # coord_init_pix[:, 0] = 0, 0, 0, ..., 1, 1, 1..., nx, nx, nx
-        # coord_init_pix[:, 1] = 0, 1, 2, ..., 0, 1, 2..., 0, 1, 2
-        coord_init_pix = np.array([row.ravel(), col.ravel(), np.array(np.ones(len(row.ravel())) * iz)]).T
-        # convert coordinates to physical space
-        coord_init_phy = np.array(im_src.transfo_pix2phys(coord_init_pix))
-        # get 2d data from the selected slice
-        src2d = data_src[:, :, iz]
-        dest2d = data_dest[:, :, iz]
-        # julien 20161105
-        #<<<
-        # threshold at 0.5
-        src2d[src2d < th_nonzero] = 0
-        dest2d[dest2d < th_nonzero] = 0
-        # get non-zero coordinates, and transpose to obtain nx2 dimensions
-        coord_src2d = np.array(np.where(src2d > 0)).T
-        coord_dest2d = np.array(np.where(dest2d > 0)).T
-        # here we use 0.5 as threshold for non-zero value
-        # coord_src2d = np.array(np.where(src2d > th_nonzero)).T
-        # coord_dest2d = np.array(np.where(dest2d > th_nonzero)).T
-        #>>>
-
-        # SCALING R-L (X dimension)
-        # ============================================================
-        # sum data across Y to obtain 1D signal: src_y and dest_y
-        src1d = np.sum(src2d, 1)
-        dest1d = np.sum(dest2d, 1)
-        # make sure there are non-zero data in src or dest
-        if np.any(src1d > th_nonzero) and np.any(dest1d > th_nonzero):
-            # retrieve min/max of non-zeros elements (edge of the segmentation)
-            # julien 20161105
-            # <<<
-            src1d_min, src1d_max = min(np.where(src1d != 0)[0]), max(np.where(src1d != 0)[0])
-            dest1d_min, dest1d_max = min(np.where(dest1d != 0)[0]), max(np.where(dest1d != 0)[0])
-            # for i in range(len(src1d)):
-            #     if src1d[i] > 0.5:
-            #         found index above 0.5, exit loop
-                    # break
-            # get indices (in continuous space) at half-maximum of upward and downward slope
-            # src1d_min, src1d_max = find_index_halfmax(src1d)
-            # dest1d_min, dest1d_max = find_index_halfmax(dest1d)
-            # >>>
-            # 1D matching between src_y and dest_y
-            mean_dest_x = (dest1d_max + dest1d_min) / 2
-            mean_src_x = (src1d_max + src1d_min) / 2
-            # compute x-scaling factor
-            Sx = (dest1d_max - dest1d_min + 1) / float(src1d_max - src1d_min + 1)
-            # apply transformation to coordinates
-            coord_src2d_scaleX = np.copy(coord_src2d)  # need to use np.copy to avoid copying pointer
-            coord_src2d_scaleX[:, 0] = (coord_src2d[:, 0] - mean_src_x) * Sx + mean_dest_x
-            coord_init_pix_scaleX = np.copy(coord_init_pix)
-            coord_init_pix_scaleX[:, 0] = (coord_init_pix[:, 0] - mean_src_x) * Sx + mean_dest_x
-            coord_init_pix_scaleXinv = np.copy(coord_init_pix)
-            coord_init_pix_scaleXinv[:, 0] = (coord_init_pix[:, 0] - mean_dest_x) / float(Sx) + mean_src_x
-            # apply transformation to image
-            from skimage.transform import warp
-            row_scaleXinv = np.reshape(coord_init_pix_scaleXinv[:, 0], [nx, ny])
-            src2d_scaleX = warp(src2d, np.array([row_scaleXinv, col]), order=1)
-
-            # ============================================================
-            # COLUMN-WISE REGISTRATION (Y dimension for each Xi)
-            # ============================================================
-            coord_init_pix_scaleY = np.copy(coord_init_pix)  # need to use np.copy to avoid copying pointer
-            coord_init_pix_scaleYinv = np.copy(coord_init_pix)  # need to use np.copy to avoid copying pointer
-            # coord_src2d_scaleXY = np.copy(coord_src2d_scaleX)  # need to use np.copy to avoid copying pointer
-            # loop across columns (X dimension)
-            for ix in range(nx):
-                # retrieve 1D signal along Y
-                src1d = src2d_scaleX[ix, :]
-                dest1d = dest2d[ix, :]
-                # make sure there are non-zero data in src or dest
-                if np.any(src1d > th_nonzero) and np.any(dest1d > th_nonzero):
-                    # retrieve min/max of non-zeros elements (edge of the segmentation)
-                    # src1d_min, src1d_max = min(np.nonzero(src1d)[0]), max(np.nonzero(src1d)[0])
-                    # dest1d_min, dest1d_max = min(np.nonzero(dest1d)[0]), max(np.nonzero(dest1d)[0])
-                    # 1D matching between src_y and dest_y
-                    # Ty = (dest1d_max + dest1d_min)/2 - (src1d_max + src1d_min)/2
-                    # Sy = (dest1d_max - dest1d_min) / float(src1d_max - src1d_min)
-                    # apply translation and scaling to coordinates in column
-                    # get indices (in continuous space) at half-maximum of upward and downward slope
-                    # src1d_min, src1d_max = find_index_halfmax(src1d)
-                    # dest1d_min, dest1d_max = find_index_halfmax(dest1d)
-                    src1d_min, src1d_max = np.min(np.where(src1d > th_nonzero)), np.max(np.where(src1d > th_nonzero))
-                    dest1d_min, dest1d_max = np.min(np.where(dest1d > th_nonzero)), np.max(np.where(dest1d > th_nonzero))
-                    # 1D matching between src_y and dest_y
-                    mean_dest_y = (dest1d_max + dest1d_min) / 2
-                    mean_src_y = (src1d_max + src1d_min) / 2
-                    # Tx = (dest1d_max + dest1d_min)/2 - (src1d_max + src1d_min)/2
-                    Sy = (dest1d_max - dest1d_min + 1) / float(src1d_max - src1d_min + 1)
-                    # apply forward transformation (in pixel space)
-                    # below: only for debugging purpose
-                    # coord_src2d_scaleX = np.copy(coord_src2d)  # need to use np.copy to avoid copying pointer
-                    # coord_src2d_scaleX[:, 0] = (coord_src2d[:, 0] - mean_src) * Sx + mean_dest
-                    # coord_init_pix_scaleY = np.copy(coord_init_pix)  # need to use np.copy to avoid copying pointer
-                    # coord_init_pix_scaleY[:, 0] = (coord_init_pix[:, 0] - mean_src ) * Sx + mean_dest
-                    range_x = list(range(ix * ny, ix * ny + nx))
-                    coord_init_pix_scaleY[range_x, 1] = (coord_init_pix[range_x, 1] - mean_src_y) * Sy + mean_dest_y
-                    coord_init_pix_scaleYinv[range_x, 1] = (coord_init_pix[range_x, 1] - mean_dest_y) / float(Sy) + mean_src_y
+
+    # SCALING R-L (X dimension)
+    # ============================================================
+    # sum data across Y to obtain 1D signal per slice: src1d and dest1d have dimension (nx, nz)
+    src1d = np.sum(data_src, 1)
+    dest1d = np.sum(data_dest, 1)
+    # make sure there are non-zero data in src or dest
+    valid_z = np.any(src1d > th_nonzero, 0) & np.any(dest1d > th_nonzero, 0)
+    # retrieve min/max of non-zeros elements (edge of the segmentation)
+    src1d_min, src1d_max = find_index_nonzero(src1d != 0, 0)
+    dest1d_min, dest1d_max = find_index_nonzero(dest1d != 0, 0)
+    # 1D matching between src_x and dest_x
+    mean_dest_x = np.where(valid_z, (dest1d_max + dest1d_min) / 2, 0)
+    mean_src_x = np.where(valid_z, (src1d_max + src1d_min) / 2, 0)
+    # compute x-scaling factor
+    Sx = np.where(valid_z, (dest1d_max - dest1d_min + 1) / (src1d_max - src1d_min + 1).astype(float), 1)
+    # apply transformation to coordinates
+    row_scaleX = (row - mean_src_x) * Sx + mean_dest_x
+    row_scaleXinv = (row - mean_dest_x) / Sx + mean_src_x
+    # apply transformation to image (slices are left unchanged along z)
+    data_src_scaleX = warp(data_src, np.array([row_scaleXinv, col, coord_z]), order=1)
+
+    # ============================================================
+    # COLUMN-WISE REGISTRATION (Y dimension for each Xi)
+    # ============================================================
+    # retrieve 1D signal along Y for each column (X and Z dimensions)
+    mask_src = data_src_scaleX > th_nonzero
+    mask_dest = data_dest > th_nonzero
+    # make sure there are non-zero data in src or dest
+    valid_xz = np.any(mask_src, 1) & np.any(mask_dest, 1) & valid_z
+    # retrieve min/max of non-zeros elements (edge of the segmentation)
+    src1d_min, src1d_max = find_index_nonzero(mask_src, 1)
+    dest1d_min, dest1d_max = find_index_nonzero(mask_dest, 1)
+    # 1D matching between src_y and dest_y
+    mean_dest_y = np.where(valid_xz, (dest1d_max + dest1d_min) / 2, 0)[:, np.newaxis, :]
+    mean_src_y = np.where(valid_xz, (src1d_max + src1d_min) / 2, 0)[:, np.newaxis, :]
+    Sy = np.where(valid_xz, (dest1d_max - dest1d_min + 1) / (src1d_max - src1d_min + 1).astype(float), 1)[:, np.newaxis, :]
+    # apply translation and scaling to coordinates in column (columns without data are left unchanged)
+    col_scaleY = (col - mean_src_y) * Sy + mean_dest_y
+    col_scaleYinv = (col - mean_dest_y) / Sy + mean_src_y
+    # regularize Y warping fields (in-plane)
+    col_scaleYsmooth = ndimage.gaussian_filter(col_scaleY, [smoothWarpXY, smoothWarpXY, 0], mode='nearest')
+    col_scaleYinvsmooth = ndimage.gaussian_filter(col_scaleYinv, [smoothWarpXY, smoothWarpXY, 0], mode='nearest')
+
+    # display
+    if verbose == 2:
+        for iz in np.where(valid_z)[0]:
+            src2d = data_src[:, :, iz]
+            dest2d = data_dest[:, :, iz]
+            src2d_scaleX = data_src_scaleX[:, :, iz]
             # apply transformation to image
-            col_scaleYinv = np.reshape(coord_init_pix_scaleYinv[:, 1], [nx, ny])
-            src2d_scaleXY = warp(src2d, np.array([row_scaleXinv, col_scaleYinv]), order=1)
-            # regularize Y warping fields
-            from skimage.filters import gaussian
-            col_scaleY = np.reshape(coord_init_pix_scaleY[:, 1], [nx, ny])
-            col_scaleYsmooth = gaussian(col_scaleY, smoothWarpXY)
-            col_scaleYinvsmooth = gaussian(col_scaleYinv, smoothWarpXY)
+            src2d_scaleXY = warp(src2d, np.array([row_scaleXinv[:, :, iz], col_scaleYinv[:, :, iz]]), order=1)
             # apply smoothed transformation to image
-            src2d_scaleXYsmooth = warp(src2d, np.array([row_scaleXinv, col_scaleYinvsmooth]), order=1)
-            # reshape warping field as 1d
-            coord_init_pix_scaleY[:, 1] = col_scaleYsmooth.ravel()
-            coord_init_pix_scaleYinv[:, 1] = col_scaleYinvsmooth.ravel()
-            # display
-            if verbose == 2:
-                # FIG 1
-                plt.figure(figsize=(15, 3))
-                # plot #1
-                ax = plt.subplot(141)
-                plt.imshow(np.swapaxes(src2d, 1, 0), cmap=plt.cm.gray, interpolation='none')
-                plt.hold(True)  # add other layer
-                plt.imshow(np.swapaxes(dest2d, 1, 0), cmap=plt.cm.copper, interpolation='none', alpha=0.5)
-                plt.title('src')
-                plt.xlabel('x')
-                plt.ylabel('y')
-                plt.xlim(mean_dest_x - 15, mean_dest_x + 15)
-                plt.ylim(mean_dest_y - 15, mean_dest_y + 15)
-                ax.grid(True, color='w')
-                # plot #2
-                ax = plt.subplot(142)
-                plt.imshow(np.swapaxes(src2d_scaleX, 1, 0), cmap=plt.cm.gray, interpolation='none')
-                plt.hold(True)  # add other layer
+            src2d_scaleXYsmooth = warp(src2d, np.array([row_scaleXinv[:, :, iz], col_scaleYinvsmooth[:, :, iz]]), order=1)
+            # center display on the last registered column
+            mean_dest_x_iz = mean_dest_x[iz]
+            mean_dest_y_iz = mean_dest_y[np.where(valid_xz[:, iz])[0][-1], 0, iz] if np.any(valid_xz[:, iz]) else ny / 2
+            # FIG 1
+            plt.figure(figsize=(15, 3))
+            for isub, (img, title) in enumerate([(src2d, 'src'),
+                                                 (src2d_scaleX, 'src_scaleX'),
+                                                 (src2d_scaleXY, 'src_scaleXY'),
+                                                 (src2d_scaleXYsmooth, 'src_scaleXYsmooth (s=' + str(smoothWarpXY) + ')')]):
+                ax = plt.subplot(141 + isub)
+                plt.imshow(np.swapaxes(img, 1, 0), cmap=plt.cm.gray, interpolation='none')
                 plt.imshow(np.swapaxes(dest2d, 1, 0), cmap=plt.cm.copper, interpolation='none', alpha=0.5)
-                plt.title('src_scaleX')
+                plt.title(title)
                 plt.xlabel('x')
                 plt.ylabel('y')
-                plt.xlim(mean_dest_x - 15, mean_dest_x + 15)
-                plt.ylim(mean_dest_y - 15, mean_dest_y + 15)
+                plt.xlim(mean_dest_x_iz - 15, mean_dest_x_iz + 15)
+                plt.ylim(mean_dest_y_iz - 15, mean_dest_y_iz + 15)
                 ax.grid(True, color='w')
-                # plot #3
-                ax = plt.subplot(143)
-                plt.imshow(np.swapaxes(src2d_scaleXY, 1, 0), cmap=plt.cm.gray, interpolation='none')
-                plt.hold(True)  # add other layer
-                plt.imshow(np.swapaxes(dest2d, 1, 0), cmap=plt.cm.copper, interpolation='none', alpha=0.5)
-                plt.title('src_scaleXY')
-                plt.xlabel('x')
-                plt.ylabel('y')
-                plt.xlim(mean_dest_x - 15, mean_dest_x + 15)
-                plt.ylim(mean_dest_y - 15, mean_dest_y + 15)
-                ax.grid(True, color='w')
-                # plot #4
-                ax = plt.subplot(144)
-                plt.imshow(np.swapaxes(src2d_scaleXYsmooth, 1, 0), cmap=plt.cm.gray, interpolation='none')
-                plt.hold(True)  # add other layer
-                plt.imshow(np.swapaxes(dest2d, 1, 0), cmap=plt.cm.copper, interpolation='none', alpha=0.5)
-                plt.title('src_scaleXYsmooth (s=' + str(smoothWarpXY) + ')')
-                plt.xlabel('x')
-                plt.ylabel('y')
-                plt.xlim(mean_dest_x - 15, mean_dest_x + 15)
-                plt.ylim(mean_dest_y - 15, mean_dest_y + 15)
-                ax.grid(True, color='w')
-                # save figure
-                plt.savefig(os.path.join(path_qc, 'register2d_columnwise_image_z' + str(iz) + '.png'))
-                plt.close()
-
-            # ============================================================
-            # CALCULATE TRANSFORMATIONS
-            # ============================================================
-            # calculate forward transformation (in physical space)
-            coord_init_phy_scaleX = np.array(im_dest.transfo_pix2phys(coord_init_pix_scaleX))
-            coord_init_phy_scaleY = np.array(im_dest.transfo_pix2phys(coord_init_pix_scaleY))
-            # calculate inverse transformation (in physical space)
-            coord_init_phy_scaleXinv = np.array(im_src.transfo_pix2phys(coord_init_pix_scaleXinv))
-            coord_init_phy_scaleYinv = np.array(im_src.transfo_pix2phys(coord_init_pix_scaleYinv))
-            # compute displacement per pixel in destination space (for forward warping field)
-            warp_x[:, :, iz] = np.array([coord_init_phy_scaleXinv[i, 0] - coord_init_phy[i, 0] for i in range(nx * ny)]).reshape((nx, ny))
-            warp_y[:, :, iz] = np.array([coord_init_phy_scaleYinv[i, 1] - coord_init_phy[i, 1] for i in range(nx * ny)]).reshape((nx, ny))
-            # compute displacement per pixel in source space (for inverse warping field)
-            warp_inv_x[:, :, iz] = np.array([coord_init_phy_scaleX[i, 0] - coord_init_phy[i, 0] for i in range(nx * ny)]).reshape((nx, ny))
-            warp_inv_y[:, :, iz] = np.array([coord_init_phy_scaleY[i, 1] - coord_init_phy[i, 1] for i in range(nx * ny)]).reshape((nx, ny))
+            # save figure
+            plt.savefig(os.path.join(path_qc, 'register2d_columnwise_image_z' + str(iz) + '.png'))
+            plt.close()
+
+    # ============================================================
+    # CALCULATE TRANSFORMATIONS
+    # ============================================================
+    # physical coordinates are not computed: the voxel-to-world transformations are affine, so that displacements in
+    # physical space are phys(p') - phys(p) = A.(p' - p), and pixels are only moved along x (scaling R-L) or y (columns)
+    affine_src = im_src.hdr.get_best_affine()
+    affine_dest = im_dest.hdr.get_best_affine()
+    # compute displacement per pixel in destination space (for forward warping field)
+    warp_x = affine_src[0, 0] * (row_scaleXinv - row)
+    warp_y = affine_src[1, 1] * (col_scaleYinvsmooth - col)
+    # compute displacement per pixel in source space (for inverse warping field), with phys_dest(p) - phys_src(p) if
+    # the grids differ
+    warp_inv_x = affine_dest[0, 0] * (row_scaleX - row)
+    warp_inv_y = affine_dest[1, 1] * (col_scaleYsmooth - col)
+    diff_affine = affine_dest - affine_src
+    if np.any(diff_affine[:2]):
+        warp_inv_x += diff_affine[0, 0] * row + diff_affine[0, 1] * col + diff_affine[0, 2] * coord_z + diff_affine[0, 3]
+        warp_inv_y += diff_affine[1, 0] * row + diff_affine[1, 1] * col + diff_affine[1, 2] * coord_z + diff_affine[1, 3]
+    # slices without data are not registered
+    for warp_field in [warp_x, warp_y, warp_inv_x, warp_inv_y]:
+        warp_field[:, :, ~valid_z] = 0
 
     # Generate forward warping field (defined in destination space)
-    generate_warping_field(fname_dest, warp_x, warp_y, fname_warp, verbose)
+    generate_warping_field(fname_dest, warp_x.reshape(data_dest.shape), warp_y.reshape(data_dest.shape), fname_warp, verbose,
+                           compresslevel=0)
     # Generate inverse warping field (defined in source space)
-    generate_warping_field(fname_src, warp_inv_x, warp_inv_y, fname_warp_inv, verbose)
+    generate_warping_field(fname_src, warp_inv_x.reshape(data_src.shape), warp_inv_y.reshape(data_src.shape), fname_warp_inv, verbose,
+                           compresslevel=0)
 
 
 def register2d(fname_src, fname_dest, fname_mask='', fname_warp='warp_forward.nii.gz', fname_warp_inv='warp_inverse.nii.gz', paramreg=Paramreg(step='0', type='im', algo='Translation', metric='MI', iter='5', shrink='1', smooth='0', gradStep='0.5'),
                     ants_registration_params={'rigid': '', 'affine': '', 'compositeaffine': '', 'similarity': '', 'translation': '', 'bspline': ',10', 'gaussiandisplacementfield': ',3,0',
-                                              'bsplinedisplacementfield': ',5,10', 'syn': ',3,0', 'bsplinesyn': ',1,3'}, verbose=0):
+                                              'bsplinedisplacementfield': ',5,10', 'syn': ',3,0', 'bsplinesyn': ',1,3'}, verbose=0, n_jobs=None,
+                    identity_on_failure=False):
     """Slice-by-slice registration of two images.
 
     We first split the 3D images into 2D images (and the mask if inputted). Then we register slices of the two images
@@ -674,6 +529,10 @@ def register2d(fname_src, fname_dest, fname_mask='', fname_warp='warp_forward.ni
         fname_warp_inv: name of output 3d inverse warping field
         paramreg[optional]: parameters of antsRegistration (type: Paramreg class from sct_register_multimodal)
         ants_registration_params[optional]: specific algorithm's parameters for antsRegistration (type: dictionary)
+        n_jobs[optional]: number of slices registered simultaneously, which share the ITK threads (type: int). Default
+            is the value of ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS, or the number of CPUs (i.e. one ITK thread per slice).
+        identity_on_failure[optional]: if a slice fails to register, use the identity transformation for this slice
+            instead of stopping with an error (type: bool)
 
     output:
         if algo==translation:
@@ -729,19 +588,13 @@ def register2d(fname_src, fname_dest, fname_mask='', fname_warp='warp_forward.ni
     # [x_o, y_o, z_o] = [coord_diff_origin[0] * 1.0/px, coord_diff_origin[1] * 1.0/py, coord_diff_origin[2] * 1.0/pz]
 
     # initialization
-    if paramreg.algo in ['Translation']:
-        x_displacement = [0 for i in range(nz)]
-        y_displacement = [0 for i in range(nz)]
-        theta_rotation = [0 for i in range(nz)]
-    if paramreg.algo in ['Rigid', 'Affine', 'BSplineSyN', 'SyN']:
-        list_warp = []
-        list_warp_inv = []
+    if n_jobs is None:
+        n_jobs = int(os.environ.get('ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS', cpu_count()))
+    list_num = [numerotation(i) for i in range(nz)]
 
-    # loop across slices
-    for i in range(nz):
-        # set masking
-        sct.printv('Registering slice ' + str(i) + '/' + str(nz - 1) + '...', verbose)
-        num = numerotation(i)
+    # prepare registration of each slice
+    list_cmd = []
+    for num in list_num:
         prefix_warp2d = 'warp2d_' + num
         # if mask is used, prepare command for ANTs
         if fname_mask != '':
@@ -765,10 +618,29 @@ def register2d(fname_src, fname_dest, fname_mask='', fname_warp='warp_forward.ni
         if not paramreg.init == '':
             init_dict = {'geometric': '0', 'centermass': '1', 'origin': '2'}
             cmd += ['-r', '[dest_Z' + num + '.nii' + ',src_Z' + num + '.nii,' + init_dict[paramreg.init] + ']']
+        list_cmd.append(cmd)
+
+    # run registrations in parallel
+    sct.printv('\nRegister ' + str(nz) + ' slices (' + str(n_jobs) + ' jobs)...', verbose)
+    list_error = [sct.RunError(output) if status != 0 else None for status, output in
+                  sct.run_many(list_cmd, n_jobs=n_jobs, raise_exception=False, is_sct_binary=True)]
+
+    # gather results in slice order, so that failures are handled the same way regardless of scheduling
+    if paramreg.algo in ['Translation']:
+        x_displacement = [0 for i in range(nz)]
+        y_displacement = [0 for i in range(nz)]
+        theta_rotation = [0 for i in range(nz)]
+    if paramreg.algo in ['Rigid', 'Affine']:
+        list_affine = [None for i in range(nz)]
+    if paramreg.algo in ['BSplineSyN', 'SyN']:
+        list_warp = []
+        list_warp_inv = []
 
+    for i, num in enumerate(list_num):
+        prefix_warp2d = 'warp2d_' + num
         try:
-            # run registration
-            sct.run(cmd, is_sct_binary=True)
+            if list_error[i] is not None:
+                raise list_error[i]
 
             if paramreg.algo in ['Translation']:
                 file_mat = prefix_warp2d + '0GenericAffine.mat'
@@ -778,35 +650,25 @@ def register2d(fname_src, fname_dest, fname_mask='', fname_warp='warp_forward.ni
                 y_displacement[i] = array_transfo[5][0]  # Ty  in ITK'S and fslview's coordinate systems
                 theta_rotation[i] = asin(array_transfo[2])  # angle of rotation theta in ITK'S coordinate system (minus theta for fslview)
 
-            if paramreg.algo in ['Rigid', 'Affine', 'BSplineSyN', 'SyN']:
-                # List names of 2d warping fields for subsequent merge along Z
-                file_warp2d = prefix_warp2d + '0Warp.nii.gz'
-                file_warp2d_inv = prefix_warp2d + '0InverseWarp.nii.gz'
-                list_warp.append(file_warp2d)
-                list_warp_inv.append(file_warp2d_inv)
-
             if paramreg.algo in ['Rigid', 'Affine']:
-                # Generating null 2d warping field (for subsequent concatenation with affine transformation)
-                # TODO fixup isct_ants* parsers
-                sct.run(['isct_antsRegistration',
-                 '-d', '2',
-                 '-t', 'SyN[1,1,1]',
-                 '-c', '0',
-                 '-m', 'MI[dest_Z' + num + '.nii,src_Z' + num + '.nii,1,32]',
-                 '-o', 'warp2d_null',
-                 '-f', '1',
-                 '-s', '0',
-                ], is_sct_binary=True)
-                # --> outputs: warp2d_null0Warp.nii.gz, warp2d_null0InverseWarp.nii.gz
-                file_mat = prefix_warp2d + '0GenericAffine.mat'
-                # Concatenating mat transfo and null 2d warping field to obtain 2d warping field of affine transformation
-                sct.run(['isct_ComposeMultiTransform', '2', file_warp2d, '-R', 'dest_Z' + num + '.nii', 'warp2d_null0Warp.nii.gz', file_mat], is_sct_binary=True)
-                sct.run(['isct_ComposeMultiTransform', '2', file_warp2d_inv, '-R', 'src_Z' + num + '.nii', 'warp2d_null0InverseWarp.nii.gz', '-i', file_mat], is_sct_binary=True)
+                list_affine[i] = read_affine_2d(prefix_warp2d + '0GenericAffine.mat')
+
+            if paramreg.algo in ['BSplineSyN', 'SyN']:
+                # List names of 2d warping fields for subsequent merge along Z
+                list_warp.append(prefix_warp2d + '0Warp.nii.gz')
+                list_warp_inv.append(prefix_warp2d + '0InverseWarp.nii.gz')
 
-        # if an exception occurs with ants, take the last value for the transformation
-        # TODO: DO WE NEED TO DO THAT??? (julien 2016-03-01)
+        # if an exception occurs with ants, stop, or use identity transformation for this slice if requested
         except Exception as e:
-            sct.printv('ERROR: Exception occurred.\n' + str(e), 1, 'error')
+            if not identity_on_failure:
+                sct.printv('ERROR: Registration failed for slice ' + str(i) + '/' + str(nz - 1) + '.\n' + str(e), 1,
+                           'error')
+                raise
+            sct.printv('WARNING: Registration failed for slice ' + str(i) + '/' + str(nz - 1) + ', using identity '
+                       'transformation.\n' + str(e), 1, 'warning')
+            if paramreg.algo in ['BSplineSyN', 'SyN']:
+                list_warp.append(None)
+                list_warp_inv.append(None)
 
     # Merge warping field along z
     sct.printv('\nMerge warping fields along z...', verbose)
@@ -817,15 +679,34 @@ def register2d(fname_src, fname_dest, fname_mask='', fname_warp='warp_forward.ni
         y_disp_a = np.asarray(y_displacement)
         theta_rot_a = np.asarray(theta_rotation)
         # Generate warping field
-        generate_warping_field('dest.nii', x_disp_a, y_disp_a, fname_warp=fname_warp)  #name_warp= 'step'+str(paramreg.step)
+        generate_warping_field('dest.nii', x_disp_a, y_disp_a, fname_warp=fname_warp, compresslevel=0)  #name_warp= 'step'+str(paramreg.step)
         # Inverse warping field
-        generate_warping_field('src.nii', -x_disp_a, -y_disp_a, fname_warp=fname_warp_inv)
+        generate_warping_field('src.nii', -x_disp_a, -y_disp_a, fname_warp=fname_warp_inv, compresslevel=0)
 
-    if paramreg.algo in ['Rigid', 'Affine', 'BSplineSyN', 'SyN']:
+    if paramreg.algo in ['Rigid', 'Affine']:
+        # convert affine transformations into displacement fields, on the grid of each image
+        generate_warping_field_affine('dest.nii', list_affine, fname_warp=fname_warp, verbose=verbose,
+                                      compresslevel=0)
+        generate_warping_field_affine('src.nii', list_affine, fname_warp=fname_warp_inv, inverse=True, verbose=verbose,
+                                      compresslevel=0)
+
+    if paramreg.algo in ['BSplineSyN', 'SyN']:
         from sct_image import concat_warp2d
         # concatenate 2d warping fields along z
-        concat_warp2d(list_warp, fname_warp, 'dest.nii')
-        concat_warp2d(list_warp_inv, fname_warp_inv, 'src.nii')
+        concat_warp2d(list_warp, fname_warp, 'dest.nii', compresslevel=0)
+        concat_warp2d(list_warp_inv, fname_warp_inv, 'src.nii', compresslevel=0)
+
+
+def read_affine_2d(fname_mat):
+    """
+    Read a 2d affine transformation generated by antsRegistration.
+    :param fname_mat: .mat file
+    :return: matrix (2x2), translation (2,), center (2,), in ITK's coordinate system (LPS)
+    """
+    matfile = loadmat(fname_mat, struct_as_record=True)
+    key = [k for k in matfile if k.startswith('AffineTransform_')][0]
+    param = matfile[key].ravel()
+    return param[:4].reshape(2, 2), param[4:6], matfile['fixed'].ravel()
 
 
 def numerotation(nb):
@@ -856,39 +737,28 @@ def numerotation(nb):
     return nb_output
 
 
-def generate_warping_field(fname_dest, warp_x, warp_y, fname_warp='warping_field.nii.gz', verbose=1):
+def generate_warping_field(fname_dest, warp_x, warp_y, fname_warp='warping_field.nii.gz', verbose=1, compresslevel=None):
     """
-    Generate an ITK warping field
+    Generate an ITK warping field (float32). The field is written slice by slice, through a memory map if fname_warp
+    is an uncompressed .nii file.
     :param fname_dest:
     :param warp_x:
     :param warp_y:
     :param fname_warp:
     :param verbose:
+    :param compresslevel: gzip compression level of .nii.gz fields (0 for intermediate files), see
+    DisplacementFieldWriter
     :return:
     """
     sct.printv('\nGenerate warping field...', verbose)
 
-    # Get image dimensions
-    # sct.printv('Get destination dimension', verbose)
-    nx, ny, nz, nt, px, py, pz, pt = Image(fname_dest).dim
-    # sct.printv('  matrix size: '+str(nx)+' x '+str(ny)+' x '+str(nz), verbose)
-    # sct.printv('  voxel size:  '+str(px)+'mm x '+str(py)+'mm x '+str(pz)+'mm', verbose)
-
-    # initialize
-    data_warp = np.zeros((nx, ny, nz, 1, 3))
-
-    # fill matrix
-    data_warp[:, :, :, 0, 0] = -warp_x  # need to invert due to ITK conventions
-    data_warp[:, :, :, 0, 1] = -warp_y  # need to invert due to ITK conventions
-
     # save warping field
-    im_dest = load(fname_dest)
-    hdr_dest = im_dest.get_header()
-    hdr_warp = hdr_dest.copy()
-    hdr_warp.set_intent('vector', (), '')
-    hdr_warp.set_data_dtype('float32')
-    img = Nifti1Image(data_warp, None, hdr_warp)
-    save(img, fname_warp)
+    with DisplacementFieldWriter(fname_warp, load(fname_dest).header, compresslevel) as writer:
+        # displacements can also be given per slice (arrays of size nz)
+        warp_x, warp_y = np.broadcast_to(warp_x, writer.data.shape[:3]), np.broadcast_to(warp_y, writer.data.shape[:3])
+        for iz in range(writer.data.shape[2]):
+            writer.data[:, :, iz, 0, 0] = -warp_x[:, :, iz]  # need to invert due to ITK conventions
+            writer.data[:, :, iz, 0, 1] = -warp_y[:, :, iz]  # need to invert due to ITK conventions
     sct.printv(' --> ' + fname_warp, verbose)
 
     #
@@ -938,6 +808,48 @@ def generate_warping_field(fname_dest, warp_x, warp_y, fname_warp='warping_field
     # sct.printv('\nDone! Warping field generated: '+fname, verbose)
 
 
+def generate_warping_field_affine(fname_dest, list_affine, fname_warp='warping_field.nii.gz', inverse=False, verbose=1,
+                                  compresslevel=None):
+    """
+    Generate an ITK warping field (float32) from slice-wise 2d affine transformations. Displacements are computed
+    analytically on the voxel grid of fname_dest, and written slice by slice (through a memory map if fname_warp is an
+    uncompressed .nii file).
+    :param fname_dest: image defining the grid of the warping field
+    :param list_affine: list (one element per slice) of (matrix, translation, center) as returned by read_affine_2d, or
+    None for identity
+    :param fname_warp:
+    :param inverse: bool: generate the warping field of the inverse transformations
+    :param verbose:
+    :param compresslevel: gzip compression level of .nii.gz fields, see DisplacementFieldWriter
+    :return:
+    """
+    sct.printv('\nGenerate warping field...', verbose)
+
+    im_dest = load(fname_dest)
+    nx, ny, nz = im_dest.shape[:3]
+    hdr_dest = im_dest.header
+
+    # in-plane physical coordinates of the voxel grid, in ITK's coordinate system (LPS)
+    row, col = np.indices((nx, ny))
+    affine_dest = hdr_dest.get_best_affine()
+    coord_phy = -(np.dot(affine_dest[:2, :2], [row.ravel(), col.ravel()]) + affine_dest[:2, 3:])
+
+    # save warping field (identity for missing slices)
+    with DisplacementFieldWriter(fname_warp, hdr_dest, compresslevel) as writer:
+        for iz, affine in enumerate(list_affine):
+            if affine is None:
+                continue
+            matrix, translation, center = affine[0], np.reshape(affine[1], (2, 1)), np.reshape(affine[2], (2, 1))
+            if inverse:
+                # T^-1(p) = A^-1.(p - c - t) + c
+                matrix = np.linalg.inv(matrix)
+                translation = -np.dot(matrix, translation)
+            # displacement: T(p) - p = A.(p - c) + t + c - p
+            displacement = np.dot(matrix, coord_phy - center) + translation + center - coord_phy
+            writer.data[:, :, iz, 0, :2] = displacement.T.reshape(nx, ny, 2)
+    sct.printv(' --> ' + fname_warp, verbose)
+
+
 def angle_between(a, b):
     """
     compute angle in radian between a and b. Throws an exception if a or b has zero magnitude.
@@ -993,6 +905,48 @@ def compute_pca(data2d):
     return coordsrc, pca, centermass
 
 
+def compute_pca_slicewise(data3d):
+    """
+    Compute the PCA of the non-zero coordinates of each axial slice, for all slices at once. Gives the same center of
+    mass, principal axes and explained variance ratio as compute_pca() on each slice.
+    :param data3d: 3d array. PCA will be computed on non-zeros values (after rounding).
+    :return:
+        centermass: nz x 2 array: 2d coordinates of the center of mass, nan for slices with less than two non-zero
+        voxels (for which compute_pca() fails)
+        eigenvectors: nz x 2 x 2 array: principal axes (in columns), by decreasing variance
+        eigenvalues: nz x 2 array: variance along the principal axes, in decreasing order
+    """
+    nz = data3d.shape[2]
+    x, y, z = np.nonzero(np.round(data3d))
+    # per-slice moments of the non-zero coordinates
+    count = np.bincount(z, minlength=nz).astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centermass = np.c_[np.bincount(z, x, nz), np.bincount(z, y, nz)] / count[:, None]
+        dx, dy = x - centermass[z, 0], y - centermass[z, 1]
+        covariance = np.empty((nz, 2, 2))
+        covariance[:, 0, 0] = np.bincount(z, dx * dx, nz) / count
+        covariance[:, 0, 1] = covariance[:, 1, 0] = np.bincount(z, dx * dy, nz) / count
+        covariance[:, 1, 1] = np.bincount(z, dy * dy, nz) / count
+    centermass[count < 2] = np.nan
+    covariance[count < 2] = np.eye(2)
+    # eigendecomposition of all 2x2 covariance matrices, sorted by decreasing eigenvalue
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    eigenvalues[count < 2] = np.nan
+    return centermass, eigenvectors[:, :, ::-1], eigenvalues[:, ::-1]
+
+
+def find_index_nonzero(mask, axis):
+    """
+    Find the first and last non-zero indices of a boolean array along an axis.
+    :param mask: boolean array
+    :param axis: int
+    :return: index_min, index_max: arrays with the dimension of mask along all other axes (0 where mask is empty)
+    """
+    index_min = np.argmax(mask, axis)
+    index_max = mask.shape[axis] - 1 - np.argmax(np.flip(mask, axis), axis)
+    return index_min, index_max
+
+
 def find_index_halfmax(data1d):
     """
     Find the two indices at half maximum for a bell-type curve (non-parametric). Uses center of mass calculation.
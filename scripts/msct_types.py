@@ -19,7 +19,6 @@ from __future__ import division, absolute_import
 from numpy import dot, cross, array, dstack, einsum, tile, multiply, stack, rollaxis, zeros
 from numpy.linalg import norm, inv
 import numpy as np
-from scipy.spatial import cKDTree
 
 
 class Point(object):
@@ -225,6 +224,7 @@ class Centerline:
         self.offset_plans = array([item[3] for item in self.plans_parameters])
 
         # initialization of KDTree for enabling computation of nearest points in centerline
+        from scipy.spatial import cKDTree
         self.tree_points = cKDTree(self.points)
 
         if self.compute_init_distribution:
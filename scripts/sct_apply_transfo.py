@@ -17,6 +17,10 @@
 from __future__ import division, absolute_import
 
 import sys, io, os, time, functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from multiprocessing import cpu_count
+
+import numpy as np
 
 from msct_parser import Parser
 import sct_utils as sct
@@ -37,7 +41,8 @@ class Param:
 def get_parser():
     # parser initialisation
     parser = Parser(__file__)
-    parser.usage.set_description('Apply transformations. This function is a wrapper for antsApplyTransforms (ANTs).')
+    parser.usage.set_description('Apply transformations. Chains of warping fields and affine transformations are applied'
+                                 ' directly. Other transformations are applied with antsApplyTransforms (ANTs).')
     parser.add_option(name="-i",
                       type_value="file",
                       description="input image",
@@ -82,6 +87,13 @@ def get_parser():
                       mandatory=False,
                       default_value='1',
                       example=['0', '1'])
+    parser.add_option(name="-j",
+                      type_value="int",
+                      description="Number of volumes of 4D data transformed simultaneously. By default, all available"
+                                  " CPU cores will be used, and the threads of each transformation are divided"
+                                  " among volumes. Set to 1 for no parallel processing.",
+                      mandatory=False,
+                      example='4')
     parser.add_option(name="-v",
                       type_value="multiple_choice",
                       description="""Verbose.""",
@@ -93,7 +105,7 @@ def get_parser():
 
 
 class Transform:
-    def __init__(self, input_filename, warp, fname_dest, output_filename='', verbose=0, crop=0, interp='spline', remove_temp_files=1, debug=0):
+    def __init__(self, input_filename, warp, fname_dest, output_filename='', verbose=0, crop=0, interp='spline', remove_temp_files=1, debug=0, n_jobs=None):
         self.input_filename = input_filename
         if isinstance(warp, str):
             self.warp_input = list([warp])
@@ -106,8 +118,11 @@ class Transform:
         self.verbose = verbose
         self.remove_temp_files = remove_temp_files
         self.debug = debug
+        self.n_jobs = n_jobs
 
     def apply(self):
+        from spinalcordtoolbox import warp
+
         # Initialization
         fname_src = self.input_filename  # source image (moving)
         fname_warp_list = self.warp_input  # list of warping fields
@@ -153,6 +168,7 @@ class Transform:
 
         # N.B. Here we take the inverse of the warp list, because sct_WarpImageMultiTransform concatenates in the reverse order
         fname_warp_list_invert.reverse()
+        list_transfo = [(transfo[-1], len(transfo) == 2) for transfo in fname_warp_list_invert]
         fname_warp_list_invert = functools.reduce(lambda x,y: x+y, fname_warp_list_invert)
 
         # Extract path, file and extension
@@ -173,8 +189,15 @@ class Transform:
         # nx, ny, nz, nt, px, py, pz, pt = sct.get_dimension(fname_src)
         sct.printv('  ' + str(nx) + ' x ' + str(ny) + ' x ' + str(nz) + ' x ' + str(nt), verbose)
 
+        # apply the chain of transformations directly, to all volumes at once
+        if nz not in [0, 1] and warp.is_supported(list_transfo):
+            sct.printv('\nApply transformation...', verbose)
+            warp.apply_transforms(fname_src, fname_dest, list_transfo, fname_out,
+                                  interp={'nn': 'NearestNeighbor', 'linear': 'Linear', 'spline': 'BSpline'}[self.interp],
+                                  n_jobs=self.n_jobs)
+
         # if 3d
-        if nt == 1:
+        elif nt == 1:
             # Apply transformation
             sct.printv('\nApply transformation...', verbose)
             if nz in [0, 1]:
@@ -192,16 +215,18 @@ class Transform:
 
         # if 4d, loop across the T dimension
         else:
-            path_tmp = sct.tmp_create(basename="apply_transfo", verbose=verbose)
+            # input and its volumes, registered volumes and output (float32)
+            path_tmp = sct.tmp_create(basename="apply_transfo", verbose=verbose,
+                                      size=2 * img_src.data.nbytes + 2 * nt * sct.nifti_nbytes(fname_dest, itemsize=4))
 
             # convert to nifti into temp folder
             sct.printv('\nCopying input data to tmp folder and convert to nii...', verbose)
             img_src.save(os.path.join(path_tmp, "data.nii"))
-            sct.copy(fname_dest, os.path.join(path_tmp, file_dest + ext_dest))
+            sct.link(fname_dest, os.path.join(path_tmp, file_dest + ext_dest))
             fname_warp_list_tmp = []
             for fname_warp in fname_warp_list:
                 path_warp, file_warp, ext_warp = sct.extract_fname(fname_warp)
-                sct.copy(fname_warp, os.path.join(path_tmp, file_warp + ext_warp))
+                sct.link(fname_warp, os.path.join(path_tmp, file_warp + ext_warp))
                 fname_warp_list_tmp.append(file_warp + ext_warp)
             fname_warp_list_invert_tmp = fname_warp_list_tmp[::-1]
 
@@ -216,32 +241,45 @@ class Transform:
             data_split_list = sct_image.split_data(im_dat, 3)
             for im in data_split_list:
                 im.save()
+            del im_dat, data_split_list
 
-            # apply transfo
-            sct.printv('\nApply transformation to each 3D volume...', verbose)
-            for it in range(nt):
-                file_data_split = 'data_T' + str(it).zfill(4) + '.nii'
-                file_data_split_reg = 'data_reg_T' + str(it).zfill(4) + '.nii'
+            # apply transfo, to several volumes at once: ITK threads are divided among volumes
+            n_jobs = min(self.n_jobs or cpu_count(), nt)
+            env = dict(os.environ)
+            env['ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS'] = str(max(1, int(
+                os.environ.get('ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS', cpu_count())) // n_jobs))
 
-                status, output = sct.run(['isct_antsApplyTransforms',
+            def apply_volume(it):
+                file_data_split_reg = 'data_reg_T' + str(it).zfill(4) + '.nii'
+                sct.run(['isct_antsApplyTransforms',
                   '-d', '3',
-                  '-i', file_data_split,
+                  '-i', 'data_T' + str(it).zfill(4) + '.nii',
                   '-o', file_data_split_reg,
                   '-t',
                  ] + fname_warp_list_invert_tmp + [
                   '-r', file_dest + ext_dest,
-                 ] + interp, verbose, is_sct_binary=True)
+                 ] + interp, verbose, env=env, is_sct_binary=True)
+                return it, file_data_split_reg
 
-            # Merge files back
-            sct.printv('\nMerge file back...', verbose)
-            import glob
+            sct.printv('\nApply transformation to each 3D volume ({} at once)...'.format(n_jobs), verbose)
             path_out, name_out, ext_out = sct.extract_fname(fname_out)
-            # im_list = [Image(file_name) for file_name in glob.glob('data_reg_T*.nii')]
-            # concat_data use to take a list of image in input, now takes a list of file names to open the files one by one (see issue #715)
-            fname_list = glob.glob('data_reg_T*.nii')
-            fname_list.sort()
-            im_out = sct_image.concat_data(fname_list, 3, im_header['pixdim'])
-            im_out.save(name_out + ext_out)
+            # volumes are written in the output as they are done
+            data_out = np.empty(tuple(msct_image.Image(file_dest + ext_dest).dim[:3]) + (nt,), dtype=np.float32)
+            hdr_out = None
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                for future in as_completed([executor.submit(apply_volume, it) for it in range(nt)]):
+                    it, file_data_split_reg = future.result()
+                    im_reg = msct_image.Image(file_data_split_reg)
+                    data_out[..., it] = im_reg.data.reshape(data_out.shape[:3])
+                    if hdr_out is None:
+                        hdr_out = im_reg.hdr.copy()
+                    del im_reg
+                    os.remove(file_data_split_reg)
+
+            # keep the temporal resolution of the input
+            hdr_out.set_data_dtype(np.float32)
+            hdr_out['pixdim'][4] = im_header['pixdim'][4]
+            msct_image.Image(data_out, hdr=hdr_out).save(name_out + ext_out)
 
             os.chdir(curdir)
             sct.generate_output_file(os.path.join(path_tmp, name_out + ext_out), fname_out)
@@ -290,6 +328,8 @@ def main(args=None):
         transform.interp = arguments["-x"]
     if "-r" in arguments:
         transform.remove_temp_files = int(arguments["-r"])
+    if "-j" in arguments:
+        transform.n_jobs = arguments["-j"]
     transform.verbose = int(arguments.get('-v'))
     sct.init_sct(log_level=transform.verbose, update=True)  # Update log level
 
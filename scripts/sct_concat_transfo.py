@@ -31,7 +31,6 @@ class Param:
 # main
 #=======================================================================================================================
 def main():
-
     # Initialization
     fname_warp_final = ''  # concatenated transformations
 
@@ -85,10 +84,20 @@ def main():
     sct.printv('\nConcatenate warping fields...', verbose)
     # N.B. Here we take the inverse of the warp list
     fname_warp_list_invert.reverse()
+    list_transfo = [(transfo[-1], len(transfo) == 2) for transfo in fname_warp_list_invert]
     fname_warp_list_invert = functools.reduce(lambda x,y: x+y, fname_warp_list_invert)
 
-    cmd = ['isct_ComposeMultiTransform', dimensionality, 'warp_final' + ext_out, '-R', fname_dest] + fname_warp_list_invert
-    status, output = sct.run(cmd, verbose=verbose, is_sct_binary=True)
+    from spinalcordtoolbox import warp
+
+    output, chain = '', None
+    if dimensionality == '3' and ext_out in ['.nii', '.nii.gz'] and warp.is_supported(list_transfo):
+        # compose in-process: the composed chain is kept in memory, and reused if the output warping field is applied
+        # by sct_apply_transfo in the same process
+        chain = warp.WarpChain.get(list_transfo, fname_dest)
+        chain.save('warp_final' + ext_out)
+    else:
+        cmd = ['isct_ComposeMultiTransform', dimensionality, 'warp_final' + ext_out, '-R', fname_dest] + fname_warp_list_invert
+        status, output = sct.run(cmd, verbose=verbose, is_sct_binary=True)
 
     # check if output was generated
     if not os.path.isfile('warp_final' + ext_out):
@@ -96,14 +105,16 @@ def main():
 
     # Generate output files
     sct.printv('\nGenerate output files...', verbose)
-    sct.generate_output_file('warp_final' + ext_out, os.path.join(path_out, file_out + ext_out))
+    fname_out = sct.generate_output_file('warp_final' + ext_out, os.path.join(path_out, file_out + ext_out))
+    if chain is not None:
+        chain.alias(fname_out)
 
 
 # ==========================================================================================
 def get_parser():
     # Initialize the parser
     parser = Parser(__file__)
-    parser.usage.set_description('Concatenate transformations. This function is a wrapper for isct_ComposeMultiTransform (ANTs). N.B. Order of input warping fields is important. For example, if you want to concatenate: A->B and B->C to yield A->C, then you have to input warping fields like that: A->B,B->C.')
+    parser.usage.set_description('Concatenate transformations. Affine matrices and warping fields are composed in-process when possible, otherwise this function is a wrapper for isct_ComposeMultiTransform (ANTs). N.B. Order of input warping fields is important. For example, if you want to concatenate: A->B and B->C to yield A->C, then you have to input warping fields like that: A->B,B->C.')
     parser.add_option(name="-d",
                       type_value="file",
                       description="Destination image.",
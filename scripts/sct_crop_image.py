@@ -17,7 +17,6 @@ import sys, io, os, math, time
 
 import numpy as np
 import scipy
-import nibabel
 
 import sct_utils as sct
 from msct_parser import Parser
@@ -210,6 +209,7 @@ class ImageCropper(object):
 
         # get image of medial slab
         sct.printv('\nGet image of medial slab...', verbose)
+        import nibabel
         image_array = nibabel.load('data_rpi.nii').get_data()
         nx, ny, nz = image_array.shape
         scipy.misc.imsave('image.jpg', image_array[math.floor(nx / 2), :, :])
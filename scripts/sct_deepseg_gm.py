@@ -15,7 +15,6 @@ import os
 
 import sct_utils as sct
 from msct_parser import Parser
-from spinalcordtoolbox.reports.qc import generate_qc
 
 
 def get_parser():
@@ -128,6 +127,7 @@ def run_main():
     qc_dataset = arguments.get("-qc-dataset", None)
     qc_subject = arguments.get("-qc-subject", None)
     if path_qc is not None:
+        from spinalcordtoolbox.reports.qc import generate_qc
         generate_qc(fname_in1=input_filename, fname_seg=out_fname, args=sys.argv[1:], path_qc=os.path.abspath(path_qc),
                     dataset=qc_dataset, subject=qc_subject, process='sct_deepseg_gm')
 
@@ -21,7 +21,6 @@ import numpy as np
 from msct_parser import Parser
 import sct_utils as sct
 from spinalcordtoolbox.image import Image
-from spinalcordtoolbox.deepseg_lesion.core import deep_segmentation_MSlesion
 
 
 def get_parser():
@@ -122,6 +121,8 @@ def main():
     algo_config_stg += '\n\tAssumes brain section included in the image: ' + str(brain_bool) + '\n'
     sct.printv(algo_config_stg)
 
+    from spinalcordtoolbox.deepseg_lesion.core import deep_segmentation_MSlesion
+
     im_image = Image(fname_image)
     im_seg, im_labels_viewer, im_ctr = deep_segmentation_MSlesion(im_image, contrast_type, ctr_algo=ctr_algo, ctr_file=manual_centerline_fname,
                                         brain_bool=brain_bool, remove_temp_files=remove_temp_files, verbose=verbose)
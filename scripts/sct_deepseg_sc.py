@@ -18,8 +18,6 @@ import sys
 
 import sct_utils as sct
 from spinalcordtoolbox.image import Image
-from spinalcordtoolbox.deepseg_sc.core import deep_segmentation_spinalcord
-from spinalcordtoolbox.reports.qc import generate_qc
 from msct_parser import Parser
 
 
@@ -152,6 +150,8 @@ def main():
     algo_config_stg += '\n\tDimension of the segmentation kernel convolutions: ' + kernel_size + '\n'
     sct.printv(algo_config_stg)
 
+    from spinalcordtoolbox.deepseg_sc.core import deep_segmentation_spinalcord
+
     im_image = Image(fname_image)
     # note: below we pass im_image.copy() otherwise the field absolutepath becomes None after execution of this function
     im_seg, im_image_RPI_upsamp, im_seg_RPI_upsamp, im_labels_viewer, im_ctr = deep_segmentation_spinalcord(
@@ -176,6 +176,7 @@ def main():
         im_ctr.save(fname_ctr)
 
     if path_qc is not None:
+        from spinalcordtoolbox.reports.qc import generate_qc
         generate_qc(fname_image, fname_seg=fname_seg, args=args, path_qc=os.path.abspath(path_qc),
                     dataset=qc_dataset, subject=qc_subject, process='sct_deepseg_sc')
     sct.display_viewer_syntax([fname_image, fname_seg], colormaps=['gray', 'red'], opacities=['', '0.7'])
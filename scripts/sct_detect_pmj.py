@@ -22,7 +22,6 @@ import spinalcordtoolbox.image as msct_image
 from spinalcordtoolbox.image import Image
 from msct_parser import Parser
 import sct_utils as sct
-from spinalcordtoolbox.reports.qc import generate_qc
 
 
 def get_parser():
@@ -290,6 +289,7 @@ def main(args=None):
     # View results
     if fname_out is not None:
         if path_qc is not None:
+            from spinalcordtoolbox.reports.qc import generate_qc
             generate_qc(fname_in, fname_seg=fname_out, args=args, path_qc=os.path.abspath(path_qc),
                         process='sct_detect_pmj')
 
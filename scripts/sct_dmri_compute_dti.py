@@ -13,7 +13,9 @@
 from __future__ import absolute_import
 
 import sys
+from multiprocessing import cpu_count
 
+import numpy as np
 from dipy.io import read_bvals_bvecs
 from dipy.core.gradients import gradient_table
 import dipy.reconst.dti as dti
@@ -24,6 +26,7 @@ import sct_utils as sct
 class Param:
     def __init__(self):
         self.verbose = 1
+        self.chunk_size = 10000  # number of voxels fitted per job
 
 
 # PARSER
@@ -71,6 +74,12 @@ def get_parser():
                       description='Output prefix.',
                       mandatory=False,
                       default_value='dti_')
+    parser.add_option(name="-j",
+                      type_value="int",
+                      description="Number of processes for parallel fitting. By default, all available CPU cores will"
+                                  " be used. Set to 1 for no multiprocessing.",
+                      mandatory=False,
+                      example='4')
     parser.add_option(name="-v",
                       type_value="multiple_choice",
                       description="""Verbose. 0: nothing. 1: basic. 2: extended.""",
@@ -98,28 +107,31 @@ def main(args = None):
     fname_bvecs = arguments['-bvec']
     prefix = arguments['-o']
     method = arguments['-method']
-    evecs = bool(arguments['-evecs'])
+    evecs = bool(int(arguments['-evecs']))
     if "-m" in arguments:
         file_mask = arguments['-m']
+    n_jobs = arguments.get('-j', None)
     param.verbose = int(arguments.get('-v'))
     sct.init_sct(log_level=param.verbose, update=True)  # Update log level
 
     # compute DTI
-    if not compute_dti(fname_in, fname_bvals, fname_bvecs, prefix, method, evecs, file_mask):
+    if not compute_dti(fname_in, fname_bvals, fname_bvecs, prefix, method, evecs, file_mask, n_jobs=n_jobs):
         sct.printv('ERROR in compute_dti()', 1, 'error')
 
 
 # compute_dti
 # ==========================================================================================
-def compute_dti(fname_in, fname_bvals, fname_bvecs, prefix, method, evecs, file_mask):
+def compute_dti(fname_in, fname_bvals, fname_bvecs, prefix, method, evecs, file_mask, n_jobs=None):
     """
-    Compute DTI.
+    Compute DTI. Data are cropped to the bounding box of the mask, and masked voxels are fitted by chunks in parallel.
     :param fname_in: input 4d file.
     :param bvals: bvals txt file
     :param bvecs: bvecs txt file
     :param prefix: output prefix. Example: "dti_"
     :param method: algo for computing dti
     :param evecs: bool: output diffusion tensor eigenvectors
+    :param file_mask: mask file. If empty, all voxels are fitted
+    :param n_jobs: int: number of processes. Default: number of CPUs
     :return: True/False
     """
     # Open file.
@@ -137,52 +149,71 @@ def compute_dti(fname_in, fname_bvals, fname_bvecs, prefix, method, evecs, file_
         sct.printv('Open mask file...', param.verbose)
         # open mask file
         nii_mask = Image(file_mask)
-        mask = nii_mask.data
+        mask = nii_mask.data > 0
+    else:
+        mask = np.ones(data.shape[:3], dtype=bool)
+    if np.any(mask):
+        bbox = tuple(slice(ind.min(), ind.max() + 1) for ind in np.nonzero(mask))
+    else:
+        bbox = (slice(0, 0),) * 3
+    mask_crop = mask[bbox]
+    # masked voxels, as a 2d array: voxels x volumes
+    data_masked = data[bbox][mask_crop]
 
     # fit tensor model
     sct.printv('Computing tensor using "' + method + '" method...', param.verbose)
-    import dipy.reconst.dti as dti
     if method == 'standard':
         tenmodel = dti.TensorModel(gtab)
-        if file_mask == '':
-            tenfit = tenmodel.fit(data)
-        else:
-            tenfit = tenmodel.fit(data, mask)
     elif method == 'restore':
         import dipy.denoise.noise_estimate as ne
+        # noise is estimated on the whole volume, not per chunk
         sigma = ne.estimate_sigma(data)
-        dti_restore = dti.TensorModel(gtab, fit_method='RESTORE', sigma=sigma)
-        if file_mask == '':
-            tenfit = dti_restore.fit(data)
-        else:
-            tenfit = dti_restore.fit(data, mask)
+        tenmodel = dti.TensorModel(gtab, fit_method='RESTORE', sigma=sigma)
+    list_chunk = [data_masked[i:i + param.chunk_size] for i in range(0, len(data_masked), param.chunk_size)]
+    if n_jobs is None:
+        n_jobs = cpu_count()
+    if n_jobs > 1 and len(list_chunk) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(list_chunk))) as executor:
+            list_fit = list(executor.map(fit_tensor, [(tenmodel, chunk, evecs) for chunk in list_chunk]))
+    else:
+        list_fit = [fit_tensor((tenmodel, chunk, evecs)) for chunk in list_chunk]
 
     # Compute metrics
     sct.printv('Computing metrics...', param.verbose)
-    # FA
-    nii.data = tenfit.fa
-    nii.save(prefix + 'FA.nii.gz', dtype='float32')
-    # MD
-    nii.data = tenfit.md
-    nii.save(prefix + 'MD.nii.gz', dtype='float32')
-    # RD
-    nii.data = tenfit.rd
-    nii.save(prefix + 'RD.nii.gz', dtype='float32')
-    # AD
-    nii.data = tenfit.ad
-    nii.save(prefix + 'AD.nii.gz', dtype='float32')
+    list_metric = ['FA', 'MD', 'RD', 'AD']
+    # maps are saved as float32, whatever the type of the input data
+    hdr = nii.hdr.copy()
+    hdr.set_data_dtype(np.float32)
     if evecs:
-        data_evecs = tenfit.evecs
         # output 1st (V1), 2nd (V2) and 3rd (V3) eigenvectors as 4d data
-        for idim in range(3):
-            nii.data = data_evecs[:, :, :, :, idim]
-            nii.save(prefix + 'V' + str(idim+1) + '.nii.gz', dtype="float32")
+        list_metric += ['V1', 'V2', 'V3']
+    for i_metric, metric in enumerate(list_metric):
+        # gather chunks into the masked voxels of a preallocated map
+        if metric.startswith('V'):
+            data_metric = np.zeros(data.shape[:3] + (3,), dtype=np.float32)
+            values = np.concatenate([fit[4][..., int(metric[1]) - 1] for fit in list_fit]) if list_fit else 0
+        else:
+            data_metric = np.zeros(data.shape[:3], dtype=np.float32)
+            values = np.concatenate([fit[i_metric] for fit in list_fit]) if list_fit else 0
+        data_metric[bbox][mask_crop] = values
+        Image(data_metric, hdr=hdr.copy()).save(prefix + metric + '.nii.gz', dtype='float32')
 
     return True
 
 
-# START PROGRAM
-# ==========================================================================================
+def fit_tensor(args):
+    """
+    Fit the diffusion tensor on a chunk of voxels.
+    :param args: (model, data, evecs): dipy TensorModel, 2d array of voxels x volumes, bool: return eigenvectors
+    :return: fa, md, rd, ad, evecs (None if not requested)
+    """
+    model, data, evecs = args
+    tenfit = model.fit(data)
+    return (tenfit.fa.astype(np.float32), tenfit.md.astype(np.float32), tenfit.rd.astype(np.float32),
+            tenfit.ad.astype(np.float32), tenfit.evecs.astype(np.float32) if evecs else None)
+
+
 if __name__ == "__main__":
     sct.init_sct()
     # initialize parameters
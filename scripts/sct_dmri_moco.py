@@ -277,11 +277,12 @@ def main(args=None):
     fname_data_moco_tmp = dmri_moco(param)
 
     # generate b0_moco_mean and dwi_moco_mean
-    args = ['-i', fname_data_moco_tmp, '-bvec', 'bvecs.txt', '-a', '1', '-v', '0']
-    if not param.fname_bvals == '':
-        # if bvals file is provided
-        args += ['-bval', param.fname_bvals]
-    fname_b0, fname_b0_mean, fname_dwi, fname_dwi_mean = sct_dmri_separate_b0_and_dwi.main(args=args)
+    index_b0, index_dwi, nb_b0, nb_dwi = sct_dmri_separate_b0_and_dwi.identify_b0('bvecs.txt', param.fname_bvals, param.bval_min, 0)
+    fname_b0_mean = os.path.abspath(sct.add_suffix(fname_data_moco_tmp, '_b0_mean'))
+    fname_dwi_mean = os.path.abspath(sct.add_suffix(fname_data_moco_tmp, '_dwi_mean'))
+    sct_dmri_separate_b0_and_dwi.separate_b0_and_dwi(Image(fname_data_moco_tmp), index_b0, index_dwi,
+                                                     fname_b0_mean=fname_b0_mean, fname_dwi_mean=fname_dwi_mean,
+                                                     verbose=0)
 
     # come back
     os.chdir(curdir)
@@ -23,16 +23,14 @@ import numpy as np
 
 import sct_utils as sct
 from spinalcordtoolbox.image import Image
-from sct_image import split_data
 from msct_parser import Parser
-from sct_convert import convert
 
 
 class Param:
     def __init__(self):
         self.debug = 0
         self.average = 0
-        self.remove_temp_files = 1
+        self.remove_temp_files = 1  # kept for compatibility: no temporary file is created
         self.verbose = 1
         self.bval_min = 100  # in case user does not have min bvalues at 0, set threshold.
 
@@ -106,10 +104,9 @@ def main(args=None):
 
     fname_data = arguments['-i']
     fname_bvecs = arguments['-bvec']
-    average = arguments['-a']
+    average = int(arguments['-a'])
     verbose = int(arguments.get('-v'))
     sct.init_sct(log_level=verbose, update=True)  # Update log level
-    remove_temp_files = int(arguments['-r'])
     path_out = arguments['-ofolder']
 
     if '-bval' in arguments:
@@ -138,28 +135,14 @@ def main(args=None):
     # Extract path, file and extension
     path_data, file_data, ext_data = sct.extract_fname(fname_data)
 
-    # create temporary folder
-    path_tmp = sct.tmp_create(basename="dmri_separate", verbose=verbose)
+    # Output file names
+    fname_b0 = os.path.abspath(os.path.join(path_out, file_data + '_b0' + ext_data))
+    fname_dwi = os.path.abspath(os.path.join(path_out, file_data + '_dwi' + ext_data))
+    fname_b0_mean = sct.add_suffix(fname_b0, '_mean')
+    fname_dwi_mean = sct.add_suffix(fname_dwi, '_mean')
 
-    # copy files into tmp folder and convert to nifti
-    sct.printv('\nCopy files into temporary folder...', verbose)
-    ext = '.nii'
-    dmri_name = 'dmri'
-    b0_name = file_data + '_b0'
-    b0_mean_name = b0_name + '_mean'
-    dwi_name = file_data + '_dwi'
-    dwi_mean_name = dwi_name + '_mean'
-
-    if not convert(fname_data, os.path.join(path_tmp, dmri_name + ext)):
-        sct.printv('ERROR in convert.', 1, 'error')
-    sct.copy(fname_bvecs, os.path.join(path_tmp, "bvecs"), verbose=verbose)
-
-    # go to tmp folder
-    curdir = os.getcwd()
-    os.chdir(path_tmp)
-
-    # Get size of data
-    im_dmri = Image(dmri_name + ext)
+    # Get size of data (data are only read when needed)
+    im_dmri = Image(fname_data)
     sct.printv('\nGet dimensions data...', verbose)
     nx, ny, nz, nt, px, py, pz, pt = im_dmri.dim
     sct.printv('.. ' + str(nx) + ' x ' + str(ny) + ' x ' + str(nz) + ' x ' + str(nt), verbose)
@@ -168,55 +151,11 @@ def main(args=None):
     sct.printv(fname_bvals)
     index_b0, index_dwi, nb_b0, nb_dwi = identify_b0(fname_bvecs, fname_bvals, param.bval_min, verbose)
 
-    # Split into T dimension
-    sct.printv('\nSplit along T dimension...', verbose)
-    im_dmri_split_list = split_data(im_dmri, 3)
-    for im_d in im_dmri_split_list:
-        im_d.save()
-
-    # Merge b=0 images
-    sct.printv('\nMerge b=0...', verbose)
-    from sct_image import concat_data
-    l = []
-    for it in range(nb_b0):
-        l.append(dmri_name + '_T' + str(index_b0[it]).zfill(4) + ext)
-    im_out = concat_data(l, 3).save(b0_name + ext)
-
-    # Average b=0 images
-    if average:
-        sct.printv('\nAverage b=0...', verbose)
-        sct.run(['sct_maths', '-i', b0_name + ext, '-o', b0_mean_name + ext, '-mean', 't'], verbose)
-
-    # Merge DWI
-    l = []
-    for it in range(nb_dwi):
-        l.append(dmri_name + '_T' + str(index_dwi[it]).zfill(4) + ext)
-    im_out = concat_data(l, 3).save(dwi_name + ext)
-
-    # Average DWI images
-    if average:
-        sct.printv('\nAverage DWI...', verbose)
-        sct.run(['sct_maths', '-i', dwi_name + ext, '-o', dwi_mean_name + ext, '-mean', 't'], verbose)
-
-    # come back
-    os.chdir(curdir)
-
-    # Generate output files
-    fname_b0 = os.path.abspath(os.path.join(path_out, b0_name + ext_data))
-    fname_dwi = os.path.abspath(os.path.join(path_out, dwi_name + ext_data))
-    fname_b0_mean = os.path.abspath(os.path.join(path_out, b0_mean_name + ext_data))
-    fname_dwi_mean = os.path.abspath(os.path.join(path_out, dwi_mean_name + ext_data))
+    # Separate and average b=0 and DWI
     sct.printv('\nGenerate output files...', verbose)
-    sct.generate_output_file(os.path.join(path_tmp, b0_name + ext), fname_b0, verbose)
-    sct.generate_output_file(os.path.join(path_tmp, dwi_name + ext), fname_dwi, verbose)
-    if average:
-        sct.generate_output_file(os.path.join(path_tmp, b0_mean_name + ext), fname_b0_mean, verbose)
-        sct.generate_output_file(os.path.join(path_tmp, dwi_mean_name + ext), fname_dwi_mean, verbose)
-
-    # Remove temporary files
-    if remove_temp_files == 1:
-        sct.printv('\nRemove temporary files...', verbose)
-        sct.rmtree(path_tmp, verbose=verbose)
+    separate_b0_and_dwi(im_dmri, index_b0, index_dwi, fname_b0=fname_b0, fname_dwi=fname_dwi,
+                        fname_b0_mean=fname_b0_mean if average else None,
+                        fname_dwi_mean=fname_dwi_mean if average else None, verbose=verbose)
 
     # display elapsed time
     elapsed_time = time.time() - start_time
@@ -225,6 +164,47 @@ def main(args=None):
     return fname_b0, fname_b0_mean, fname_dwi, fname_dwi_mean
 
 
+def separate_b0_and_dwi(im_dmri, index_b0, index_dwi, fname_b0=None, fname_dwi=None, fname_b0_mean=None,
+                        fname_dwi_mean=None, verbose=1):
+    """
+    Select b=0 and DW volumes of a diffusion dataset and/or compute their average. Only the requested outputs are
+    written. When the 4D subset is not requested, its mean is accumulated one volume at a time, so that the subset is
+    never held in memory (volumes are read on demand if the data are memory-mapped, e.g. for .nii files).
+    :param im_dmri: Image: 4D diffusion data
+    :param index_b0: list of indices of b=0 volumes
+    :param index_dwi: list of indices of DW volumes
+    :param fname_b0: output file name for b=0 volumes (not written if None)
+    :param fname_dwi: output file name for DW volumes (not written if None)
+    :param fname_b0_mean: output file name for the mean of b=0 volumes (not written if None)
+    :param fname_dwi_mean: output file name for the mean of DW volumes (not written if None)
+    :param verbose:
+    :return:
+    """
+    data = im_dmri.data
+    for index, fname, fname_mean in [(index_b0, fname_b0, fname_b0_mean), (index_dwi, fname_dwi, fname_dwi_mean)]:
+        if not len(index):
+            continue
+        data_mean = None
+        if fname is not None:
+            # fancy indexing only reads the selected volumes
+            data_out = data[..., index]
+            Image(data_out, hdr=im_dmri.hdr.copy()).save(fname, verbose=verbose)
+            sct.printv('  File created: ' + fname, verbose)
+            if fname_mean is not None:
+                data_mean = np.mean(data_out, 3)
+            del data_out
+        if fname_mean is not None:
+            if data_mean is None:
+                # running mean
+                dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.float64
+                data_mean = np.zeros(data.shape[:3], dtype=np.float64)
+                for it in index:
+                    data_mean += data[..., it]
+                data_mean = (data_mean / len(index)).astype(dtype)
+            Image(data_mean, hdr=im_dmri.hdr.copy()).save(fname_mean, verbose=verbose)
+            sct.printv('  File created: ' + fname_mean, verbose)
+
+
 # ==========================================================================================
 # identify b=0 and DW images
 # ==========================================================================================
@@ -22,9 +22,7 @@ from __future__ import division, absolute_import
 
 import sys, os
 
-import numpy as np
-
-from spinalcordtoolbox.metadata import read_label_file
+from spinalcordtoolbox.metadata import read_label_file, SparseAtlas
 from spinalcordtoolbox.utils import parse_num_list
 from spinalcordtoolbox.aggregate_slicewise import check_labels, extract_metric, save_as_csv, Metric, LabelStruc
 import sct_utils as sct
@@ -59,10 +57,12 @@ def get_parser():
     parser.usage.set_description("""This program extracts metrics (e.g., DTI or MTR) within labels. Labels could be a single file or a folder generated with 'sct_warp_template' and containing multiple label files and a label description file (info_label.txt). The labels should be in the same space coordinates as the input image.""")
     # Mandatory arguments
     parser.add_option(name='-i',
-                      type_value='image_nifti',
-                      description='File to extract metrics from.',
+                      type_value=[[','], 'image_nifti'],
+                      description='File to extract metrics from. To extract several metrics within the same labels, '
+                                  'separate files with ",": labels are then loaded once and all results are written '
+                                  'to the same output file.',
                       mandatory=True,
-                      example='FA.nii.gz')
+                      example='FA.nii.gz,MD.nii.gz')
     # Optional arguments
     parser.add_option(name='-f',
                       type_value='folder',
@@ -223,7 +223,8 @@ def main(fname_data, path_label, method, slices, levels, fname_output, labels_us
          verbose=1):
     """
     Extract metrics from MRI data based on mask (could be single file of folder to atlas)
-    :param fname_data: data to extract metric from
+    :param fname_data: data to extract metric from. Could be a list of files, in which case labels are loaded once and
+           results of all files are written in fname_output.
     :param path_label: mask: could be single file or folder to atlas (which contains info_label.txt)
     :param method:
     :param slices_of_interest. Accepted format:
@@ -304,41 +305,50 @@ def main(fname_data, path_label, method, slices, levels, fname_output, labels_us
 
     # check syntax of labels asked by user
     labels_id_user = check_labels(indiv_labels_ids + combined_labels_ids, parse_num_list(labels_user))
-    nb_labels = len(indiv_labels_files)
-
-    # Load data and systematically reorient to RPI because we need the 3rd dimension to be z
-    sct.printv('\nLoad metric image...', verbose)
-    input_im = Image(fname_data).change_orientation("RPI")
-
-    data = Metric(data=input_im.data, label='')
-    # Load labels
-    labels_tmp = np.empty([nb_labels], dtype=object)
-    for i_label in range(nb_labels):
-        im_label = Image(os.path.join(path_label, indiv_labels_files[i_label])).change_orientation("RPI")
-        labels_tmp[i_label] = np.expand_dims(im_label.data, 3)  # TODO: generalize to 2D input label
-    labels = np.concatenate(labels_tmp[:], 3)  # labels: (x,y,z,label)
+
+    # Load labels once for all metrics, and systematically reorient to RPI because we need the 3rd dimension to be z.
+    # Atlas folders are cached as a sparse matrix in the user cache folder, so that label files are only read once.
+    sct.printv('\nLoad labels...', verbose)
+    if path_label:
+        atlas = SparseAtlas.from_folder(path_label, param_default.file_info_label, orientation="RPI")
+    else:
+        atlas = SparseAtlas.from_images(indiv_labels_files, orientation="RPI")
+    nx_atlas, ny_atlas, nz_atlas = atlas.shape
     # Load vertebral levels
-    if vertebral_levels:
+    if levels:
         im_vertebral_labeling = Image(fname_vertebral_labeling).change_orientation("RPI")
     else:
         im_vertebral_labeling = None
 
-        # Get dimensions of data and labels
-    nx, ny, nz = data.data.shape
-    nx_atlas, ny_atlas, nz_atlas, nt_atlas = labels.shape
-
-    # Check dimensions consistency between atlas and data
-    if (nx, ny, nz) != (nx_atlas, ny_atlas, nz_atlas):
-        sct.printv('\nERROR: Metric data and labels DO NOT HAVE SAME DIMENSIONS.', 1, type='error')
-
-    for id_label in labels_id_user:
-        sct.printv('Estimation for label: '+label_struc[id_label].name, verbose)
-        agg_metric = extract_metric(data, labels=labels, slices=slices, levels=levels, perslice=perslice,
-                                    perlevel=perlevel, vert_level=im_vertebral_labeling, method=method,
-                                    label_struc=label_struc, id_label=id_label, indiv_labels_ids=indiv_labels_ids)
-
-        save_as_csv(agg_metric, fname_output, fname_in=fname_data, append=append)
-        append = True  # when looping across labels, need to append results in the same file
+    # Voxels outside of all labels have zero weight, so the in-plane field of view can be cropped to the bounding box of
+    # the labels. Not done for method "max", which considers all voxels of a slice.
+    if method != 'max':
+        crop_xy = atlas.bounding_box_xy()
+    else:
+        crop_xy = (slice(None), slice(None))
+    labels = atlas.to_dense(crop=crop_xy)  # labels: (x,y,z,label)  # TODO: generalize to 2D input label
+
+    if isinstance(fname_data, str):
+        fname_data = [fname_data]
+    for fname_metric in fname_data:
+        # Load data and systematically reorient to RPI because we need the 3rd dimension to be z
+        sct.printv('\nLoad metric image: ' + fname_metric, verbose)
+        input_im = Image(fname_metric).change_orientation("RPI")
+
+        # Check dimensions consistency between atlas and data
+        if input_im.data.shape != (nx_atlas, ny_atlas, nz_atlas):
+            sct.printv('\nERROR: Metric data and labels DO NOT HAVE SAME DIMENSIONS.', 1, type='error')
+        data = Metric(data=input_im.data[crop_xy].copy(), label='')
+        del input_im
+
+        for id_label in labels_id_user:
+            sct.printv('Estimation for label: '+label_struc[id_label].name, verbose)
+            agg_metric = extract_metric(data, labels=labels, slices=slices, levels=levels, perslice=perslice,
+                                        perlevel=perlevel, vert_level=im_vertebral_labeling, method=method,
+                                        label_struc=label_struc, id_label=id_label, indiv_labels_ids=indiv_labels_ids)
+
+            save_as_csv(agg_metric, fname_output, fname_in=fname_metric, append=append)
+            append = True  # when looping across labels and metrics, need to append results in the same file
     sct.display_open(fname_output)
 
 
@@ -352,7 +362,7 @@ if __name__ == "__main__":
     arguments = parser.parse(sys.argv[1:])
 
     overwrite = 0
-    fname_data = sct.get_absolute_path(arguments['-i'])
+    fname_data = [sct.get_absolute_path(fname) for fname in arguments['-i']]
     path_label = arguments['-f']
     method = arguments['-method']
     fname_output = arguments['-o']
@@ -14,12 +14,12 @@
 from __future__ import absolute_import, division
 
 import sys
+from multiprocessing import cpu_count
 
 import numpy as np
-from skimage import transform, img_as_float
+from scipy import ndimage
 
 import sct_utils as sct
-import spinalcordtoolbox.image as msct_image
 from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.centerline.core import get_centerline
 from msct_parser import Parser
@@ -35,13 +35,16 @@ class Param:
         self.verbose = 1
 
 
-def flatten_sagittal(im_anat, im_centerline, verbose):
+def flatten_sagittal(im_anat, im_centerline, verbose, n_jobs=None, return_translation=False):
     """
-    Flatten a 3D volume using the segmentation, such that the spinal cord is centered in the R-L medial plane.
+    Flatten a 3D or 4D volume using the segmentation, such that the spinal cord is centered in the R-L medial plane.
     :param im_anat:
     :param im_centerline:
     :param verbose:
-    :return:
+    :param n_jobs: int: number of threads. Default: number of CPUs
+    :param return_translation: bool: also return the translation along x (R-L, in voxels, RPI orientation) of each
+    axial slice, which can be used with translate_slices() to flatten other images (e.g. labels) consistently.
+    :return: im_anat_flattened, or (im_anat_flattened, translation_x) if return_translation
     """
     # re-oriente to RPI
     orientation_native = im_anat.orientation
@@ -59,29 +62,60 @@ def flatten_sagittal(im_anat, im_centerline, verbose):
                                             x_centerline_fit,
                                             np.ones(nz-zmax) * x_centerline_fit[-1]])
 
-    # change type to float32 and scale between -1 and 1 as requested by img_as_float(). See #1790, #2069
-    im_anat_flattened = msct_image.change_type(im_anat, np.float32)
-    min_data, max_data = np.min(im_anat_flattened.data), np.max(im_anat_flattened.data)
-    im_anat_flattened.data = 2 * im_anat_flattened.data/(max_data - min_data) - 1
-
-    # loop and translate each axial slice, such that the flattened centerline is centered in the medial plane (R-L)
-    for iz in range(nz):
-        # compute translation along x (R-L)
-        translation_x = x_centerline_extended[iz] - np.round(nx/2.0)
-        # apply transformation to 2D image with linear interpolation
-        # tform = tf.SimilarityTransform(scale=1, rotation=0, translation=(translation_x, 0))
-        tform = transform.SimilarityTransform(translation=(0, translation_x))
-        # important to force input in float to skikit image, because it will output float values
-        img = img_as_float(im_anat_flattened.data[:, :, iz])
-        img_reg = transform.warp(img, tform)
-        im_anat_flattened.data[:, :, iz] = img_reg
+    # translate each axial slice, such that the flattened centerline is centered in the medial plane (R-L)
+    translation_x = x_centerline_extended[:nz] - np.round(nx/2.0)
+
+    # change type to float32 and scale between -1 and 1 as was requested by img_as_float(). See #1790, #2069
+    # nb. downstream tools rely on this intensity range, e.g. isct_spine_detect in detect_c2c3
+    data = im_anat.data.astype(np.float32)
+    min_data, max_data = np.min(data), np.max(data)
+    data = 2 * data / (max_data - min_data) - 1
+
+    im_anat_flattened = Image(translate_slices(data, translation_x, n_jobs=n_jobs), hdr=im_anat.hdr.copy())
+    im_anat_flattened.hdr.set_data_dtype(np.float32)
 
     # change back to native orientation
     im_anat_flattened.change_orientation(orientation_native)
 
+    if return_translation:
+        return im_anat_flattened, translation_x
     return im_anat_flattened
 
 
+def translate_slices(data, translation_x, order=1, n_jobs=None):
+    """
+    Translate each axial slice of a volume along x: output[x, y, z] = data[x + translation_x[z], y, z]. Points outside
+    the volume are set to 0. Axial slices are processed by chunks in parallel.
+    :param data: 3D or 4D array
+    :param translation_x: 1D array: translation (in voxels) of each axial slice
+    :param order: int: spline interpolation order. Use 0 for labels.
+    :param n_jobs: int: number of threads. Default: number of CPUs
+    :return: float32 array with the same shape as data
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    nx, ny, nz = data.shape[:3]
+    data_out = np.empty(data.shape, dtype=np.float32)
+    if n_jobs is None:
+        n_jobs = cpu_count()
+    size_chunk = int(np.ceil(nz / float(max(1, min(n_jobs, nz)))))
+
+    def translate_chunk(z0):
+        z1 = min(z0 + size_chunk, nz)
+        # sampling grid of the chunk, shared by all volumes
+        coord = np.mgrid[0:nx, 0:ny, 0:z1-z0].astype(np.float32)
+        coord[0] += translation_x[z0:z1]
+        # input is passed as float32 so that the output is interpolated in float32
+        for it in np.ndindex(data.shape[3:]):
+            data_chunk = np.asarray(data[(slice(None), slice(None), slice(z0, z1)) + it], dtype=np.float32)
+            ndimage.map_coordinates(data_chunk, coord, output=data_out[(slice(None), slice(None), slice(z0, z1)) + it],
+                                    order=order, mode='constant', cval=0)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(n_jobs, nz))) as executor:
+        list(executor.map(translate_chunk, range(0, nz, size_chunk)))
+    return data_out
+
+
 def main(fname_anat, fname_centerline, verbose):
     """
     Main function
@@ -344,7 +344,7 @@ def pad_image(im, pad_x_i=0, pad_x_f=0, pad_y_i=0, pad_y_f=0, pad_z_i=0, pad_z_f
 
 def split_data(im_in, dim, squeeze_data=True):
     """
-    Split data
+    Split data. The data of the output images are views on the data of the input image (no copy).
     :param im_in: input image.
     :param dim: dimension: 0, 1, 2, 3.
     :return: list of split images
@@ -358,80 +358,68 @@ def split_data(im_in, dim, squeeze_data=True):
     if dim + 1 > len(np.shape(data)):
         data = data[..., np.newaxis]
     # in case splitting along the last dim, make sure to remove the last dim to avoid singleton
-    if dim + 1 == len(np.shape(data)):
-        if squeeze_data:
-            do_reshape = True
-        else:
-            do_reshape = False
-    else:
-        do_reshape = False
-    # Split data into list
-    data_split = np.array_split(data, data.shape[dim], dim)
-    # Write each file
+    do_reshape = squeeze_data and dim + 1 == len(np.shape(data))
+    # Split data into list of views
     im_out_list = []
-    for idx_img, dat in enumerate(data_split):
-        im_out = msct_image.empty_like(im_in)
-        if do_reshape:
-            im_out.data = dat.reshape(tuple([ x for (idx_shape, x) in enumerate(data.shape) if idx_shape != dim]))
-        else:
-            im_out.data = dat
+    for idx_img in range(data.shape[dim]):
+        index = [slice(None)] * data.ndim
+        index[dim] = idx_img if do_reshape else slice(idx_img, idx_img + 1)
+        im_out = msct_image.Image(data[tuple(index)], hdr=im_in.hdr.copy())
         im_out.absolutepath = sct.add_suffix(im_in.absolutepath, "_{}{}".format(dim_list[dim].upper(), str(idx_img).zfill(4)))
         im_out_list.append(im_out)
 
     return im_out_list
 
 
-def concat_data(fname_in_list, dim, pixdim=None, squeeze_data=False):
+def concat_data(fname_in_list, dim, pixdim=None, squeeze_data=False, fname_memmap=None):
     """
-    Concatenate data
+    Concatenate data. The output is preallocated and filled one input at a time, so that only one input is in memory
+    in addition to the output.
     :param im_in_list: list of Images or image filenames
     :param dim: dimension: 0, 1, 2, 3.
     :param pixdim: pixel resolution to join to image header
     :param squeeze_data: bool: if True, remove the last dim if it is a singleton.
+    :param fname_memmap: str: if set, the output data is a memory-mapped array backed by this file.
     :return im_out: concatenated image
     """
     # WARNING: calling concat_data in python instead of in command line causes a non understood issue (results are different with both options)
-    # from numpy import concatenate, expand_dims
-
-    dat_list = []
-    data_concat_list = []
-
-    # check if shape of first image is smaller than asked dim to concatenate along
-    # data0 = Image(fname_in_list[0]).data
-    # if len(data0.shape) <= dim:
-    #     expand_dim = True
-    # else:
-    #     expand_dim = False
-
-    for i, fname in enumerate(fname_in_list):
-        # if there is more than 100 images to concatenate, then it does it iteratively to avoid memory issue.
-        if i != 0 and i % 100 == 0:
-            data_concat_list.append(np.concatenate(dat_list, axis=dim))
-            im = Image(fname)
-            dat = im.data
-            # if image shape is smaller than asked dim, then expand dim
-            if len(dat.shape) <= dim:
-                dat = np.expand_dims(dat, dim)
-            dat_list = [dat]
-            del im
-            del dat
-        else:
-            im = Image(fname)
-            dat = im.data
-            # if image shape is smaller than asked dim, then expand dim
-            if len(dat.shape) <= dim:
-                dat = np.expand_dims(dat, dim)
-            dat_list.append(dat)
-            del im
-            del dat
-    if data_concat_list:
-        data_concat_list.append(np.concatenate(dat_list, axis=dim))
-        data_concat = np.concatenate(data_concat_list, axis=dim)
-    else:
-        data_concat = np.concatenate(dat_list, axis=dim)
+
+    def get_shape(shape):
+        # if image shape is smaller than asked dim, then expand dim
+        if len(shape) <= dim:
+            shape = shape[:dim] + (1,) + shape[dim:]
+        return tuple(shape)
+
+    import nibabel
+
+    # get output dimensions from the headers (without loading data)
+    list_shape = [get_shape(nibabel.load(fname).shape if isinstance(fname, str) else fname.data.shape)
+                  for fname in fname_in_list]
+    shape_concat = list(list_shape[0])
+    shape_concat[dim] = sum(shape[dim] for shape in list_shape)
+
+    data_concat = None
+    index = [slice(None)] * len(shape_concat)
+    offset = 0
+    for fname, shape in zip(fname_in_list, list_shape):
+        im = Image(fname) if isinstance(fname, str) else fname
+        dat = im.data.reshape(shape)
+        if data_concat is None:
+            # use the first image as template for the output
+            hdr_concat = im.hdr.copy()
+            if fname_memmap is not None:
+                data_concat = np.memmap(fname_memmap, dtype=dat.dtype, mode='w+', shape=tuple(shape_concat))
+            else:
+                data_concat = np.empty(shape_concat, dtype=dat.dtype)
+        elif np.result_type(data_concat, dat) != data_concat.dtype:
+            data_concat = data_concat.astype(np.result_type(data_concat, dat))
+        index[dim] = slice(offset, offset + shape[dim])
+        data_concat[tuple(index)] = dat
+        offset += shape[dim]
+        del im, dat
+
     # write file
-    im_out = msct_image.empty_like(Image(fname_in_list[0]))
-    im_out.data = data_concat
+    im_out = Image(data_concat, hdr=hdr_concat)
     if isinstance(fname_in_list[0], str):
         im_out.absolutepath = sct.add_suffix(fname_in_list[0], "_concat")
     else:
@@ -476,51 +464,30 @@ def remove_vol(im_in, index_vol_user, todo):
     return im_out
 
 
-def concat_warp2d(fname_list, fname_warp3d, fname_dest):
+def concat_warp2d(fname_list, fname_warp3d, fname_dest, compresslevel=None):
     """
     Concatenate 2d warping fields into a 3d warping field along z dimension. The 3rd dimension of the resulting warping
-    field will be zeroed.
+    field will be zeroed. The 3d field (float32) is written slice by slice, through a memory map if fname_warp3d is an
+    uncompressed .nii file, so that only one 2d field is in memory at a time.
     :param
-    fname_list: list of 2d warping fields (along X and Y).
+    fname_list: list of 2d warping fields (along X and Y). None entries yield a null (identity) displacement.
     fname_warp3d: output name of 3d warping field
     fname_dest: 3d destination file (used to copy header information)
+    compresslevel: gzip compression level of .nii.gz fields, see spinalcordtoolbox.warp.DisplacementFieldWriter
     :return: none
     """
-    from numpy import zeros
     import nibabel as nib
-
-    # get dimensions
-    # nib.load(fname_list[0])
-    # im_0 = Image(fname_list[0])
-    nx, ny = nib.load(fname_list[0]).shape[0:2]
-    nz = len(fname_list)
-    # warp3d = tuple([nx, ny, nz, 1, 3])
-    warp3d = zeros([nx, ny, nz, 1, 3])
-    for iz, fname in enumerate(fname_list):
-        warp2d = nib.load(fname).get_data()
-        warp3d[:, :, iz, 0, 0] = warp2d[:, :, 0, 0, 0]
-        warp3d[:, :, iz, 0, 1] = warp2d[:, :, 0, 0, 1]
-        del warp2d
-    # save new image
-    im_dest = nib.load(fname_dest)
-    affine_dest = im_dest.get_affine()
-    im_warp3d = nib.Nifti1Image(warp3d, affine_dest)
-    # set "intent" code to vector, to be interpreted as warping field
-    im_warp3d.header.set_intent('vector', (), '')
-    nib.save(im_warp3d, fname_warp3d)
-    # copy header from 2d warping field
-    #
-    # im_dest = Image(fname_dest)
-    # im_warp3d = im_dest.copy()
-    # im_warp3d.data = warp3d.astype('float32')
-    # # add dimension between 3rd and 5th
-    # im_warp3d.hdr.set_data_shape([nx, ny, nz, 1, 3])
-    #
-    # im_warp3d.hdr.set_intent('vector', (), '')
-    # im_warp3d.absolutepath = fname_warp3d
-    # # save 3d warping field
-    # im_warp3d.save()
-    # return im_out
+    from spinalcordtoolbox.warp import DisplacementFieldWriter
+
+    # the 3d field is defined on the grid of the destination image, with one slice per 2d field
+    hdr_warp3d = nib.load(fname_dest).header.copy()
+    nx, ny = nib.load([fname for fname in fname_list if fname is not None][0]).shape[0:2]
+    hdr_warp3d.set_data_shape((nx, ny, len(fname_list)))
+    with DisplacementFieldWriter(fname_warp3d, hdr_warp3d, compresslevel) as writer:
+        for iz, fname in enumerate(fname_list):
+            if fname is None:
+                continue
+            writer.data[:, :, iz, 0, :2] = nib.load(fname).dataobj[:, :, 0, 0, :2]
 
 
 def multicomponent_split(im):
@@ -22,7 +22,6 @@ import os
 import sys
 
 import numpy as np
-from scipy import ndimage
 
 from msct_parser import Parser
 import spinalcordtoolbox.image as msct_image
@@ -191,6 +190,8 @@ class ProcessLabels(object):
 
         image_output = msct_image.zeros_like(self.image_input)
 
+        from scipy import ndimage
+
         # loop across labels
         for i, coord in enumerate(self.coordinates):
             # split coord string
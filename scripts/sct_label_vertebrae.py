@@ -23,7 +23,6 @@ import sct_utils as sct
 from spinalcordtoolbox.vertebrae.core import create_label_z, get_z_and_disc_values_from_label, vertebral_detection, \
     clean_labeled_segmentation, label_discs, label_vert
 from spinalcordtoolbox.vertebrae.detect_c2c3 import detect_c2c3
-from spinalcordtoolbox.reports.qc import generate_qc
 
 
 # PARAMETERS
@@ -404,6 +403,7 @@ def main(args=None):
         qc_dataset = arguments.get("-qc-dataset", None)
         qc_subject = arguments.get("-qc-subject", None)
         labeled_seg_file = os.path.join(path_output, file_seg + '_labeled' + ext_seg)
+        from spinalcordtoolbox.reports.qc import generate_qc
         generate_qc(fname_in, fname_seg=labeled_seg_file, args=args, path_qc=os.path.abspath(path_qc),
                     dataset=qc_dataset, subject=qc_subject, process='sct_label_vertebrae')
 
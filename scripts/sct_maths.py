@@ -13,6 +13,7 @@
 from __future__ import division, absolute_import
 
 import sys
+from multiprocessing import cpu_count
 
 import numpy as np
 from msct_parser import Parser
@@ -21,6 +22,10 @@ from sct_utils import printv, extract_fname
 import sct_utils as sct
 
 ALMOST_ZERO = 0.000000001
+DIM_LIST = ['x', 'y', 'z', 't']
+# operations that output an image, by order of priority if several flags are set
+OPERATIONS = ['otsu', 'otsu_adap', 'otsu_median', 'thr', 'percent', 'bin', 'add', 'sub', 'laplacian', 'mul', 'div',
+              'mean', 'rms', 'std', 'smooth', 'dilate', 'erode', 'denoise', 'symmetrize']
 
 
 class Param:
@@ -172,6 +177,22 @@ def get_parser():
                       description='Output type.',
                       mandatory=False,
                       example=['uint8', 'int16', 'int32', 'float32', 'complex64', 'float64', 'int8', 'uint16', 'uint32', 'int64', 'uint64'])
+    parser.add_option(name='-chain',
+                      type_value='str',
+                      description='Run several operations in memory, in the order given, and only write the final '
+                                  'result to -o. Separate operations with ";" and give parameters with "=" as you would '
+                                  'give them to the flag of the same name. Use "o=FILE" to also save an intermediate '
+                                  'result. Consecutive element-wise operations (-thr, -bin, and -add/-sub/-mul/-div with '
+                                  'a number) are fused into a single pass over the data.',
+                      mandatory=False,
+                      example='"thr=0.5;bin=0;o=mask_bin.nii.gz;dilate=2;mul=mask.nii.gz"')
+    parser.add_option(name='-fast',
+                      type_value='multiple_choice',
+                      description='Performance mode: compute in float32, process 2D-per-slice operations and 4D volumes '
+                                  'in parallel, and use distance transforms for ball dilation/erosion of binary images.',
+                      mandatory=False,
+                      default_value='0',
+                      example=['0', '1'])
     parser.add_option(name="-v",
                       type_value="multiple_choice",
                       description="""Verbose. 0: nothing. 1: basic. 2: extended.""",
@@ -185,8 +206,6 @@ def get_parser():
 # ==========================================================================================
 def main(args = None):
 
-    dim_list = ['x', 'y', 'z', 't']
-
     if not args:
         args = sys.argv[1:]
 
@@ -201,120 +220,36 @@ def main(args = None):
         output_type = arguments['-type']
     else:
         output_type = None
+    fast = bool(int(arguments['-fast']))
 
     # Open file(s)
     im = Image(fname_in)
     data = im.data  # 3d or 4d numpy array
     dim = im.dim
+    if fast and data.dtype != np.float32:
+        data = data.astype(np.float32)
 
     # run command
-    if '-otsu' in arguments:
-        param = arguments['-otsu']
-        data_out = otsu(data, param)
-
-    elif '-otsu_adap' in arguments:
-        param = arguments['-otsu_adap']
-        data_out = otsu_adap(data, param[0], param[1])
-
-    elif '-otsu_median' in arguments:
-        param = arguments['-otsu_median']
-        data_out = otsu_median(data, param[0], param[1])
-
-    elif '-thr' in arguments:
-        param = arguments['-thr']
-        data_out = threshold(data, param)
-
-    elif '-percent' in arguments:
-        param = arguments['-percent']
-        data_out = perc(data, param)
-
-    elif '-bin' in arguments:
-        bin_thr = arguments['-bin']
-        data_out = binarise(data, bin_thr=bin_thr)
-
-    elif '-add' in arguments:
-        from numpy import sum
-        data2 = get_data_or_scalar(arguments["-add"], data)
-        data_concat = concatenate_along_4th_dimension(data, data2)
-        data_out = sum(data_concat, axis=3)
-
-    elif '-sub' in arguments:
-        data2 = get_data_or_scalar(arguments['-sub'], data)
-        data_out = data - data2
-
-    elif "-laplacian" in arguments:
-        sigmas = arguments["-laplacian"]
-        if len(sigmas) == 1:
-            sigmas = [sigmas for i in range(len(data.shape))]
-        elif len(sigmas) != len(data.shape):
-            printv(parser.usage.generate(error='ERROR: -laplacian need the same number of inputs as the number of image dimension OR only one input'))
-        # adjust sigma based on voxel size
-        sigmas = [sigmas[i] / dim[i + 4] for i in range(3)]
-        # smooth data
-        data_out = laplacian(data, sigmas)
-
-    elif '-mul' in arguments:
-        from numpy import prod
-        data2 = get_data_or_scalar(arguments["-mul"], data)
-        data_concat = concatenate_along_4th_dimension(data, data2)
-        data_out = prod(data_concat, axis=3)
-
-    elif '-div' in arguments:
-        from numpy import divide
-        data2 = get_data_or_scalar(arguments["-div"], data)
-        data_out = divide(data, data2)
-
-    elif '-mean' in arguments:
-        from numpy import mean
-        dim = dim_list.index(arguments['-mean'])
-        if dim + 1 > len(np.shape(data)):  # in case input volume is 3d and dim=t
-            data = data[..., np.newaxis]
-        data_out = mean(data, dim)
-
-    elif '-rms' in arguments:
-        from numpy import mean, sqrt, square
-        dim = dim_list.index(arguments['-rms'])
-        if dim + 1 > len(np.shape(data)):  # in case input volume is 3d and dim=t
-            data = data[..., np.newaxis]
-        data_out = sqrt(mean(square(data.astype(float)), dim))
-
-    elif '-std' in arguments:
-        from numpy import std
-        dim = dim_list.index(arguments['-std'])
-        if dim + 1 > len(np.shape(data)):  # in case input volume is 3d and dim=t
-            data = data[..., np.newaxis]
-        data_out = std(data, dim, ddof=1)
-
-    elif "-smooth" in arguments:
-        sigmas = arguments["-smooth"]
-        if len(sigmas) == 1:
-            sigmas = [sigmas[0] for i in range(len(data.shape))]
-        elif len(sigmas) != len(data.shape):
-            printv(parser.usage.generate(error='ERROR: -smooth need the same number of inputs as the number of image dimension OR only one input'))
-        # adjust sigma based on voxel size
-        sigmas = [sigmas[i] / dim[i + 4] for i in range(3)]
-        # smooth data
-        data_out = smooth(data, sigmas)
-
-    elif '-dilate' in arguments:
-        data_out = dilate(data, arguments['-dilate'])
-
-    elif '-erode' in arguments:
-        data_out = erode(data, arguments['-erode'])
-
-    elif '-denoise' in arguments:
-        # parse denoising arguments
-        p, b = 1, 5  # default arguments
-        list_denoise = arguments['-denoise']
-        for i in list_denoise:
-            if 'p' in i:
-                p = int(i.split('=')[1])
-            if 'b' in i:
-                b = int(i.split('=')[1])
-        data_out = denoise_nlmeans(data, patch_radius=p, block_radius=b)
-
-    elif '-symmetrize' in arguments:
-        data_out = (data + data[list(range(data.shape[0] - 1, -1, -1)), :, :]) / float(2)
+    list_operation = [op for op in OPERATIONS if '-' + op in arguments]
+    if '-chain' in arguments:
+        try:
+            operations = parse_chain(arguments['-chain'], parser)
+        except ValueError as e:
+            printv(parser.usage.generate(error='ERROR: ' + str(e)))
+
+        def save_intermediate(fname, data_tmp):
+            # header of the input file, already loaded
+            Image(data_tmp, hdr=im.hdr.copy()).save(fname, dtype=output_type)
+            printv('File created: ' + fname, verbose)
+
+        data_out = run_chain(data, operations, dim=dim, fast=fast, save_func=save_intermediate)
+
+    elif list_operation:
+        operation = list_operation[0]
+        try:
+            data_out = compute(data, operation, arguments['-' + operation], dim=dim, fast=fast)
+        except ValueError as e:
+            printv(parser.usage.generate(error='ERROR: ' + str(e)))
 
     elif '-mi' in arguments:
         # input 1 = from flag -i --> im
@@ -377,19 +312,207 @@ def main(args = None):
     else:
         printv('\nDone! File created: ' + fname_out, verbose, 'info')
 
+
+def compute(data, operation, param, dim=None, fast=False):
+    """
+    Apply one operation on data, as done by the flag of the same name
+    :param data: 3d or 4d numpy array
+    :param operation: str: name of the operation, i.e. the flag without dash. See OPERATIONS.
+    :param param: value of the flag, as returned by the parser
+    :param dim: image dimensions as returned by Image.dim. Needed to convert smoothing kernels from mm to voxel.
+    :param fast: bool: performance mode (float32 computation and multi-threading)
+    :return: numpy array
+    """
+    # in performance mode, work in float32 and use all available cores
+    dtype = np.float32 if fast else None
+    n_jobs = cpu_count() if fast else 1
+
+    if operation == 'otsu':
+        return otsu(data, param)
+
+    elif operation == 'otsu_adap':
+        return otsu_adap(data, param[0], param[1], n_jobs=n_jobs)
+
+    elif operation == 'otsu_median':
+        return otsu_median(data, param[0], param[1])
+
+    elif operation == 'thr':
+        return threshold(data, param)
+
+    elif operation == 'percent':
+        return perc(data, param)
+
+    elif operation == 'bin':
+        return binarise(data, bin_thr=param)
+
+    elif operation == 'add':
+        operands = get_operands(param, data)
+        return accumulate(data, operands, np.add, dtype=dtype)
+
+    elif operation == 'sub':
+        data2 = get_data_or_scalar(param, data)
+        return data - data2
+
+    elif operation == 'mul':
+        operands = get_operands(param, data)
+        return accumulate(data, operands, np.multiply, dtype=dtype)
+
+    elif operation == 'div':
+        data2 = get_data_or_scalar(param, data)
+        return np.divide(data, data2)
+
+    elif operation in ['mean', 'rms', 'std']:
+        axis = DIM_LIST.index(param)
+        if axis + 1 > len(np.shape(data)):  # in case input volume is 3d and dim=t
+            data = data[..., np.newaxis]
+        if operation == 'mean':
+            return np.mean(data, axis)
+        elif operation == 'rms':
+            return np.sqrt(np.mean(np.square(data.astype(dtype or float)), axis))
+        else:
+            return np.std(data, axis, ddof=1)
+
+    elif operation in ['smooth', 'laplacian']:
+        sigmas = param
+        if len(sigmas) == 1:
+            sigmas = [sigmas[0] for i in range(len(data.shape))]
+        elif len(sigmas) != len(data.shape):
+            raise ValueError('-{} need the same number of inputs as the number of image dimension OR only one '
+                             'input'.format(operation))
+        # adjust sigma based on voxel size
+        sigmas = [sigmas[i] / dim[i + 4] for i in range(3)]
+        func = smooth if operation == 'smooth' else laplacian
+        return func(data, sigmas, dtype=dtype or float)
+
+    elif operation == 'dilate':
+        return dilate(data, param, use_edt=fast, n_jobs=n_jobs)
+
+    elif operation == 'erode':
+        return erode(data, param, use_edt=fast, n_jobs=n_jobs)
+
+    elif operation == 'denoise':
+        # parse denoising arguments
+        p, b = 1, 5  # default arguments
+        for i in param:
+            if 'p' in i:
+                p = int(i.split('=')[1])
+            if 'b' in i:
+                b = int(i.split('=')[1])
+        return denoise_nlmeans(data, patch_radius=p, block_radius=b)
+
+    elif operation == 'symmetrize':
+        return (data + data[list(range(data.shape[0] - 1, -1, -1)), :, :]) / float(2)
+
+    else:
+        raise ValueError('Unknown operation: {}'.format(operation))
+
+
+def parse_chain(chain, parser):
+    """
+    Parse a chain of operations written as "op1=param1;op2=param2;...", e.g.: "thr=0.5;bin=0;dilate=2;mul=mask.nii.gz".
+    Each parameter is checked and cast as if it was given to the flag of the same name. "o=fname" saves the current
+    result into fname.
+    :param chain: str
+    :param parser: Parser returned by get_parser()
+    :return: list of (operation, param)
+    """
+    operations = []
+    for item in [item.strip() for item in chain.split(';') if item.strip()]:
+        operation, _, param = [x.strip() for x in item.partition('=')]
+        if operation == 'o':
+            if not param:
+                raise ValueError('-chain: "o" needs a file name')
+        elif operation not in OPERATIONS:
+            raise ValueError('-chain: operation "{}" cannot be chained. Available: {}'.format(operation,
+                                                                                            ', '.join(OPERATIONS)))
+        else:
+            param = parser.options['-' + operation].checkIntegrity(param)
+        operations.append((operation, param))
+    return operations
+
+
+def run_chain(data, operations, dim=None, fast=False, save_func=None):
+    """
+    Run a sequence of operations in memory. Consecutive element-wise operations (see is_elementwise) are fused: they are
+    applied slab by slab along z, so that data are traversed once for the whole group and temporaries fit in cache.
+    :param data: 3d or 4d numpy array
+    :param operations: list of (operation, param), see parse_chain(). ('o', fname) calls save_func(fname, data).
+    :param dim: image dimensions as returned by Image.dim
+    :param fast: bool: performance mode
+    :param save_func: function(fname, data) used to write intermediate results
+    :return: numpy array: result of the last operation
+    """
+    group = []
+    for operation, param in operations + [(None, None)]:
+        if operation is not None and is_elementwise(operation, param, data.ndim):
+            group.append((operation, param))
+            continue
+        # flush group of fused operations
+        if len(group) == 1:
+            data = compute(data, group[0][0], group[0][1], dim=dim, fast=fast)
+        elif group:
+            data = _compute_fused(data, group, dim=dim, fast=fast)
+        group = []
+        if operation == 'o':
+            if save_func is not None:
+                save_func(param, data)
+        elif operation is not None:
+            data = compute(data, operation, param, dim=dim, fast=fast)
+    return data
+
+
+def is_elementwise(operation, param, ndim):
+    """
+    Check if an operation only depends on the value of each voxel, so that it can be fused with its neighbours.
+    """
+    if operation in ['thr', 'bin']:
+        return True
+    if operation in ['add', 'sub', 'mul', 'div']:
+        try:
+            float(param)
+        except ValueError:
+            return False
+        # -add and -mul with a 4d input also sum/multiply across time
+        return operation in ['sub', 'div'] or ndim == 3
+    return False
+
+
+def _compute_fused(data, operations, dim=None, fast=False, slab_size=2 ** 20):
+    """
+    Apply element-wise operations slab by slab along z
+    :param slab_size: int: approximate number of voxels per slab
+    """
+    nz = data.shape[2]
+    nz_slab = max(1, slab_size // max(1, data[:, :, 0, ...].size))
+    data_out = None
+    for z0 in range(0, nz, nz_slab):
+        data_slab = data[:, :, z0:z0 + nz_slab, ...]
+        for operation, param in operations:
+            data_slab = compute(data_slab, operation, param, dim=dim, fast=fast)
+        if data_out is None:
+            data_out = np.empty(data.shape, dtype=data_slab.dtype)
+        data_out[:, :, z0:z0 + nz_slab, ...] = data_slab
+    return data_out
+
+
 def otsu(data, nbins):
     from skimage.filters import threshold_otsu
     thresh = threshold_otsu(data, nbins)
     return data > thresh
 
 
-def otsu_adap(data, block_size, offset):
-    from skimage.filters import threshold_adaptive
+def otsu_adap(data, block_size, offset, n_jobs=1):
+    try:
+        from skimage.filters import threshold_adaptive
+    except ImportError:
+        # threshold_adaptive was replaced by threshold_local in scikit-image 0.15
+        from skimage.filters import threshold_local
+
+        def threshold_adaptive(image, block_size, offset):
+            return image > threshold_local(image, block_size, offset=offset)
 
     mask = data
-    for iz in range(data.shape[2]):
-        mask[:, :, iz] = threshold_adaptive(data[:, :, iz], block_size, offset)
-        # mask[:, :, iz] = threshold_otsu(data[:, :, iz], 5)
+    apply_slicewise(lambda data2d: threshold_adaptive(data2d, block_size, offset), data, out=mask, n_jobs=n_jobs)
     return mask
 
 
@@ -414,38 +537,144 @@ def binarise(data, bin_thr=0):
     return data > bin_thr
 
 
-def dilate(data, radius):
+def dilate(data, radius, use_edt=False, n_jobs=1):
     """
     Dilate data using ball structuring element
-    :param data: 2d or 3d array
+    :param data: 2d, 3d or 4d array. 4d arrays are dilated volume by volume.
     :param radius: radius of structuring element OR comma-separated int.
+    :param use_edt: bool: performance mode. For a ball on binary data, threshold a Euclidean distance transform\
+      instead of sliding the structuring element: the cost becomes independent of the radius. For a box, use separable\
+      1d filters.
+    :param n_jobs: int: number of volumes of a 4d array processed in parallel.
     :return: data dilated
     """
-    from skimage.morphology import dilation, ball
-    if len(radius) == 1:
-        # define structured element as a ball
-        selem = ball(radius[0])
-    else:
-        # define structured element as a box with input dimensions
-        selem = np.ones((radius[0], radius[1], radius[2]), dtype=np.dtype)
-    return dilation(data, selem=selem, out=None)
+    return _morphology(data, radius, 'dilation', use_edt=use_edt, n_jobs=n_jobs)
 
 
-def erode(data, radius):
+def erode(data, radius, use_edt=False, n_jobs=1):
     """
     Erode data using ball structuring element
-    :param data: 2d or 3d array
+    :param data: 2d, 3d or 4d array. 4d arrays are eroded volume by volume.
     :param radius: radius of structuring element
+    :param use_edt: bool: performance mode. For a ball on binary data, threshold a Euclidean distance transform\
+      instead of sliding the structuring element: the cost becomes independent of the radius. For a box, use separable\
+      1d filters.
+    :param n_jobs: int: number of volumes of a 4d array processed in parallel.
     :return: data eroded
     """
-    from skimage.morphology import erosion, ball
+    return _morphology(data, radius, 'erosion', use_edt=use_edt, n_jobs=n_jobs)
+
+
+def _morphology(data, radius, operation, use_edt=False, n_jobs=1):
+    """
+    Dispatch dilation/erosion to the cheapest implementation for the structuring element
+    :param operation: 'dilation' or 'erosion'
+    """
+    if data.ndim == 4:
+        out = np.empty_like(data)
+        apply_volumewise(lambda data3d: _morphology(data3d, radius, operation, use_edt=use_edt), data, out=out,
+                         n_jobs=n_jobs)
+        return out
+
     if len(radius) == 1:
+        if use_edt and is_binary(data):
+            return _morphology_edt(data, radius[0], operation)
         # define structured element as a ball
+        from skimage.morphology import ball, dilation, erosion
         selem = ball(radius[0])
+        func = dilation if operation == 'dilation' else erosion
+        return func(data, selem)
     else:
         # define structured element as a box with input dimensions
-        selem = np.ones((radius[0], radius[1], radius[2]), dtype=np.dtype)
-    return erosion(data, selem=selem, out=None)
+        selem = np.ones(radius[:data.ndim], dtype=np.uint8)
+        if use_edt:
+            # a flat box is separable: scipy computes it as a sequence of 1d max/min filters. grey_dilation reflects
+            # the structuring element like skimage does, so that even sizes give the same result as the default mode.
+            from scipy.ndimage import grey_dilation, grey_erosion
+            func = grey_dilation if operation == 'dilation' else grey_erosion
+            return func(data, footprint=selem)
+        from skimage.morphology import dilation, erosion
+        func = dilation if operation == 'dilation' else erosion
+        return func(data, selem)
+
+
+def _morphology_edt(data, radius, operation):
+    """
+    Dilate/erode binary data with a ball of given radius (in voxel) using a Euclidean distance transform: a voxel is in
+    the dilated mask if its distance to the mask is <= radius, and in the eroded mask if its distance to the background
+    is > radius.
+    """
+    from scipy.ndimage import distance_transform_edt
+    mask = data.astype(bool)
+    if operation == 'dilation':
+        if not mask.any():
+            return data.copy()
+        mask_out = distance_transform_edt(~mask) <= radius
+    else:
+        if mask.all():
+            return data.copy()
+        mask_out = distance_transform_edt(mask) > radius
+    return mask_out.astype(data.dtype)
+
+
+def is_binary(data):
+    """
+    Check if data only contains 0 and 1
+    """
+    return bool(np.all((data == 0) | (data == 1)))
+
+
+def apply_slicewise(func, data, out=None, n_jobs=1):
+    """
+    Apply a 2d function to every axial slice of a 3d array
+    :param func: function taking a 2d array and returning a 2d array of the same shape
+    :param data: 3d numpy array
+    :param out: 3d numpy array to store the result in. If None, a new array with data's dtype is created.
+    :param n_jobs: int: number of slices processed in parallel (threads)
+    :return: out
+    """
+    if out is None:
+        out = np.empty_like(data)
+
+    def run_slice(iz):
+        out[:, :, iz] = func(data[:, :, iz])
+
+    _map_index(run_slice, data.shape[2], n_jobs)
+    return out
+
+
+def apply_volumewise(func, data, out=None, n_jobs=1):
+    """
+    Apply a 3d function to every volume of a 4d array
+    :param func: function taking a 3d array and returning a 3d array of the same shape
+    :param data: 4d numpy array
+    :param out: 4d numpy array to store the result in. If None, a new array with data's dtype is created.
+    :param n_jobs: int: number of volumes processed in parallel (threads)
+    :return: out
+    """
+    if out is None:
+        out = np.empty_like(data)
+
+    def run_volume(it):
+        out[..., it] = func(data[..., it])
+
+    _map_index(run_volume, data.shape[3], n_jobs)
+    return out
+
+
+def _map_index(func, n, n_jobs):
+    """
+    Call func(i) for i in range(n), using a pool of n_jobs threads if n_jobs > 1. Threads are enough because numpy,
+    scipy.ndimage and skimage release the GIL in their compiled loops, and they avoid copying data between processes.
+    """
+    if n_jobs > 1 and n > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(n_jobs, n)) as executor:
+            # list() re-raises the first exception raised by a worker
+            list(executor.map(func, range(n)))
+    else:
+        for i in range(n):
+            func(i)
 
 
 def get_data(list_fname):
@@ -488,6 +717,51 @@ def get_data_or_scalar(argument, data_in):
     return data_out
 
 
+def get_operands(argument, data_in):
+    """
+    Get operands from list of file names (scenario 1) or scalar (scenario 2), without concatenating them
+    :param argument: list of file names of scalar
+    :param data_in: if argument is scalar, use data to get np.shape
+    :return: list of 3d or 4d numpy arrays. A scalar is returned as a read-only broadcast view (no memory allocated).
+    """
+    try:
+        return [np.broadcast_to(np.array(float(argument)), data_in.shape)]
+    except ValueError:
+        parser2 = Parser(__file__)
+        parser2.add_option(name='-i', type_value=[[','], 'file'])
+        list_fname = parser2.parse(['-i', argument]).get('-i')
+        list_data = [Image(f_in).data for f_in in list_fname]
+        for fname, data in zip(list_fname[1:], list_data[1:]):
+            if not np.shape(data) == np.shape(list_data[0]):
+                printv('\nWARNING: shape(' + fname + ')=' + str(np.shape(data)) + ' incompatible with shape(' + list_fname[0] + ')=' + str(np.shape(list_data[0])), 1, 'warning')
+                printv('\nERROR: All input images must have same dimensions.', 1, 'error')
+        return list_data
+
+
+def accumulate(data, operands, ufunc, dtype=None):
+    """
+    Reduce data and operands with np.add or np.multiply across the 4th dimension. This gives the same result as
+    concatenating all inputs along the 4th dimension and summing (or multiplying) along axis 3, but accumulates in-place
+    into a single output array instead of building the concatenated array.
+    :param data: 3d or 4d numpy array
+    :param operands: list of 3d or 4d numpy arrays
+    :param ufunc: np.add or np.multiply
+    :param dtype: output dtype. If None, use the dtype numpy.sum/numpy.prod would return for the concatenated inputs.
+    :return: 3d numpy array
+    """
+    if dtype is None:
+        reduce_func = np.sum if ufunc is np.add else np.prod
+        dtype = reduce_func(np.zeros(1, dtype=np.result_type(data, *operands))).dtype
+
+    def reduce_t(d):
+        return ufunc.reduce(d, axis=3, dtype=dtype) if d.ndim == 4 else d
+
+    data_out = np.array(reduce_t(data), dtype=dtype)
+    for operand in operands:
+        ufunc(data_out, reduce_t(operand), out=data_out)
+    return data_out
+
+
 def concatenate_along_4th_dimension(data1, data2):
     """
     Concatenate two data along 4th dimension.
@@ -521,25 +795,26 @@ def denoise_nlmeans(data_in, patch_radius=1, block_radius=5):
     return denoised
 
 
-def smooth(data, sigmas):
+def smooth(data, sigmas, dtype=float):
     """
     Smooth data by convolving Gaussian kernel
     :param data: input 3D numpy array
     :param sigmas: Kernel SD in voxel
+    :param dtype: output (and computation) dtype
     :return:
     """
     assert len(data.shape) == len(sigmas)
     from scipy.ndimage.filters import gaussian_filter
-    return gaussian_filter(data.astype(float), sigmas, order=0, truncate=4.0)
+    return gaussian_filter(data, sigmas, output=dtype, order=0, truncate=4.0)
 
 
-def laplacian(data, sigmas):
+def laplacian(data, sigmas, dtype=float):
     """
     Apply Laplacian filter
     """
     assert len(data.shape) == len(sigmas)
     from scipy.ndimage.filters import gaussian_laplace
-    return gaussian_laplace(data.astype(float), sigmas)
+    return gaussian_laplace(data, sigmas, output=dtype)
     # from scipy.ndimage.filters import laplace
     # return laplace(data.astype(float))
 
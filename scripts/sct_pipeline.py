@@ -45,9 +45,15 @@ usage:
 
 from __future__ import print_function, absolute_import
 
-import sys, io, os, types, copy, copy_reg, time, itertools, glob, importlib, pickle
+import sys, io, os, types, copy, time, itertools, glob, importlib, pickle, json, logging
 import platform
 import signal
+try:
+    import copy_reg
+except ImportError:
+    import copyreg as copy_reg
+
+import sct_utils as sct
 
 path_script = os.path.dirname(__file__)
 sys.path.append(os.path.join(sct.__sct_dir__, 'testing'))
@@ -66,11 +72,13 @@ from multiprocessing import cpu_count
 import numpy as np
 import h5py
 import pandas as pd
+import psutil
 
-import sct_utils as sct
 import msct_parser
 import sct_testing
 
+logger = logging.getLogger(__name__)
+
 def _pickle_method(method):
     """
     Author: Steven Bethard (author of argparse)
@@ -103,6 +111,16 @@ def _unpickle_method(func_name, obj, cls):
 
 copy_reg.pickle(types.MethodType, _pickle_method, _unpickle_method)
 
+# memory required by one job (in GB), used to avoid overcommitting RAM when scheduling jobs
+MEMORY_PER_JOB = {
+    'sct_deepseg_gm': 4.,
+    'sct_deepseg_lesion': 4.,
+    'sct_deepseg_sc': 4.,
+}
+MEMORY_PER_JOB_DEFAULT = 1.
+# when jobs are waiting for memory, available memory is checked again at this interval (in seconds)
+MEMORY_POLL_INTERVAL = 10.
+
 
 def generate_data_list(folder_dataset, verbose=1):
     """
@@ -241,7 +259,110 @@ def read_database(folder_dataset, specifications=None, fname_database='', verbos
 #         logger.exception(e)
 #         raise
 
+class JobTimeout(Exception):
+    pass
+
+
+def _raise_job_timeout(signum, frame):
+    raise JobTimeout()
+
+
+def _kill_job_processes():
+    """
+    Kill the processes started by the current job: descendants of the current process, and, if the current process
+    leads its own process group (see function_launcher()), the other processes of the group, e.g. orphaned
+    grandchildren whose parent already exited.
+    """
+    process = psutil.Process()
+    list_proc = process.children(recursive=True)
+    pgid = os.getpgrp()
+    if pgid == process.pid:
+        pid_children = set(p.pid for p in list_proc)
+        for p in psutil.process_iter():
+            try:
+                if p.pid != pgid and p.pid not in pid_children and os.getpgid(p.pid) == pgid:
+                    list_proc.append(p)
+            except (OSError, psutil.Error):
+                pass
+    for p in list_proc:
+        try:
+            p.kill()
+        except psutil.Error:
+            pass
+    psutil.wait_procs(list_proc, timeout=5)
+
+
+def call_with_timeout(function, timeout, *args):
+    """
+    Call function(*args), and stop it after timeout seconds: JobTimeout is raised and the processes started by the
+    call are killed (see _kill_job_processes()). Must be called from the main thread (SIGALRM).
+    :param timeout: int: in seconds, 0 or None: no timeout
+    """
+    if not timeout:
+        return function(*args)
+    handler_orig = signal.signal(signal.SIGALRM, _raise_job_timeout)
+    signal.alarm(int(timeout))
+    try:
+        return function(*args)
+    except JobTimeout:
+        signal.alarm(0)
+        _kill_job_processes()
+        raise
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, handler_orig)
+
+
+class JobLedger(object):
+    """
+    On-disk ledger of finished jobs, stored as JSON lines: each job is appended with its results as soon as it is done,
+    so that results are not lost if the run is interrupted, and so that a run can be resumed by skipping finished jobs.
+    Jobs that crashed (status 1) are not considered finished, and are run again when resuming.
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        self.entries = {}
+        if os.path.isfile(fname):
+            with open(fname, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # truncated line, e.g. if the previous run was killed while writing
+                        continue
+                    self.entries[self.key(entry['job'])] = entry
+
+    @staticmethod
+    def key(job):
+        """
+        :param job: (function, path_subject, args, test_integrity)
+        """
+        return json.dumps(list(job[:4]))
+
+    def is_done(self, job):
+        entry = self.entries.get(self.key(job))
+        return entry is not None and 1 not in entry['status']
+
+    def add(self, job, results):
+        entry = {'job': list(job[:4]),
+                 'status': [int(status) for status in results['status']],
+                 'results': json.loads(results.to_json(orient='split'))}
+        self.entries[self.key(job)] = entry
+        with open(self.fname, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def get_results(self, job):
+        return pd.read_json(json.dumps(self.entries[self.key(job)]['results']), orient='split')
+
+
 def function_launcher(args):
+    """
+    Run one job.
+    :param args: (function, path_subject, args, test_integrity[, timeout]). timeout: in seconds, 0 or None: no timeout
+    :return: DataFrame with results
+    """
     # append local script to PYTHONPATH for import
     sys.path.append(os.path.join(sct.__sct_dir__, "testing"))
     # retrieve param class from sct_testing
@@ -251,12 +372,23 @@ def function_launcher(args):
     param_testing.args = args[2]
     param_testing.test_integrity = args[3]
     param_testing.redirect_stdout = True  # create individual logs for each subject.
+    timeout = args[4] if len(args) > 4 else None
     # load modules of function to test
     module_testing = importlib.import_module('test_' + param_testing.function_to_test)
     # initialize parameters specific to the test
     param_testing = module_testing.init(param_testing)
+    if timeout and os.getpgrp() != os.getpid():
+        # the worker leads its own process group, so that processes left by a job can be found and killed on timeout
+        try:
+            os.setpgrp()
+        except OSError as e:
+            logger.debug('Could not create a process group for the worker: %s' % e)
     try:
-        param_testing = sct_testing.test_function(param_testing)
+        param_testing = call_with_timeout(sct_testing.test_function, timeout, param_testing)
+    except JobTimeout:
+        logger.error('%s: timeout after %ss' % ('test_' + args[0], timeout))
+        from pandas import DataFrame
+        param_testing.results = DataFrame(index=[''], data={'status': int(1), 'output': 'ERROR: Function timed out.'})
     except:
         import traceback
         logger.error('%s: %s' % ('test_' + args[0], traceback.format_exc()))
@@ -283,6 +415,19 @@ def init_worker():
     signal.signal(signal.SIGINT, signal.SIG_IGN)
 
 
+def _nb_job_startable(nb_job_running, nb_job_max, memory_per_job):
+    """
+    Number of jobs that can be started now, given the memory currently available (which accounts for the memory used
+    by running jobs). At least one job is started if none is running, so that the run always progresses.
+    :param memory_per_job: float: memory required by one job (in GB)
+    """
+    memory_available = psutil.virtual_memory().available / 1024. ** 3
+    nb_job = min(nb_job_max - nb_job_running, int(memory_available // memory_per_job))
+    if nb_job_running == 0:
+        nb_job = max(nb_job, 1)
+    return max(nb_job, 0)
+
+
 def get_list_subj(folder_dataset, data_specifications=None, fname_database=''):
     """
     Generate list of eligible subjects from folder and file containing database
@@ -310,9 +455,16 @@ def get_list_subj(folder_dataset, data_specifications=None, fname_database=''):
     return list_subj
 
 
-def run_function(function, folder_dataset, list_subj, list_args=[], nb_cpu=None, verbose=1, test_integrity=0):
+def run_function(function, folder_dataset, list_subj, list_args=[], nb_cpu=None, verbose=1, test_integrity=0,
+                 fname_ledger=None, timeout=None, memory_per_job=None):
     """
     Run a test function on the dataset using multiprocessing and save the results
+    :param fname_ledger: JSON lines file where results of each job are written as soon as the job is done. If the file
+    exists, jobs that are already in it are not run again (resume an interrupted run).
+    :param timeout: int: maximum duration of one job (in seconds). Default: no limit
+    :param memory_per_job: float: memory required by one job (in GB). Jobs are started only if enough memory is
+    available at that time, and otherwise wait until running jobs or other processes free memory. Default: see
+    MEMORY_PER_JOB
     :return: results
     # results are organized as the following: tuple of (status, output, DataFrame with results)
     """
@@ -325,36 +477,65 @@ def run_function(function, folder_dataset, list_subj, list_args=[], nb_cpu=None,
 
     # create list that finds all the combinations for function + subject path + arguments. Example of one list element:
     # ('sct_propseg', os.path.join(path_sct, 'data', 'sct_test_function', '200_005_s2''), '-i ' + os.path.join("t2", "t2.nii.gz") + ' -c t2', 1)
-    list_func_subj_args = list(itertools.product(*[[function], list_subj_path, list_args, [test_integrity]]))
+    list_func_subj_args = list(itertools.product(*[[function], list_subj_path, list_args, [test_integrity], [timeout]]))
         # data_and_params = itertools.izip(itertools.repeat(function), data_subjects, itertools.repeat(parameters))
 
-    logger.debug("stating pool with {} thread(s)".format(nb_cpu))
+    # skip jobs that were already done in a previous run
+    ledger = JobLedger(fname_ledger) if fname_ledger else None
+    if ledger is not None:
+        list_job_todo = [job for job in list_func_subj_args if not ledger.is_done(job)]
+        if len(list_job_todo) < len(list_func_subj_args):
+            logger.info('Resuming from {}: {}/{} jobs already done'.format(
+                fname_ledger, len(list_func_subj_args) - len(list_job_todo), len(list_func_subj_args)))
+    else:
+        list_job_todo = list_func_subj_args
+
+    # memory-aware scheduling: available memory is checked each time jobs are started, see _nb_job_startable()
+    if memory_per_job is None:
+        memory_per_job = MEMORY_PER_JOB.get(function, MEMORY_PER_JOB_DEFAULT)
+    nb_job_max = nb_cpu or cpu_count()
+
+    logger.debug("stating pool with {} thread(s), {}GB per job".format(nb_cpu, memory_per_job))
     pool = PoolExecutor(nb_cpu)
     compute_time = None
+    future_dirs = {}
     try:
         compute_time = time.time()
-        count = 0
-        all_results = []
+        count = len(list_func_subj_args) - len(list_job_todo)
+        all_results = {}
 
         # logger.info('Waiting for results, be patient')
-        future_dirs = {pool.submit(function_launcher, subject_arg): subject_arg
-                         for subject_arg in list_func_subj_args}
-
-        for future in concurrent.futures.as_completed(future_dirs):
-            count += 1
-            subject = os.path.basename(future_dirs[future][1])
-            arguments = future_dirs[future][2]
-            try:
-                result = future.result()
-                sct.no_new_line_log('Processing subjects... {}/{}'.format(count, len(list_func_subj_args)))
-                all_results.append(result)
-            except Exception as exc:
-                logger.error('{} {} generated an exception: {}'.format(subject, arguments, exc))
+        list_job_pending = list(reversed(list_job_todo))
+        while list_job_pending or future_dirs:
+            if list_job_pending:
+                for i in range(min(len(list_job_pending), _nb_job_startable(len(future_dirs), nb_job_max,
+                                                                            memory_per_job))):
+                    subject_arg = list_job_pending.pop()
+                    future_dirs[pool.submit(function_launcher, subject_arg)] = subject_arg
+            # jobs waiting for memory: check available memory again after some time, even if no job is done
+            done, _ = concurrent.futures.wait(future_dirs, return_when=concurrent.futures.FIRST_COMPLETED,
+                                              timeout=MEMORY_POLL_INTERVAL if list_job_pending else None)
+            for future in done:
+                count += 1
+                subject_arg = future_dirs.pop(future)
+                subject = os.path.basename(subject_arg[1])
+                arguments = subject_arg[2]
+                try:
+                    result = future.result()
+                    all_results[subject_arg] = result
+                    # write results to disk as soon as they are available
+                    if ledger is not None:
+                        ledger.add(subject_arg, result)
+                    sct.printv('Processing subjects... {}/{}'.format(count, len(list_func_subj_args)), verbose)
+                except Exception as exc:
+                    logger.error('{} {} generated an exception: {}'.format(subject, arguments, exc))
 
         compute_time = time.time() - compute_time
 
-        # concatenate all_results into single Panda structure
-        results_dataframe = pd.concat(all_results)
+        # concatenate all_results into single Panda structure, in the order of jobs, including results of previous runs
+        results_dataframe = pd.concat([all_results[job] if job in all_results else ledger.get_results(job)
+                                       for job in list_func_subj_args if job in all_results or
+                                       (ledger is not None and ledger.is_done(job))])
 
     except KeyboardInterrupt:
         logger.warning("\nCaught KeyboardInterrupt, terminating workers")
@@ -421,6 +602,21 @@ def get_parser():
                       mandatory=False,
                       example='42')
 
+    parser.add_option(name="-timeout",
+                      type_value="int",
+                      description="Maximum duration of one job, in seconds. Jobs that take longer are stopped and"
+                                  " reported as crashed. By default, there is no limit.",
+                      mandatory=False,
+                      example='3600')
+
+    parser.add_option(name="-mem",
+                      type_value="float",
+                      description="Memory required by one job, in GB. Jobs are started only when enough memory is"
+                                  " available. By default, 4GB for deep learning functions (sct_deepseg_*), 1GB"
+                                  " otherwise.",
+                      mandatory=False,
+                      example='8')
+
     parser.add_option(name="-test-integrity",
                       type_value="multiple_choice",
                       description="Run (=1) or not (=0) integrity testing which is defined in test_integrity() function of the test_ script. See example here: https://github.com/neuropoly/spinalcordtoolbox/blob/master/testing/test_sct_propseg.py",
@@ -437,6 +633,16 @@ def get_parser():
                       example=['0', '1'],
                       default_value='1')
 
+    parser.add_option(name="-ledger",
+                      type_value="str",
+                      description="Job ledger (JSON lines). Results of each job are appended to this file as soon as"
+                                  " the job is done. If the file already exists, jobs that are already in it are"
+                                  " skipped: to resume an interrupted run, pass its ledger. By default, a new"
+                                  " ledger is created for each run, named after the log file, so that results of"
+                                  " previous runs are never reused unless requested.",
+                      mandatory=False,
+                      example='ledger.jsonl')
+
     parser.add_option(name="-pickle",
                       type_value='multiple_choice',
                       description="Output Pickle file.",
@@ -499,6 +705,8 @@ if __name__ == "__main__":
     else:
         jobs = cpu_count()  # uses maximum number of available CPUs
     test_integrity = int(arguments['-test-integrity'])
+    timeout = arguments.get('-timeout', None)
+    memory_per_job = arguments.get('-mem', None)
     create_log = int(arguments['-log'])
     output_pickle = int(arguments['-pickle'])
 
@@ -530,9 +738,10 @@ if __name__ == "__main__":
     output_time = time.strftime("%y%m%d%H%M%S")
 
     # build log file name
+    file_log = "_".join([output_time, function_to_test, sct.__get_branch().replace("/", "~")]).replace("sct_", "")
+    fname_ledger = arguments.get('-ledger', file_log + '.jsonl')
     if create_log:
         # global log:
-        file_log = "_".join([output_time, function_to_test, sct.__get_branch().replace("/", "~")]).replace("sct_", "")
         fname_log = file_log + '.log'
         # handle_log = sct.ForkStdoutToFile(fname_log)
         file_handler = sct.add_file_handler_to_logger(fname_log)
@@ -583,7 +792,9 @@ if __name__ == "__main__":
             sct.remove_handler(file_handler)
         # run function
         logger.debug("enter test fct")
-        tests_ret = run_function(function_to_test, path_data, list_subj, list_args=list_args, nb_cpu=jobs, verbose=1, test_integrity=test_integrity)
+        tests_ret = run_function(function_to_test, path_data, list_subj, list_args=list_args, nb_cpu=jobs, verbose=1,
+                                 test_integrity=test_integrity, fname_ledger=fname_ledger, timeout=timeout,
+                                 memory_per_job=memory_per_job)
         logger.debug("exit test fct")
         results = tests_ret['results']
         compute_time = tests_ret['compute_time']
@@ -26,7 +26,6 @@ import sct_image
 import sct_utils as sct
 from msct_parser import Parser
 from spinalcordtoolbox.centerline import optic
-from spinalcordtoolbox.reports.qc import generate_qc
 
 
 def check_and_correct_segmentation(fname_segmentation, fname_centerline, folder_output='', threshold_distance=5.0,
@@ -613,6 +612,7 @@ def main(arguments):
     qc_dataset = arguments.get("-qc-dataset", None)
     qc_subject = arguments.get("-qc-subject", None)
     if path_qc is not None:
+        from spinalcordtoolbox.reports.qc import generate_qc
         generate_qc(fname_in1=fname_input_data, fname_seg=fname_seg, args=args, path_qc=os.path.abspath(path_qc),
                     dataset=qc_dataset, subject=qc_subject, process='sct_propseg')
     sct.display_viewer_syntax([fname_input_data, fname_seg], colormaps=['gray', 'red'], opacities=['', '1'])
@@ -41,7 +41,7 @@ import sct_utils as sct
 from msct_parser import Parser
 import spinalcordtoolbox.image as msct_image
 from spinalcordtoolbox.image import Image
-from spinalcordtoolbox.reports.qc import generate_qc
+from spinalcordtoolbox import profiling
 
 
 def get_parser(paramreg=None):
@@ -560,6 +560,7 @@ def main(args=None):
 
     if path_qc is not None:
         if fname_dest_seg:
+            from spinalcordtoolbox.reports.qc import generate_qc
             generate_qc(fname_src2dest, fname_in2=fname_dest, fname_seg=fname_dest_seg, args=args,
                         path_qc=os.path.abspath(path_qc), dataset=qc_dataset, subject=qc_subject,
                         process='sct_register_multimodal')
@@ -573,6 +574,7 @@ def main(args=None):
 
 # register images
 # ==========================================================================================
+@profiling.span('registration')
 def register(src, dest, paramreg, param, i_step_str):
     # initiate default parameters of antsRegistration transformation
     ants_registration_params = {'rigid': '', 'affine': '', 'compositeaffine': '', 'similarity': '', 'translation': '',
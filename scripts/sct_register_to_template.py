@@ -31,7 +31,6 @@ from msct_register_landmarks import register_landmarks
 import spinalcordtoolbox.image as msct_image
 from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.centerline.core import get_centerline
-from spinalcordtoolbox.reports.qc import generate_qc
 from spinalcordtoolbox.resampling import resample_file
 
 # DEFAULT PARAMETERS
@@ -678,6 +677,7 @@ def main(args=None):
     qc_dataset = arguments.get("-qc-dataset", None)
     qc_subject = arguments.get("-qc-subject", None)
     if param.path_qc is not None:
+        from spinalcordtoolbox.reports.qc import generate_qc
         generate_qc(fname_data, fname_in2=fname_template2anat, fname_seg=fname_seg, args=args,
                     path_qc=os.path.abspath(param.path_qc), dataset=qc_dataset, subject=qc_subject,
                     process='sct_register_to_template')
@@ -16,16 +16,30 @@
 from __future__ import print_function, division, absolute_import
 
 import sys, io, os, re, time, datetime, platform
+import atexit
 import errno
+import collections
 import logging
+import runpy
+import shlex
 import shutil
 import subprocess
 import tempfile
-
-import numpy as np
+import threading
+import traceback
 
 logger = logging.getLogger(__name__)
 
+# SCT scripts that are always run in a separate process by run()
+RUN_SUBPROCESS = ['sct_check_dependencies', 'sct_download_data', 'sct_pipeline', 'sct_testing']
+# depth of nested SCT scripts run in the current process
+_inprocess_depth = 0
+# maximum size of the output of a subprocess kept by run() (the end of the output is kept)
+RUN_OUTPUT_MAX = 16 << 20
+# executor of run_async(), and lock of its creation and of the run log
+_run_executor = None
+_run_lock = threading.Lock()
+
 if os.getenv('SENTRY_DSN', None):
     # do no import if Sentry is not set (i.e., if variable SENTRY_DSN is not defined)
     import raven
@@ -35,13 +49,13 @@ if sys.hexversion < 0x03030000:
     def list2cmdline(lst):
         return " ".join(pipes.quote(x) for x in lst)
 else:
-    import shlex
     def list2cmdline(lst):
         return " ".join(shlex.quote(x) for x in lst)
 
 
 from spinalcordtoolbox import __version__, __sct_dir__, __data_dir__
-from spinalcordtoolbox.utils import check_exe
+from spinalcordtoolbox import profiling
+from spinalcordtoolbox.utils import check_exe, is_tmp_path, get_compresslevel, recompress
 
 
 def init_sct(log_level=1, update=False):
@@ -69,8 +83,8 @@ def init_sct(log_level=1, update=False):
     logger.setLevel(getattr(logging, dict_log_levels[log_level]))
     logging.root.setLevel(getattr(logging, dict_log_levels[log_level]))
 
-    if not update:
-        # Initialize logging
+    if not update and not _inprocess_depth:
+        # Initialize logging. Not done for scripts run in-process by run(), which capture the logging of the caller
         hdlr = logging.StreamHandler(sys.stdout)
         fmt = logging.Formatter()
         fmt.format = _format_wrap(fmt.format)
@@ -81,6 +95,8 @@ def init_sct(log_level=1, update=False):
         init_error_client()
         if os.environ.get("SCT_TIMER", None) is not None:
             add_elapsed_time_counter()
+        if os.environ.get("SCT_PROFILE", None):
+            profiling.enable(os.environ["SCT_PROFILE"])
 
 
 def add_elapsed_time_counter():
@@ -239,6 +255,15 @@ def which_sct_binaries():
 
 
 def run(cmd, verbose=1, raise_exception=True, cwd=None, env=None, is_sct_binary=False):
+    """
+    Run a command. SCT scripts (sct_*) are run in the current interpreter (see run_inprocess()) to avoid the startup
+    cost of a new Python process, unless SCT_RUN_INPROCESS=0 is set, a specific environment is requested, or the
+    command is called from a thread other than the main thread.
+    The output of subprocesses is read by chunks as it comes, and only its end is kept (see RUN_OUTPUT_MAX).
+    Timing and exit status of each command are recorded, see _log_run(). To run several commands concurrently, use
+    run_async() or run_many().
+    :return: status, output
+    """
     # if verbose == 2:
     #     printv(sys._getframe().f_back.f_code.co_name, 1, 'process')
 
@@ -247,6 +272,18 @@ def run(cmd, verbose=1, raise_exception=True, cwd=None, env=None, is_sct_binary=
 
     if env is None:
         env = os.environ
+        fname_script, args = _get_inprocess_script(cmd)
+        if fname_script is not None:
+            cmdline = cmd if isinstance(cmd, str) else list2cmdline(cmd)
+            if verbose:
+                printv("%s # in %s" % (cmdline, cwd), 1, 'code')
+            time_start = time.time()
+            with profiling.span(os.path.basename(fname_script)[:-3], kind='inprocess', cmd=cmdline):
+                status, output = run_inprocess(fname_script, args, verbose=verbose, cwd=cwd)
+            _log_run(cmdline, cwd, 'inprocess', time_start, status, len(output))
+            if status != 0 and raise_exception:
+                raise RunError(output)
+            return status, output
 
     if sys.hexversion < 0x03000000 and isinstance(cmd, unicode):
         cmd = str(cmd)
@@ -285,24 +322,25 @@ def run(cmd, verbose=1, raise_exception=True, cwd=None, env=None, is_sct_binary=
 
     shell = isinstance(cmd, str)
 
-    process = subprocess.Popen(cmd, shell=shell, cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
-    output_final = ''
-    while True:
-        # Watch out for deadlock!!!
-        output = process.stdout.readline().decode("utf-8")
-        if output == '' and process.poll() is not None:
-            break
-        if output:
-            if verbose == 2:
-                printv(output.strip())
-            output_final += output.strip() + '\n'
-
-    status = process.returncode
-    output = output_final.rstrip()
-
-    # process.stdin.close()
-    # process.stdout.close()
-    # process.terminate()
+    # subprocesses are recorded as separate spans when profiling is enabled
+    name = cmd[0] if isinstance(cmd, list) else cmd.split(" ", 1)[0]
+    time_start = time.time()
+    with profiling.span(os.path.basename(name), kind='subprocess', cmd=cmdline):
+        process = subprocess.Popen(cmd, shell=shell, cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+        buffer = _OutputBuffer(RUN_OUTPUT_MAX, verbose == 2)
+        fd = process.stdout.fileno()
+        while True:
+            # chunks of output are read as soon as they are available
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            buffer.write(chunk)
+        process.stdout.close()
+        process.stdin.close()
+        status = process.wait()
+
+    output = buffer.getvalue()
+    _log_run(cmdline, cwd, 'subprocess', time_start, status, buffer.nbytes)
 
     if status != 0 and raise_exception:
         raise RunError(output)
@@ -310,6 +348,218 @@ def run(cmd, verbose=1, raise_exception=True, cwd=None, env=None, is_sct_binary=
     return status, output
 
 
+def run_async(cmd, verbose=1, raise_exception=True, cwd=None, env=None, is_sct_binary=False):
+    """
+    Run a command in the background (see run()). At most SCT_RUN_JOBS commands (default: number of CPUs) run at once,
+    the next ones wait for their turn. SCT scripts are run in a subprocess.
+    :return: concurrent.futures.Future, whose result is: status, output
+    """
+    global _run_executor
+    with _run_lock:
+        if _run_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _run_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('SCT_RUN_JOBS', _cpu_count())))
+    return _run_executor.submit(run, cmd, verbose=verbose, raise_exception=raise_exception, cwd=cwd, env=env,
+                                is_sct_binary=is_sct_binary)
+
+
+def run_many(list_cmd, n_jobs=None, verbose=1, raise_exception=True, cwd=None, env=None, is_sct_binary=False):
+    """
+    Run independent commands concurrently (see run()). When several commands run simultaneously, ITK threads are
+    divided among them to avoid oversubscribing the CPUs.
+    :param list_cmd: list of commands
+    :param n_jobs: maximum number of commands running at once. Default: number of CPUs
+    :return: list of (status, output), in the order of list_cmd. If raise_exception, the first failure (in the order of
+    list_cmd) is raised once the running commands are done, and the commands not started yet are cancelled.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    n_jobs = max(1, min(n_jobs or _cpu_count(), len(list_cmd)))
+    if n_jobs > 1:
+        env = dict(os.environ if env is None else env)
+        env['ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS'] = str(max(1, int(
+            env.get('ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS', _cpu_count())) // n_jobs))
+
+    # each worker thread waits for its own subprocess, so the number of running processes is bounded by n_jobs
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [executor.submit(run, cmd, verbose=verbose, raise_exception=raise_exception, cwd=cwd, env=env,
+                                   is_sct_binary=is_sct_binary) for cmd in list_cmd]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def _cpu_count():
+    import multiprocessing
+    return multiprocessing.cpu_count()
+
+
+def _log_run(cmdline, cwd, kind, time_start, status, nbytes):
+    """
+    Record a command run by run(): timing and exit status are logged (debug level), and appended as a JSON line to the
+    file set by the SCT_RUN_LOG environment variable, if any
+    """
+    record = {
+        'cmd': cmdline,
+        'cwd': cwd,
+        'kind': kind,
+        'thread': threading.current_thread().name,
+        'start': datetime.datetime.fromtimestamp(time_start).isoformat(),
+        'wall_time': time.time() - time_start,
+        'status': status,
+        'output_bytes': nbytes,
+    }
+    logger.debug("Command run in %.2fs, status %d: %s", record['wall_time'], status, cmdline)
+    fname_log = os.environ.get('SCT_RUN_LOG')
+    if fname_log:
+        import json
+        with _run_lock:
+            with io.open(fname_log, 'a', encoding='utf-8') as f:
+                f.write(u"%s\n" % json.dumps(record))
+
+
+class _OutputBuffer(object):
+    """
+    Output of a subprocess, read by chunks: only the last maxsize bytes are kept (ring buffer), so that very verbose
+    commands don't use unbounded memory
+    """
+    def __init__(self, maxsize, echo=False):
+        self.maxsize = maxsize
+        self.echo = echo
+        self.chunks = collections.deque()
+        self.size = 0  # size of the chunks kept
+        self.nbytes = 0  # size of the whole output
+        self._line = b''  # incomplete line, for echo
+
+    def write(self, chunk):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self.nbytes += len(chunk)
+        while self.size - len(self.chunks[0]) >= self.maxsize:
+            self.size -= len(self.chunks.popleft())
+        if self.echo:
+            lines = (self._line + chunk).split(b'\n')
+            self._line = lines.pop()
+            for line in lines:
+                printv(line.decode('utf-8', 'replace').strip())
+
+    def getvalue(self):
+        """
+        :return: output, with stripped lines
+        """
+        if self.echo and self._line:
+            printv(self._line.decode('utf-8', 'replace').strip())
+            self._line = b''
+        data = b''.join(self.chunks)
+        header = []
+        if self.nbytes > len(data) or len(data) > self.maxsize:
+            # drop the beginning of the output, up to the first complete line
+            data = data[-self.maxsize:]
+            data = data[data.find(b'\n') + 1:]
+            header = ['[... %d bytes of output dropped]' % (self.nbytes - len(data))]
+        lines = [line.strip() for line in data.decode('utf-8', 'replace').splitlines()]
+        return '\n'.join(header + lines).rstrip()
+
+
+def _get_inprocess_script(cmd):
+    """
+    Get the SCT script to run in-process for a command, if any
+    :param cmd: list or str
+    :return: fname_script, args. fname_script is None if the command must be run in a subprocess
+    """
+    if os.environ.get('SCT_RUN_INPROCESS', '1') == '0' or not isinstance(threading.current_thread(), threading._MainThread):
+        return None, None
+    if isinstance(cmd, str):
+        # shell features need a shell
+        if any(c in cmd for c in '|&;<>()$`*?~\n'):
+            return None, None
+        cmd = shlex.split(cmd)
+    if not cmd or not cmd[0].startswith('sct_') or cmd[0] in RUN_SUBPROCESS:
+        return None, None
+    fname_script = os.path.join(__sct_dir__, 'scripts', cmd[0] + '.py')
+    if not os.path.isfile(fname_script):
+        return None, None
+    return fname_script, list(cmd[1:])
+
+
+class _OutputCapture(object):
+    """
+    File-like object collecting the output of a script run in-process (replaces sys.stdout and sys.stderr). As for
+    subprocesses, only the last maxsize bytes are kept (see _OutputBuffer).
+    """
+    def __init__(self, stream=None, maxsize=None):
+        self.stream = stream
+        self.buffer = _OutputBuffer(RUN_OUTPUT_MAX if maxsize is None else maxsize)
+
+    def write(self, text):
+        if sys.hexversion < 0x03000000 and isinstance(text, str):
+            self.buffer.write(text)
+        else:
+            self.buffer.write(text.encode('utf-8', 'replace'))
+        if self.stream is not None:
+            self.stream.write(text)
+
+    def flush(self):
+        if self.stream is not None:
+            self.stream.flush()
+
+    def isatty(self):
+        return False
+
+    def getvalue(self):
+        return self.buffer.getvalue()
+
+
+def run_inprocess(fname_script, args, verbose=1, cwd=None):
+    """
+    Run an SCT script in the current interpreter, as if it was run from the command line. The working directory,
+    command-line arguments, standard output and logging are isolated, and restored after the script is done.
+    :param fname_script: path to the script
+    :param args: list of command-line arguments
+    :param verbose: output of the script is displayed if verbose == 2, as with run()
+    :param cwd: working directory
+    :return: status, output: exit status (0 if the script succeeded), output of the script (stdout, stderr and logging)
+    """
+    global _inprocess_depth
+    capture = _OutputCapture(sys.__stdout__ if verbose == 2 else None)
+    handler = logging.StreamHandler(capture)
+    state = (os.getcwd(), sys.argv, sys.stdout, sys.stderr, logging.root.handlers[:], logging.root.level, logger.level)
+    logging.root.handlers = [handler]
+    sys.argv = [fname_script] + args
+    sys.stdout = sys.stderr = capture
+    _inprocess_depth += 1
+    tmp_folders, status = _tmp_folders[:], 1
+    try:
+        if cwd is not None:
+            os.chdir(cwd)
+        runpy.run_path(fname_script, run_name='__main__')
+        status = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            # same as the exit status of a process
+            status = (e.code or 0) % 256
+        else:
+            capture.write(str(e.code) + '\n')
+            status = 1
+    except Exception:
+        capture.write(traceback.format_exc())
+        status = 1
+    finally:
+        _inprocess_depth -= 1
+        os.chdir(state[0])
+        sys.argv, sys.stdout, sys.stderr = state[1:4]
+        logging.root.handlers = state[4]
+        logging.root.setLevel(state[5])
+        logger.setLevel(state[6])
+        if status != 0:
+            # remove the temporary folders left by the failed script
+            tmp_cleanup(exclude=tmp_folders)
+    return status, '\n'.join(line.strip() for line in capture.getvalue().splitlines()).rstrip()
+
+
 def display_open(file):
     """Print the syntax to open a file based on the platform."""
     if sys.platform == 'linux':
@@ -415,6 +665,10 @@ def mv(src, dst, verbose=1):
     """
     try:
         printv("mv %s %s" % (src, dst), verbose=verbose, type="code")
+        if _must_recompress(src, dst):
+            recompress(src, dst)
+            os.remove(src)
+            return
         os.rename(src, dst)
     except Exception as e:
         raise
@@ -430,6 +684,10 @@ def copy(src, dst, verbose=1):
          % (os.path.basename(src), folder, contents))
     try:
         printv("cp %s %s" % (src, dst), verbose=verbose, type="code")
+        fname_dst = os.path.join(dst, os.path.basename(src)) if os.path.isdir(dst) else dst
+        if _must_recompress(src, fname_dst):
+            recompress(src, fname_dst)
+            return
         shutil.copy(src, dst)
     except Exception as e:
         if sys.hexversion < 0x03000000:
@@ -440,9 +698,39 @@ def copy(src, dst, verbose=1):
                 return
         raise # Must be another error
 
+def _must_recompress(src, dst):
+    """Check if a .nii.gz file leaves a temporary folder, where it was written with a lower compression level than the
+    one of its destination (see spinalcordtoolbox.utils.get_compresslevel), so that it must be recompressed
+    """
+    return src.endswith('.nii.gz') and dst.endswith('.nii.gz') and is_tmp_path(src) \
+        and get_compresslevel(src) != get_compresslevel(dst)
+
+def link(src, dst, verbose=1):
+    """Link src to dst instead of copying it, for files that are only read (e.g. inputs copied to a temporary folder).
+    Use a hard link, or a symbolic link across file systems (e.g. to a RAM disk), or a copy if links are not supported.
+    nb. spinalcordtoolbox.utils.save_nifti() replaces links instead of writing through them.
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+    if os.path.lexists(dst):
+        os.remove(dst)
+    printv("ln %s %s" % (src, dst), verbose=verbose, type="code")
+    try:
+        os.link(src, dst)
+    except (OSError, AttributeError):
+        try:
+            os.symlink(os.path.abspath(src), dst)
+        except (OSError, AttributeError, NotImplementedError):
+            copy(src, dst, verbose=0)
+
 def rmtree(folder, verbose=1):
     """Recursively remove folder, almost like shutil.rmtree
     """
+    if folder in _tmp_folders:
+        _tmp_folders.remove(folder)
+        _tmp_stats['bytes'] += get_tmp_size(folder)
     try:
         printv("rm -rf %s" % (folder), verbose=verbose, type="code")
         shutil.rmtree(folder, ignore_errors=True)
@@ -637,24 +925,130 @@ def find_file_within_folder(fname, directory, seek_type='file'):
     return all_path
 
 
-def tmp_create(basename=None, verbose=1):
+# Temporary folders are created in the first folder of the SCT_TMPDIR environment variable (os.pathsep-separated list,
+# e.g. "/dev/shm" to work on a RAM disk) with enough free space, otherwise in the system temporary folder.
+# Free space required in SCT_TMPDIR folders when the size of the temporary files is unknown
+TMP_MIN_FREE = 1 << 30
+
+# temporary folders created by this process and not removed yet, see tmp_cleanup()
+_tmp_folders = []
+# number of temporary folders created by this process, and size of the ones already removed
+_tmp_stats = {'folders': 0, 'bytes': 0}
+
+
+def get_tmp_dir(size=None):
+    """
+    Folder where to create temporary folders: the first folder of SCT_TMPDIR with enough free space, otherwise the system
+    temporary folder
+    :param size: expected size of the temporary files (bytes). Default: TMP_MIN_FREE
+    :return: path
+    """
+    size = TMP_MIN_FREE if size is None else size
+    for path in os.environ.get('SCT_TMPDIR', '').split(os.pathsep):
+        if not path or not os.path.isdir(path) or not os.access(path, os.W_OK):
+            continue
+        try:
+            stat = os.statvfs(path)
+        except (AttributeError, OSError):
+            continue
+        free = stat.f_bavail * stat.f_frsize
+        if free >= size:
+            return path
+        logger.info("Not enough free space for temporary files in %s (%d MB, %d MB required)", path, free >> 20,
+                    size >> 20)
+    return tempfile.gettempdir()
+
+
+def nifti_nbytes(fname, itemsize=None):
+    """
+    Size of the data of a NIfTI image once loaded, read from its header
+    :param fname: str
+    :param itemsize: size of a voxel (bytes). Default: size of the data type of the image
+    :return: int
+    """
+    import nibabel
+    hdr = nibabel.load(fname).header
+    n = 1
+    for dim in hdr.get_data_shape():
+        n *= dim
+    return n * (itemsize or hdr.get_data_dtype().itemsize)
+
+
+def tmp_create(basename=None, verbose=1, size=None):
     """Create temporary folder and return its path
+
+    :param size: expected size of the temporary files (bytes), to choose a folder with enough free space (see get_tmp_dir)
     """
+    # nb. the name must match spinalcordtoolbox.utils.TMP_FOLDER_PATTERN
     prefix = "sct-%s-" % datetime.datetime.now().strftime("%Y%m%d%H%M%S.%f")
     if basename:
         prefix += "%s-" % basename
-    tmpdir = tempfile.mkdtemp(prefix=prefix)
+    tmpdir = tempfile.mkdtemp(prefix=prefix, dir=get_tmp_dir(size))
+    if not _tmp_stats['folders']:
+        atexit.register(_tmp_report)
+    _tmp_folders.append(tmpdir)
+    _tmp_stats['folders'] += 1
     printv('\nCreate temporary folder (%s)...' % tmpdir, verbose)
     return tmpdir
 
 
+def get_tmp_size(folder):
+    """
+    Size of the files written in a temporary folder: links to other files (see link()) are not counted
+    :param folder: str
+    :return: int (bytes)
+    """
+    size = 0
+    for root, dirs, files in os.walk(folder):
+        for fname in files:
+            try:
+                stat = os.lstat(os.path.join(root, fname))
+            except OSError:
+                continue
+            if not os.path.islink(os.path.join(root, fname)) and stat.st_nlink == 1:
+                size += stat.st_size
+    return size
+
+
+def tmp_cleanup(exclude=()):
+    """
+    Remove the temporary folders created by this process which still exist, e.g. after a failure. Temporary folders are
+    kept if the SCT_KEEP_TMP environment variable is set, for debugging.
+    :param exclude: temporary folders to keep
+    """
+    if os.environ.get('SCT_KEEP_TMP'):
+        return
+    for folder in [x for x in _tmp_folders if x not in exclude]:
+        rmtree(folder, verbose=0)
+
+
+def _tmp_report():
+    """
+    Report the size of the temporary files written by this process
+    """
+    size = _tmp_stats['bytes'] + sum(get_tmp_size(folder) for folder in _tmp_folders if os.path.isdir(folder))
+    logger.info("Temporary files written: %.1f MB in %d folder(s)", size / 2. ** 20, _tmp_stats['folders'])
+
+
 class TempFolder(object):
-    """This class will create a temporary folder."""
+    """This class will create a temporary folder.
+
+    It can be used as a context manager, which removes the folder when leaving the block:
+        with TempFolder() as tmp_folder:
+            ...
+    """
 
-    def __init__(self, verbose=0):
-        self.path_tmp = tmp_create(verbose=verbose)
+    def __init__(self, verbose=0, size=None):
+        self.path_tmp = tmp_create(verbose=verbose, size=size)
         self.previous_path = None
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.chdir_undo()
+        self.cleanup()
+
     def chdir(self):
         """This method will change the working directory to the temporary folder."""
         self.previous_path = os.getcwd()
@@ -679,6 +1073,15 @@ class TempFolder(object):
         copy(filename, self.path_tmp)
         return self.path_tmp + '/' + file_fname
 
+    def link_from(self, filename):
+        """This method will link a specified file, which is only read, into the temporary folder (see link()).
+
+        :param filename: The filename to link into the folder.
+        """
+        file_fname = os.path.basename(filename)
+        link(filename, self.path_tmp)
+        return self.path_tmp + '/' + file_fname
+
     def cleanup(self):
         """Remove the created folder and its contents."""
         rmtree(self.path_tmp)
@@ -738,6 +1141,10 @@ def generate_output_file(fname_in, fname_out, verbose=1):
         '''
         from sct_convert import convert
         convert(fname_in, fname_out)
+    elif _must_recompress(fname_in, fname_out):
+        # Files of temporary folders are written with little or no compression: compress the output
+        recompress(fname_in, fname_out)
+        os.remove(fname_in)
     else:
         # Generate output file without changing the extension
         shutil.move(fname_in, fname_out)
@@ -775,6 +1182,7 @@ def check_if_installed(cmd, name_software):
 #=======================================================================================================================
 # check if two images are in the same space and same orientation
 def check_if_same_space(fname_1, fname_2):
+    import numpy as np
     from spinalcordtoolbox.image import Image
 
     im_1 = Image(fname_1)
@@ -16,7 +16,7 @@ from __future__ import absolute_import
 import sys, os
 
 import spinalcordtoolbox.metadata
-from spinalcordtoolbox.reports.qc import generate_qc
+from spinalcordtoolbox.warp import is_displacement_field, warp_images
 from msct_parser import Parser
 import sct_utils as sct
 
@@ -67,57 +67,70 @@ class WarpTemplate:
         if not os.path.exists(self.folder_out):
             os.makedirs(self.folder_out)
 
-        # Warp template objects
+        # list label folders to warp
+        list_folder_label = [self.folder_template]
         sct.printv('\nWARP TEMPLATE:', self.verbose)
-        warp_label(self.path_template, self.folder_template, param.file_info_label, self.fname_src, self.fname_transfo, self.folder_out)
-
         # Warp atlas
         if self.warp_atlas == 1:
-            sct.printv('\nWARP ATLAS OF WHITE MATTER TRACTS:', self.verbose)
-            warp_label(self.path_template, self.folder_atlas, param.file_info_label, self.fname_src, self.fname_transfo, self.folder_out)
-
+            sct.printv('WARP ATLAS OF WHITE MATTER TRACTS:', self.verbose)
+            list_folder_label.append(self.folder_atlas)
         # Warp spinal levels
         if self.warp_spinal_levels == 1:
-            sct.printv('\nWARP SPINAL LEVELS:', self.verbose)
-            warp_label(self.path_template, self.folder_spinal_levels, param.file_info_label, self.fname_src, self.fname_transfo, self.folder_out)
+            sct.printv('WARP SPINAL LEVELS:', self.verbose)
+            list_folder_label.append(self.folder_spinal_levels)
+
+        # Warp all labels in a single pass
+        warp_label(self.path_template, list_folder_label, param.file_info_label, self.fname_src, self.fname_transfo, self.folder_out)
 
 
-def warp_label(path_label, folder_label, file_label, fname_src, fname_transfo, path_out):
+def warp_label(path_label, list_folder_label, file_label, fname_src, fname_transfo, path_out):
     """
-    Warp label files according to info_label.txt file
+    Warp label files according to info_label.txt file. If the transformation is a displacement field, it is loaded once
+    and all labels are resampled in the same pass. Otherwise, isct_antsApplyTransforms is called for each label.
     :param path_label:
-    :param folder_label:
+    :param list_folder_label: list of label folders (e.g. template, atlas)
     :param file_label:
     :param fname_src:
     :param fname_transfo:
     :param path_out:
     :return:
     """
-    try:
-        # Read label file
-        template_label_ids, template_label_names, template_label_file, combined_labels_ids, combined_labels_names, \
-        combined_labels_id_groups, clusters_apriori = \
-            spinalcordtoolbox.metadata.read_label_file(os.path.join(path_label, folder_label), file_label)
-    except Exception as error:
-        sct.printv('\nWARNING: Cannot warp label ' + folder_label + ': ' + str(error), 1, 'warning')
-        raise
+    list_fname_label, list_fname_out, list_interp = [], [], []
+    for folder_label in list_folder_label:
+        try:
+            # Read label file
+            template_label_ids, template_label_names, template_label_file, combined_labels_ids, combined_labels_names, \
+            combined_labels_id_groups, clusters_apriori = \
+                spinalcordtoolbox.metadata.read_label_file(os.path.join(path_label, folder_label), file_label)
+        except Exception as error:
+            sct.printv('\nWARNING: Cannot warp label ' + folder_label + ': ' + str(error), 1, 'warning')
+            raise
+        else:
+            # create output folder
+            if not os.path.exists(os.path.join(path_out, folder_label)):
+                os.makedirs(os.path.join(path_out, folder_label))
+            for i in range(0, len(template_label_file)):
+                list_fname_label.append(os.path.join(path_label, folder_label, template_label_file[i]))
+                list_fname_out.append(os.path.join(path_out, folder_label, template_label_file[i]))
+                list_interp.append(get_interp(template_label_file[i]))
+
+    # Warp labels
+    if is_displacement_field(fname_transfo):
+        warp_images(list_fname_label, fname_src, fname_transfo, list_fname_out, list_interp)
     else:
-        # create output folder
-        if not os.path.exists(os.path.join(path_out, folder_label)):
-            os.makedirs(os.path.join(path_out, folder_label))
-        # Warp label
-        for i in range(0, len(template_label_file)):
-            fname_label = os.path.join(path_label, folder_label, template_label_file[i])
+        for fname_label, fname_out, interp in zip(list_fname_label, list_fname_out, list_interp):
             # apply transfo
             sct.run('isct_antsApplyTransforms -d 3 -i %s -r %s -t %s -o %s -n %s' %
                     (fname_label,
                      fname_src,
                      fname_transfo,
-                     os.path.join(path_out, folder_label, template_label_file[i]),
-                     get_interp(template_label_file[i])),
+                     fname_out,
+                     interp),
                     is_sct_binary=True,
                     verbose=param.verbose)
-        # Copy list.txt
+
+    # Copy list.txt
+    for folder_label in list_folder_label:
         sct.copy(os.path.join(path_label, folder_label, param.file_info_label), os.path.join(path_out, folder_label))
 
 
@@ -224,6 +237,7 @@ def main(args=None):
         if path_qc is not None:
             fname_wm = os.path.join(w.folder_out, w.folder_template,
                                     spinalcordtoolbox.metadata.get_file_label(path_template, 'white matter'))
+            from spinalcordtoolbox.reports.qc import generate_qc
             generate_qc(fname_src, fname_seg=fname_wm, args=sys.argv[1:], path_qc=os.path.abspath(path_qc),
                         dataset=qc_dataset, subject=qc_subject, process='sct_warp_template')
 
@@ -101,6 +101,9 @@ def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], persli
             # slicegroups = [(0, 1, 2, 3, 4, 5, 6, 7, 8)]
             slicegroups = [tuple(slices)]
     agg_metric = dict((slicegroup, dict()) for slicegroup in slicegroups)
+    # ML/MAP estimates of all slice groups, computed at once from per-slice normal equations (see _solve_per_group())
+    normal_eq = None
+    beta_groups = dict()
 
     # loop across slice group
     for slicegroup in slicegroups:
@@ -120,25 +123,25 @@ def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], persli
                     agg_metric[slicegroup]['Size [vox]'] = np.sum(mask_slicegroup.flatten())
                 else:
                     mask_slicegroup = np.ones(data_slicegroup.shape)
-                # Ignore nonfinite values
+                # Ignore nonfinite values. Note: if mask has one more dimension than data (i.e. labels), all labels of
+                # the nonfinite voxels are set to zero.
                 i_nonfinite = np.where(np.isfinite(data_slicegroup) == False)
                 data_slicegroup[i_nonfinite] = 0.
-                # TODO: the lines below could probably be done more elegantly
-                if mask_slicegroup.ndim == data_slicegroup.ndim + 1:
-                    arr_tmp_concat = []
-                    for i in range(mask_slicegroup.shape[-1]):
-                        arr_tmp = np.reshape(mask_slicegroup[..., i], data_slicegroup.shape)
-                        arr_tmp[i_nonfinite] = 0.
-                        arr_tmp_concat.append(np.expand_dims(arr_tmp, axis=(mask_slicegroup.ndim-1)))
-                    mask_slicegroup = np.concatenate(arr_tmp_concat, axis=(mask_slicegroup.ndim-1))
-                else:
-                    mask_slicegroup[i_nonfinite] = 0.
+                mask_slicegroup[i_nonfinite] = 0.
                 # Make sure the number of pixels to extract metrics is not null
                 if mask_slicegroup.sum() == 0:
                     result = None
                 else:
                     # Run estimation
-                    result, _ = func(data_slicegroup, mask_slicegroup, map_clusters)
+                    if func in FUNCS_NORMAL_EQUATIONS and mask_slicegroup.ndim == data_slicegroup.ndim + 1:
+                        if func not in beta_groups:
+                            if normal_eq is None:
+                                normal_eq = normal_equations_per_slice(metric.data, mask.data)
+                            beta_groups[func] = _solve_per_group(normal_eq, slicegroups, FUNCS_NORMAL_EQUATIONS[func],
+                                                                 map_clusters)
+                        result = beta_groups[func][slicegroups.index(slicegroup)][0]
+                    else:
+                        result, _ = func(data_slicegroup, mask_slicegroup, map_clusters)
                     # check if nan
                     if np.isnan(result):
                         result = None
@@ -150,6 +153,22 @@ def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], persli
     return agg_metric
 
 
+def _solve_per_group(normal_eq, slicegroups, solver, map_clusters=None):
+    """
+    Run ML or MAP estimation for all slice groups at once: the per-slice normal equations are summed within each slice
+    group (which is equivalent to stacking the voxels of the group), then solved as a stack.
+    :param normal_eq: tuple: output of normal_equations_per_slice()
+    :param slicegroups: list of tuple of int: slice indices of each group
+    :param solver: function(xtx, xty, map_clusters) that returns beta, e.g. solve_ml()
+    :param map_clusters: list of int: See func_map()
+    :return: [nb_groups x nb_labels]: beta of each slice group
+    """
+    xtx, xty = normal_eq
+    xtx_groups = np.stack([xtx[list(slicegroup)].sum(axis=0) for slicegroup in slicegroups])
+    xty_groups = np.stack([xty[list(slicegroup)].sum(axis=0) for slicegroup in slicegroups])
+    return solver(xtx_groups, xty_groups, map_clusters)
+
+
 def check_labels(indiv_labels_ids, selected_labels):
     """Check the consistency of the labels asked by the user."""
     # convert strings to int
@@ -284,30 +303,7 @@ def func_map(data, mask, map_clusters):
     """
     # Check number of labels and map_clusters
     assert mask.shape[-1] == len(map_clusters)
-    # Sum across each clustered labels, then concatenate
-    mask_l = []
-    for i_cluster in list(set(map_clusters)):
-        # Get indices for given cluster
-        i_clusters = [i for i in range(len(map_clusters)) if i_cluster == map_clusters[i]]
-        # Sum all labels for this cluster
-        mask_l.append(np.expand_dims(np.sum(mask[..., i_clusters], axis=(mask.ndim - 1)), axis=(mask.ndim - 1)))
-    mask_clusters = np.concatenate(mask_l, axis=(mask.ndim-1))
-    # Run ML estimation for each clustered labels
-    _, beta_cluster = func_ml(data, mask_clusters)
-    # MAP estimation:
-    #   y [nb_vox x 1]: measurements vector (to which weights are applied)
-    #   x [nb_vox x nb_labels]: linear relation between the measurements y
-    #   beta_0 [nb_labels]: A priori values estimated per cluster using ML.
-    #   beta [nb_labels] = beta_0 + (Xt . X + 1)^(-1) . Xt . (y - X . beta_0) : The estimated metric value in each label
-    #
-    # Note: for simplicity we consider that sigma_noise = sigma_label
-    n_vox = functools.reduce(operator.mul, data.shape, 1)
-    y = np.reshape(data, n_vox)
-    x = np.reshape(mask, (n_vox, mask.shape[mask.ndim-1]))
-    beta_0 = [beta_cluster[map_clusters[i_label]] for i_label in range(mask.shape[-1])]
-    beta = beta_0 + np.dot(np.linalg.pinv(np.dot(x.T, x) + np.diag(np.ones(mask.shape[-1]))),
-                           np.dot(x.T,
-                                  (y - np.dot(x, beta_0))))
+    beta = solve_map(*normal_equations(data, mask), map_clusters=map_clusters)
     return beta[0], beta
 
 
@@ -322,16 +318,88 @@ def func_ml(data, mask, map_clusters=None):
     :return: float: beta corresponding to the first label
     """
     # TODO: support weighted least square
+    beta = solve_ml(*normal_equations(data, mask))
+    return beta[0], beta
+
+
+def normal_equations(data, mask):
+    """
+    Compute the normal equations of the linear model used for ML and MAP estimation:
+      y [nb_vox x 1]: measurements vector (to which weights are applied)
+      x [nb_vox x nb_labels]: linear relation between the measurements y
+    :param data: nd-array: input data
+    :param mask: (n+1)d-array: input mask
+    :return: xtx [nb_labels x nb_labels]: Xt . X, xty [nb_labels]: Xt . y
+    """
     # reshape as 1d vector (for data) and 2d vector (for mask)
     n_vox = functools.reduce(operator.mul, data.shape, 1)
-    # ML estimation:
-    #   y: measurements vector (to which weights are applied)
-    #   x: linear relation between the measurements y
-    #   beta [nb_labels] = (Xt . X)^(-1) . Xt . y: The estimated metric value in each label
-    y = np.reshape(data, n_vox)  # [nb_vox x 1]
+    y = np.reshape(data, n_vox)
     x = np.reshape(mask, (n_vox, mask.shape[mask.ndim-1]))
-    beta = np.dot(np.linalg.pinv(np.dot(x.T, x)), np.dot(x.T, y))
-    return beta[0], beta
+    return np.dot(x.T, x), np.dot(x.T, y)
+
+
+def normal_equations_per_slice(data, mask):
+    """
+    Compute the normal equations (see normal_equations()) of each slice at once. Nonfinite values of data are ignored.
+    :param data: nd-array: input data. Slices are along the last dimension.
+    :param mask: (n+1)d-array: input mask, with labels along the last dimension
+    :return: xtx [nb_slices x nb_labels x nb_labels], xty [nb_slices x nb_labels]
+    """
+    nz, n_label = mask.shape[-2:]
+    # [nb_vox_per_slice x nb_slices (x nb_labels)]
+    y = np.reshape(data, (-1, nz))
+    x = np.reshape(mask, (-1, nz, n_label))
+    # only keep in-plane voxels that belong to a label in at least one slice: they are usually a small fraction of the
+    # field of view
+    ind_vox = np.where(np.any(x != 0, axis=(1, 2)))[0]
+    y, x = y[ind_vox], x[ind_vox]
+    is_finite = np.isfinite(y)
+    y = np.where(is_finite, y, 0.)
+    x = x * is_finite[..., np.newaxis]
+    # put slices first, to compute all products as a stack of matrix products
+    xt = np.transpose(x, (1, 2, 0))  # [nb_slices x nb_labels x nb_vox_per_slice]
+    xtx = np.matmul(xt, np.transpose(xt, (0, 2, 1)))
+    xty = np.matmul(xt, np.transpose(y)[..., np.newaxis])[..., 0]
+    return xtx, xty
+
+
+def solve_ml(xtx, xty, map_clusters=None):
+    """
+    ML estimation from normal equations:
+      beta [nb_labels] = (Xt . X)^(-1) . Xt . y: The estimated metric value in each label
+    :param xtx: [... x nb_labels x nb_labels]: Xt . X, possibly stacked
+    :param xty: [... x nb_labels]: Xt . y, possibly stacked
+    :param map_clusters: not used
+    :return: [... x nb_labels]: beta
+    """
+    return np.matmul(np.linalg.pinv(xtx), xty[..., np.newaxis])[..., 0]
+
+
+def solve_map(xtx, xty, map_clusters):
+    """
+    MAP estimation from normal equations:
+      beta_0 [nb_labels]: A priori values estimated per cluster using ML.
+      beta [nb_labels] = beta_0 + (Xt . X + 1)^(-1) . Xt . (y - X . beta_0) : The estimated metric value in each label
+    Note: for simplicity we consider that sigma_noise = sigma_label
+    :param xtx: [... x nb_labels x nb_labels]: Xt . X, possibly stacked
+    :param xty: [... x nb_labels]: Xt . y, possibly stacked
+    :param map_clusters: list of int: cluster of each label. See func_map()
+    :return: [... x nb_labels]: beta
+    """
+    n_label = xtx.shape[-1]
+    # Summing the labels of each cluster is a linear map: x_cluster = X . C, with C [nb_labels x nb_clusters]
+    clusters = list(set(map_clusters))
+    c = np.array([[float(map_clusters[i_label] == i_cluster) for i_cluster in clusters] for i_label in range(n_label)])
+    # Run ML estimation for each clustered labels
+    beta_cluster = solve_ml(np.matmul(np.matmul(c.T, xtx), c), np.matmul(xty, c))
+    beta_0 = beta_cluster[..., [map_clusters[i_label] for i_label in range(n_label)]]
+    # Xt . (y - X . beta_0) = Xt . y - Xt . X . beta_0
+    residual = xty - np.matmul(xtx, beta_0[..., np.newaxis])[..., 0]
+    return beta_0 + solve_ml(xtx + np.eye(n_label), residual)
+
+
+# Functions that can be computed from the normal equations of the linear model, and their solver
+FUNCS_NORMAL_EQUATIONS = {func_ml: solve_ml, func_map: solve_map}
 
 
 def func_std(data, mask=None, map_clusters=None):
@@ -34,7 +34,7 @@ except Exception as e:
 else:
     sys.stderr = original_stderr
 
-from spinalcordtoolbox import resampling
+from spinalcordtoolbox import resampling, profiling
 from . import model
 from ..utils import __data_dir__
 
@@ -292,6 +292,7 @@ def segment_volume(ninput_volume, model_name,
     return pred_slices
 
 
+@profiling.span('deepseg_gm')
 def segment_file(input_filename, output_filename,
                  model_name, threshold, verbosity,
                  use_tta):
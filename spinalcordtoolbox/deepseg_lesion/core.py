@@ -17,7 +17,7 @@ import spinalcordtoolbox.image as msct_image
 from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.centerline import optic
 from spinalcordtoolbox.deepseg_sc.core import find_centerline, crop_image_around_centerline, uncrop_image, _normalize_data
-from spinalcordtoolbox import resampling
+from spinalcordtoolbox import resampling, profiling
 from spinalcordtoolbox.deepseg_sc.cnn_models import nn_architecture_ctr
 
 logger = logging.getLogger(__name__)
@@ -118,6 +118,7 @@ def segment_3d(model_fname, contrast_type, im):
     return out.copy()
 
 
+@profiling.span('deepseg_lesion')
 def deep_segmentation_MSlesion(im_image, contrast_type, ctr_algo='svm', ctr_file=None, brain_bool=True,
                                remove_temp_files=1, verbose=1):
     """
@@ -14,6 +14,7 @@ from spinalcordtoolbox import resampling
 from spinalcordtoolbox.deepseg_sc.cnn_models import nn_architecture_seg, nn_architecture_ctr
 from spinalcordtoolbox.image import Image, empty_like, change_type, zeros_like
 from spinalcordtoolbox.centerline.core import get_centerline, _call_viewer_centerline
+from spinalcordtoolbox import profiling
 
 import sct_utils as sct
 from sct_image import concat_data, split_data
@@ -576,6 +577,7 @@ def segment_3d(model_fname, contrast_type, im_in):
     return out.data
 
 
+@profiling.span('deepseg_sc')
 def deep_segmentation_spinalcord(im_image, contrast_type, ctr_algo='cnn', ctr_file=None, brain_bool=True,
                                  kernel_size='2d', remove_temp_files=1, verbose=1):
     """Pipeline"""
@@ -15,16 +15,11 @@ from __future__ import division, absolute_import
 
 import sys, os, itertools, warnings, logging
 
-import nibabel
-import nibabel.orientations
-
 import numpy as np
-from scipy.ndimage import map_coordinates
-
-import transforms3d.affines as affines
 
 from msct_types import Coordinate
 import sct_utils as sct
+from spinalcordtoolbox.utils import save_nifti
 
 logger = logging.getLogger(__name__)
 
@@ -317,6 +312,8 @@ class Image(object):
         :return:
         """
 
+        import nibabel
+
         try:
             self.im_file = nibabel.load(path)
         except nibabel.spatialimages.ImageFileError:
@@ -393,7 +390,7 @@ class Image(object):
             self._path = None
         return self
 
-    def save(self, path=None, dtype=None, verbose=1, mutable=False):
+    def save(self, path=None, dtype=None, verbose=1, mutable=False, compresslevel=None):
         """
         Write an image in a nifti file
 
@@ -420,6 +417,9 @@ class Image(object):
                         (2048, 'complex256', _complex256t, "NIFTI_TYPE_COMPLEX256"),
 
         :param mutable: whether to update members with newly created path or dtype
+
+        :param compresslevel: gzip compression level of .nii.gz files. Default: no compression in SCT temporary
+                              folders, nibabel's default elsewhere (see spinalcordtoolbox.utils.get_compresslevel)
         """
 
         if path is None and self.absolutepath is None:
@@ -430,7 +430,7 @@ class Image(object):
 
         path = path or self.absolutepath
 
-        from nibabel import Nifti1Image
+        import nibabel
 
         if dtype is not None:
             dst = self.copy()
@@ -446,7 +446,7 @@ class Image(object):
 
         # nb. that copy() is important because if it were a memory map, save()
         # would corrupt it
-        img = Nifti1Image(data.copy(), None, hdr)
+        img = nibabel.Nifti1Image(data.copy(), None, hdr)
         if os.path.isfile(path):
             sct.printv('WARNING: File ' + path + ' already exists. Will overwrite it.', verbose, 'warning')
 
@@ -458,7 +458,7 @@ class Image(object):
             logger.debug("Saving image to %s (%s) orientation %s shape %s",
              path, os.path.abspath(path), self.orientation, data.shape)
 
-        nibabel.save(img, path)
+        save_nifti(img, path, compresslevel)
 
         if mutable:
             self.absolutepath = path
@@ -561,11 +561,9 @@ class Image(object):
         """
 
         m_p2f = self.hdr.get_best_affine()
-        aug = np.hstack((np.asarray(coordi), np.ones((len(coordi), 1))))
-        ret = np.empty_like(coordi, dtype=np.float64)
-        for idx_coord, coord in enumerate(aug):
-            phys = np.matmul(m_p2f, coord)
-            ret[idx_coord] = phys[:3]
+        # rotation/scaling then translation, without building the (nb_points x 4) augmented coordinates
+        ret = np.dot(np.asarray(coordi, dtype=np.float64), m_p2f[:3, :3].T)
+        ret += m_p2f[:3, 3]
         return ret
 
 
@@ -598,9 +596,12 @@ class Image(object):
         :param interpolation_mode: 0=nearest neighbor, 1= linear, 2= 2nd-order spline, 3= 2nd-order spline, 4= 2nd-order spline, 5= 5th-order spline
         :return: intensity values at continuouspix with interpolation_mode
         """
+        from scipy.ndimage import map_coordinates
         return map_coordinates(self.data, coordi, output=np.float32, order=interpolation_mode, mode=border, cval=cval)
 
     def get_transform(self, im_ref, mode='affine'):
+        import transforms3d.affines as affines
+
         aff_im_self = self.im_file.affine
         aff_im_ref = im_ref.im_file.affine
         transform = np.matmul(np.linalg.inv(aff_im_self), aff_im_ref)
@@ -629,6 +630,8 @@ class Image(object):
         return transform
 
     def get_inverse_transform(self, im_ref, mode='affine'):
+        import transforms3d.affines as affines
+
         aff_im_self = self.im_file.affine
         aff_im_ref = im_ref.im_file.affine
         if mode == 'affine':
@@ -662,6 +665,8 @@ class Image(object):
         Returns:
             X, Y and Z axes of the image
         """
+        import transforms3d.affines as affines
+
         direction_matrix = self.header.get_best_affine()
         T_self, R_self, Sc_self, Sh_self = affines.decompose44(direction_matrix)
         return R_self[0:3, 0], R_self[0:3, 1], R_self[0:3, 2]
@@ -841,6 +846,7 @@ def get_orientation(im):
     :param im: an Image
     :return: reference space string (ie. what's in Image.orientation)
     """
+    import nibabel.orientations
     res = "".join(nibabel.orientations.aff2axcodes(im.hdr.get_best_affine()))
     return orientation_string_nib2sct(res)
     return res # for later ;)
@@ -880,6 +886,7 @@ def change_shape(im_src, shape, im_dst=None):
         # image data may be a view
         im_dst_data = im_src.data.copy().reshape(shape, order="F")
 
+    import nibabel.nifti1
     pair = nibabel.nifti1.Nifti1Pair(im_dst.data, im_dst.hdr.get_best_affine(), im_dst.hdr)
     im_dst.hdr = pair.header
     return im_dst
@@ -897,6 +904,7 @@ def change_orientation(im_src, orientation, im_dst=None, inverse=False):
     - the resulting image has no path member set
     - if the source image is < 3D, it is reshaped to 3D and the destination is 3D
     """
+    import nibabel.orientations
 
     if len(im_src.data.shape) < 3:
         pass # Will reshape to 3D
@@ -1130,6 +1138,7 @@ def spatial_crop(im_src, spec, im_dst=None):
 
     :param spec: dict of dim -> [lo,hi] bounds (integer voxel coordinates)
     """
+    import nibabel
 
     # Compute bounds
     bounds = [ (0, x-1) for x in im_src.data.shape ]
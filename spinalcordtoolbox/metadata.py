@@ -4,10 +4,27 @@
 
 from __future__ import absolute_import
 
-import io, os, re
+import io, os, re, json, hashlib, logging
+
+import numpy as np
 
 from spinalcordtoolbox.utils import parse_num_list
 
+logger = logging.getLogger(__name__)
+
+
+def get_cache_dir():
+    """
+    Folder where derived data are cached between runs: SCT_CACHE_DIR if set, otherwise spinalcordtoolbox within the
+    user cache folder (XDG_CACHE_HOME, default: ~/.cache). Datasets shipped with SCT may be read-only, and are never
+    written to.
+    """
+    path_cache = os.environ.get('SCT_CACHE_DIR')
+    if not path_cache:
+        path_cache = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                                  'spinalcordtoolbox')
+    return path_cache
+
 
 class InfoLabel(object):
     """
@@ -158,6 +175,199 @@ class InfoLabel(object):
                 w("{}, {}".format(_name, group_str))
 
 
+class SparseAtlas(object):
+    """
+    Sparse representation of a stack of label (e.g. atlas tract) volumes covering the same grid.
+
+    Almost all voxels of a tract are zero, so labels are stored as a CSR matrix of shape (nb_labels, nb_voxels): row i
+    holds the voxel indices (in C order over the volume shape) and partial volume weights of label i.
+    Weighted sums of a metric over every label (and every slice) are then computed with a single sparse product or
+    bincount, and the matrix can be cached on disk next to info_label.txt to avoid re-reading the NIFTI files.
+    """
+    CACHE_VERSION = 1
+
+    def __init__(self, weights, shape, ids=None, names=None, orientation=None):
+        """
+        :param weights: scipy.sparse matrix of shape (nb_labels, prod(shape))
+        :param shape: 3-tuple: shape of the label volumes
+        :param ids: list of int: label IDs, one per row of weights. Default: row indices.
+        :param names: list of str: label names, one per row of weights
+        :param orientation: orientation of the label volumes, if they were reoriented when loaded
+        """
+        from scipy.sparse import csr_matrix
+        self.weights = csr_matrix(weights, dtype=np.float32)
+        self.shape = tuple(int(x) for x in shape)
+        n_label = self.weights.shape[0]
+        self.ids = list(range(n_label)) if ids is None else list(ids)
+        self.names = [str(x) for x in self.ids] if names is None else list(names)
+        self.orientation = orientation
+        self._cache_key = None
+
+    def __len__(self):
+        return self.weights.shape[0]
+
+    @classmethod
+    def from_images(cls, list_fname, ids=None, names=None, orientation=None):
+        """
+        Build from a list of label files
+        :param list_fname: list of file names, one per label
+        :param orientation: if not None, reorient labels (e.g. "RPI")
+        """
+        from scipy.sparse import csr_matrix
+        from spinalcordtoolbox.image import Image
+
+        shape = None
+        list_indices, list_values = [], []
+        for fname in list_fname:
+            im_label = Image(fname)
+            if orientation is not None:
+                im_label.change_orientation(orientation)
+            if shape is None:
+                shape = im_label.data.shape
+            elif im_label.data.shape != shape:
+                raise ValueError("Label {} has shape {}, expected {}".format(fname, im_label.data.shape, shape))
+            data = np.ravel(im_label.data)
+            indices = np.flatnonzero(data)
+            list_indices.append(indices)
+            list_values.append(data[indices].astype(np.float32))
+        indptr = np.concatenate([[0], np.cumsum([len(indices) for indices in list_indices])])
+        weights = csr_matrix((np.concatenate(list_values), np.concatenate(list_indices), indptr),
+                             shape=(len(list_fname), int(np.prod(shape))))
+        return cls(weights, shape, ids=ids, names=names, orientation=orientation)
+
+    @classmethod
+    def from_folder(cls, path_label, file_info_label='info_label.txt', orientation=None, cache=True):
+        """
+        Build from the individual labels of an info_label.txt file
+        :param path_label: folder containing file_info_label and the label files
+        :param orientation: if not None, reorient labels (e.g. "RPI")
+        :param cache: if True, load the atlas from (or save it to) a cache file in the user cache folder (see
+          get_cache_dir()), never in path_label. The cache is rebuilt if info_label.txt or any label file has been
+          modified since it was written.
+        """
+        il = InfoLabel()
+        il.load(os.path.join(path_label, file_info_label))
+        ids, names, files = [list(x) for x in zip(*il._indiv_labels)]
+        list_fname = [os.path.join(path_label, f) for f in [file_info_label] + files]
+        key = json.dumps({'version': cls.CACHE_VERSION, 'orientation': orientation,
+                          'files': [(f, os.path.getmtime(f), os.path.getsize(f)) for f in list_fname]})
+        # one cache file per atlas folder and orientation
+        fname_cache = os.path.join(get_cache_dir(), 'sparse_atlas', '{}.npz'.format(hashlib.md5(json.dumps(
+            [os.path.abspath(list_fname[0]), orientation]).encode('utf-8')).hexdigest()))
+
+        if cache and os.path.isfile(fname_cache):
+            try:
+                atlas = cls.load(fname_cache)
+                if atlas._cache_key == key:
+                    logger.debug("Loaded sparse atlas from %s", fname_cache)
+                    return atlas
+            except Exception as e:
+                logger.debug("Ignoring sparse atlas cache %s: %s", fname_cache, e)
+
+        atlas = cls.from_images(list_fname[1:], ids=ids, names=names, orientation=orientation)
+        if cache:
+            try:
+                if not os.path.isdir(os.path.dirname(fname_cache)):
+                    os.makedirs(os.path.dirname(fname_cache))
+                atlas.save(fname_cache, cache_key=key)
+            except (IOError, OSError) as e:
+                logger.debug("Could not write sparse atlas cache %s: %s", fname_cache, e)
+        return atlas
+
+    @classmethod
+    def load(cls, fname):
+        """
+        Load from a file written by save()
+        """
+        from scipy.sparse import csr_matrix
+        with np.load(fname) as npz:
+            weights = csr_matrix((npz['data'], npz['indices'], npz['indptr']), shape=tuple(npz['weights_shape']))
+            meta = json.loads(str(npz['meta']))
+        atlas = cls(weights, meta['shape'], ids=meta['ids'], names=meta['names'], orientation=meta['orientation'])
+        atlas._cache_key = meta.get('cache_key')
+        return atlas
+
+    def save(self, fname, cache_key=None):
+        """
+        Save to an uncompressed .npz file
+        :param cache_key: str: stored along with the atlas, used to detect stale caches
+        """
+        meta = json.dumps({'shape': self.shape, 'ids': self.ids, 'names': self.names,
+                           'orientation': self.orientation, 'cache_key': cache_key})
+        with io.open(fname, 'wb') as f:
+            np.savez(f, data=self.weights.data, indices=self.weights.indices, indptr=self.weights.indptr,
+                     weights_shape=np.array(self.weights.shape), meta=np.array(meta))
+
+    def _slice_index(self):
+        """
+        :return: label index and slice index (along the last dimension) of each stored weight
+        """
+        rows = np.repeat(np.arange(len(self)), np.diff(self.weights.indptr))
+        return rows, self.weights.indices % self.shape[-1]
+
+    def weighted_sum(self, data):
+        """
+        Sum of data weighted by each label
+        :param data: array with the same shape as the labels
+        :return: [nb_labels]
+        """
+        return self.weights.dot(np.ravel(data).astype(np.float64))
+
+    def weighted_sum_per_slice(self, data=None):
+        """
+        Sum of data weighted by each label, within each slice (last dimension)
+        :param data: array with the same shape as the labels. If None, sum the weights themselves.
+        :return: [nb_labels x nb_slices]
+        """
+        values = self.weights.data.astype(np.float64)
+        if data is not None:
+            values *= np.ravel(data)[self.weights.indices]
+        rows, slices = self._slice_index()
+        nz = self.shape[-1]
+        return np.bincount(rows * nz + slices, weights=values, minlength=len(self) * nz).reshape(len(self), nz)
+
+    def weighted_average_per_slice(self, data):
+        """
+        Weighted average of data within each label and each slice. Slices where a label is empty are set to NaN.
+        :return: [nb_labels x nb_slices]
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.weighted_sum_per_slice(data) / self.weighted_sum_per_slice()
+
+    def bounding_box_xy(self):
+        """
+        In-plane bounding box of all labels, across all slices
+        :return: tuple of slices, to index the first two dimensions of an array
+        """
+        if self.weights.nnz == 0:
+            return slice(None), slice(None)
+        nx, ny, nz = self.shape
+        ind_x, ind_y, _ = np.unravel_index(self.weights.indices, (nx, ny, nz))
+        return slice(ind_x.min(), ind_x.max() + 1), slice(ind_y.min(), ind_y.max() + 1)
+
+    def to_dense(self, crop=None, dtype=np.float32):
+        """
+        Convert to a dense array with labels along the last dimension
+        :param crop: tuple of slices (e.g. from bounding_box_xy()) applied to the first dimensions
+        :return: [nx x ny x nz x nb_labels] array
+        """
+        crop = () if crop is None else tuple(crop)
+        coords = np.unravel_index(self.weights.indices, self.shape)
+        rows, _ = self._slice_index()
+        keep = np.ones(len(rows), dtype=bool)
+        shape_out, coords_out = [], []
+        for axis, coord in enumerate(coords):
+            start, stop = 0, self.shape[axis]
+            if axis < len(crop):
+                start, stop, _ = crop[axis].indices(self.shape[axis])
+                keep &= (coord >= start) & (coord < stop)
+            shape_out.append(stop - start)
+            coords_out.append(coord - start)
+        data_out = np.zeros(tuple(shape_out) + (len(self),), dtype=dtype)
+        data_out[tuple(coord[keep] for coord in coords_out) + (rows[keep],)] = self.weights.data[keep]
+        return data_out
+
+
 def read_label_file(path_info_label, file_info_label):
     """Reads file_info_label (located inside label folder) and returns the information needed."""
 
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# Instrumentation of SCT runs: wall time, CPU time and peak memory of named processing steps
+#
+# Profiling is enabled with the SCT_PROFILE environment variable, or with the -profile flag of any command-line tool.
+# Its value is the output JSON file, or an existing folder, in which case one file is written per invocation (useful
+# when SCT tools call each other).
+#
+# Usage:
+#     from spinalcordtoolbox import profiling
+#     with profiling.span('straightening'):
+#         ...
+# or, to record each call of a function:
+#     @profiling.span('straightening')
+#     def straighten(...):
+#
+# When profiling is not enabled, spans do nothing.
+
+from __future__ import absolute_import, division
+
+import os, sys, time, json, atexit, threading, functools, logging
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from spinalcordtoolbox import __version__
+
+logger = logging.getLogger(__name__)
+
+# Profile being recorded, None if profiling is not enabled
+_profile = None
+
+
+def get_rss_peak(who='self'):
+    """
+    Peak resident set size of the process (or of its largest terminated child process)
+    :param who: {'self', 'children'}
+    :return: float: peak RSS in MB, None if not available
+    """
+    if resource is None:
+        return None
+    rusage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kB on Linux, in bytes on OSX
+    return rusage.ru_maxrss / (1024. ** 2 if sys.platform == 'darwin' else 1024.)
+
+
+class Profile(object):
+    """
+    Spans recorded during one invocation, written as JSON at exit
+    """
+    def __init__(self, fname):
+        if os.path.isdir(fname):
+            fname = os.path.join(fname, '{}_{}_{}.json'.format(
+                os.path.splitext(os.path.basename(sys.argv[0]))[0], time.strftime("%y%m%d%H%M%S"), os.getpid()))
+        self.fname = os.path.abspath(fname)
+        self.spans = []
+        self._time_start = time.time()
+        self._times_start = os.times()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def start_span(self, name, kind, attributes):
+        stack = self._local.__dict__.setdefault('stack', [])
+        span = dict(name=name, kind=kind, parent=stack[-1]['id'] if stack else None, depth=len(stack),
+                    start=time.time() - self._time_start, **attributes)
+        with self._lock:
+            span['id'] = len(self.spans)
+            self.spans.append(span)
+        stack.append(span)
+        return span, time.time(), os.times(), get_rss_peak()
+
+    def end_span(self, span, time_start, times_start, rss_peak_start):
+        times = os.times()
+        span['wall_time'] = time.time() - time_start
+        span['cpu_time'] = (times[0] + times[1]) - (times_start[0] + times_start[1])
+        span['cpu_time_children'] = (times[2] + times[3]) - (times_start[2] + times_start[3])
+        span['rss_peak_mb'] = get_rss_peak()
+        if rss_peak_start is not None:
+            # increase of the peak RSS of the process during the span
+            span['rss_peak_increase_mb'] = span['rss_peak_mb'] - rss_peak_start
+        if span['kind'] == 'subprocess':
+            span['rss_peak_children_mb'] = get_rss_peak('children')
+        self._local.stack.pop()
+
+    def to_dict(self):
+        times = os.times()
+        return {
+            'command': sys.argv,
+            'sct_version': __version__,
+            'pid': os.getpid(),
+            'start': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self._time_start)),
+            'wall_time': time.time() - self._time_start,
+            'cpu_time': (times[0] + times[1]) - (self._times_start[0] + self._times_start[1]),
+            'cpu_time_children': (times[2] + times[3]) - (self._times_start[2] + self._times_start[3]),
+            'rss_peak_mb': get_rss_peak(),
+            'rss_peak_children_mb': get_rss_peak('children'),
+            'spans': self.spans,
+        }
+
+    def save(self):
+        with open(self.fname, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        logger.info("Profile written to: {}".format(self.fname))
+
+
+def enable(fname):
+    """
+    Start recording the profile of the current invocation, which will be written at exit
+    :param fname: output JSON file, or folder
+    """
+    global _profile
+    if _profile is None:
+        _profile = Profile(fname)
+        atexit.register(_profile.save)
+
+
+def is_enabled():
+    return _profile is not None
+
+
+class span(object):
+    """
+    Record wall time, CPU time (of the process and of its children) and peak memory of a block of code, or of each call
+    of a function when used as a decorator. Spans can be nested, and used from several threads.
+    :param name: str: name of the step
+    :param kind: {'step', 'subprocess'}
+    :param attributes: additional information saved with the span (must be JSON serializable)
+    """
+    def __init__(self, name, kind='step', **attributes):
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self._state = None
+
+    def __enter__(self):
+        if _profile is not None:
+            self._state = _profile.start_span(self.name, self.kind, self.attributes)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._state is not None:
+            _profile.end_span(*self._state)
+            self._state = None
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(self.name, self.kind, **self.attributes):
+                return func(*args, **kwargs)
+        return wrapper
@@ -28,6 +28,7 @@ import matplotlib.colors as color
 import sct_utils as sct
 from spinalcordtoolbox.image import Image
 import spinalcordtoolbox.reports.slice as qcslice
+from spinalcordtoolbox import profiling
 
 logger = logging.getLogger(__name__)
 
@@ -454,6 +455,7 @@ class QcReport(object):
                              dest_full_path)
 
 
+@profiling.span('qc')
 def add_entry(src, process, args, path_qc, plane, background=None, foreground=None,
               qcslice=None,
               qcslice_operations=[],
@@ -21,6 +21,7 @@ from msct_types import Centerline
 import spinalcordtoolbox.image as msct_image
 from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.centerline.core import get_centerline
+from spinalcordtoolbox import profiling
 
 logger = logging.getLogger(__name__)
 
@@ -64,6 +65,7 @@ class SpinalCordStraightener(object):
 
         self.template_orientation = 0
 
+    @profiling.span('straightening')
     def straighten(self):
         """
         Straighten spinal cord. Steps: (everything is done in physical space)
@@ -106,7 +108,9 @@ class SpinalCordStraightener(object):
         # Extract path/file/extension
         path_anat, file_anat, ext_anat = sct.extract_fname(fname_anat)
 
-        path_tmp = sct.tmp_create(basename="straighten_spinalcord", verbose=verbose)
+        # input, centerlines, two displacement fields (3 components) and the straightened image, in float32
+        path_tmp = sct.tmp_create(basename="straighten_spinalcord", verbose=verbose,
+                                  size=12 * sct.nifti_nbytes(fname_anat, itemsize=4))
 
         # Copying input data to tmp folder
         sct.printv('\nCopy files to tmp folder...', verbose)
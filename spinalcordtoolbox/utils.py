@@ -4,7 +4,7 @@
 
 from __future__ import absolute_import
 
-import io, os, re, time, logging
+import io, os, re, time, gzip, logging
 import subprocess
 
 logger = logging.getLogger(__name__)
@@ -184,3 +184,69 @@ def parse_num_list_inv(list_int):
             colon_is_present = False
 
     return str_num
+
+
+# Name of the folders created by sct_utils.tmp_create(): "sct-<date>-[basename-]<random>"
+TMP_FOLDER_PATTERN = re.compile(r"^sct-\d{14}\.\d{6}-")
+
+
+def is_tmp_path(path):
+    """
+    Check if a file is in a SCT temporary folder (created by sct_utils.tmp_create)
+    :param path: str
+    :return: bool
+    """
+    return any(TMP_FOLDER_PATTERN.match(x) for x in os.path.dirname(os.path.abspath(path)).split(os.sep))
+
+
+def get_compresslevel(path):
+    """
+    gzip compression level used to write a .nii.gz file:
+      - files in SCT temporary folders, which are read back and deleted within the run: SCT_TMP_COMPRESSLEVEL
+        environment variable, default 0 (no compression, which saves the CPU time of gzip)
+      - other files: SCT_COMPRESSLEVEL environment variable, default: nibabel's default
+    :param path: str
+    :return: int, or None for nibabel's default
+    """
+    if is_tmp_path(path):
+        compresslevel = os.environ.get('SCT_TMP_COMPRESSLEVEL', '0')
+    else:
+        compresslevel = os.environ.get('SCT_COMPRESSLEVEL', '')
+    return int(compresslevel) if compresslevel != '' else None
+
+
+def save_nifti(img, path, compresslevel=None):
+    """
+    Save a nibabel image, compressing .nii.gz files at the level of get_compresslevel()
+    :param img: nibabel image
+    :param path: str
+    :param compresslevel: gzip compression level, overrides get_compresslevel()
+    """
+    import nibabel as nib
+    if os.path.islink(path) or (os.path.isfile(path) and os.stat(path).st_nlink > 1):
+        # do not write through a link to another file, see sct_utils.link()
+        os.remove(path)
+    if compresslevel is None:
+        compresslevel = get_compresslevel(path)
+    if compresslevel is not None and path.endswith('.gz'):
+        with gzip.open(path, 'wb', compresslevel=compresslevel) as f:
+            img.to_file_map({'image': nib.FileHolder(fileobj=f)})
+    else:
+        nib.save(img, path)
+
+
+def recompress(fname_in, fname_out, compresslevel=None):
+    """
+    Copy a gzip file, with the compression level of get_compresslevel(fname_out)
+    :param fname_in: str
+    :param fname_out: str
+    :param compresslevel: gzip compression level, overrides get_compresslevel()
+    """
+    import shutil
+    if compresslevel is None:
+        compresslevel = get_compresslevel(fname_out)
+    if compresslevel is None:
+        import nibabel as nib
+        compresslevel = nib.openers.Opener.default_compresslevel
+    with gzip.open(fname_in, 'rb') as f_in, gzip.open(fname_out, 'wb', compresslevel=compresslevel) as f_out:
+        shutil.copyfileobj(f_in, f_out, 1 << 20)
@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# Apply ITK/ANTs transformations (displacement fields and affine transformations) in-process
+
+from __future__ import absolute_import, division
+
+import os
+import logging
+import multiprocessing
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import nibabel as nib
+from scipy import ndimage
+
+from spinalcordtoolbox.utils import save_nifti
+
+logger = logging.getLogger(__name__)
+
+# ANTs interpolation names --> spline order
+INTERP_ORDER = {'NearestNeighbor': 0, 'Linear': 1, 'BSpline': 3}
+# ITK affine transformations that can be read, see read_affine()
+AFFINE_TYPES = ('AffineTransform_', 'MatrixOffsetTransformBase_')
+# RAS <--> LPS
+RAS2LPS = np.array([-1., -1., 1.])
+
+
+def is_displacement_field(fname):
+    """
+    Check if a file is a dense displacement field, as written by ANTs (shape: nx, ny, nz, 1, 3)
+    :param fname: str
+    :return: bool
+    """
+    if not fname.endswith(('.nii', '.nii.gz')):
+        return False
+    shape = nib.load(fname).shape
+    return len(shape) == 5 and shape[3] == 1 and shape[4] == 3
+
+
+def is_affine(fname):
+    """
+    Check if a file is an affine transformation that can be read by read_affine()
+    :param fname: str
+    :return: bool
+    """
+    try:
+        read_affine(fname)
+    except Exception:
+        return False
+    return True
+
+
+def read_affine(fname, inverse=False):
+    """
+    Read a 3D affine transformation written by ITK/ANTs, either as text (.txt) or as MATLAB (.mat) file. Following ITK
+    conventions, the transformation maps points of the fixed space to points of the moving space, in LPS coordinates:
+    y = A * (x - c) + t + c
+    :param fname: .txt or .mat file
+    :param inverse: bool: return the inverse transformation
+    :return: 4x4 matrix, in LPS coordinates
+    """
+    if fname.endswith('.mat'):
+        from scipy.io import loadmat
+        matfile = loadmat(fname)
+        key = [k for k in matfile if k.startswith(AFFINE_TYPES)][0]
+        param, center = matfile[key].ravel(), matfile['fixed'].ravel()
+    elif fname.endswith('.txt'):
+        with open(fname) as f:
+            lines = [line.split(':', 1) for line in f if ':' in line and not line.startswith('#')]
+        fields = dict(lines)
+        if [key for key, value in lines].count('Transform') != 1:
+            raise ValueError("Composite transformations are not supported: {}".format(fname))
+        if not fields['Transform'].strip().startswith(AFFINE_TYPES):
+            raise ValueError("Unsupported transformation type in {}: {}".format(fname, fields['Transform'].strip()))
+        param = np.array(fields['Parameters'].split(), dtype=np.float64)
+        center = np.array(fields['FixedParameters'].split(), dtype=np.float64)
+    else:
+        raise ValueError("Unsupported affine transformation file: {}".format(fname))
+    if param.size != 12 or center.size != 3:
+        raise ValueError("Not a 3D affine transformation: {}".format(fname))
+    matrix = np.eye(4)
+    matrix[:3, :3] = param[:9].reshape(3, 3)
+    matrix[:3, 3] = param[9:] + center - np.dot(matrix[:3, :3], center)
+    return np.linalg.inv(matrix) if inverse else matrix
+
+
+def apply_affine(matrix, coord_phy):
+    """
+    Map physical points through an affine transformation
+    :param matrix: 4x4 matrix, in LPS coordinates (see read_affine())
+    :param coord_phy: array of shape (3, ...): physical coordinates (RAS)
+    :return: array of shape (3, ...): transformed physical coordinates (RAS)
+    """
+    shape = (3,) + (1,) * (coord_phy.ndim - 1)
+    # conjugate by the RAS <--> LPS flip, which is its own inverse
+    matrix_ras = RAS2LPS.reshape(3, 1) * matrix[:3, :3] * RAS2LPS
+    return np.tensordot(matrix_ras, coord_phy, axes=1) + (RAS2LPS * matrix[:3, 3]).reshape(shape)
+
+
+def is_supported(list_transfo):
+    """
+    Check if a chain of transformations can be applied in-process by transform_points()
+    :param list_transfo: list of (fname, inverse)
+    :return: bool
+    """
+    for fname, inverse in list_transfo:
+        if fname.endswith(('.nii', '.nii.gz')):
+            # displacement fields cannot be inverted on the fly
+            if inverse or not is_displacement_field(fname):
+                return False
+        elif not is_affine(fname):
+            return False
+    return True
+
+
+def transform_points(list_transfo, coord_phy, affine=None):
+    """
+    Map physical points through a chain of transformations. As with the -t option of antsApplyTransforms, the first
+    transformation of the list is applied first to the points of the fixed (reference) space.
+    :param list_transfo: list of (fname, inverse): displacement fields or affine transformations. inverse is only
+    supported for affine transformations.
+    :param coord_phy: array of shape (3, nx, ny, nz): physical coordinates (RAS) of points in the fixed space
+    :param affine: voxel to world matrix of the grid of coord_phy, see apply_displacement_field()
+    :return: array of shape (3, nx, ny, nz): physical coordinates (RAS) of the corresponding points in the moving space
+    """
+    for fname, inverse in list_transfo:
+        if fname.endswith(('.nii', '.nii.gz')):
+            coord_phy = apply_displacement_field(fname, coord_phy, affine)
+        else:
+            coord_phy = apply_affine(read_affine(fname, inverse), coord_phy)
+        # points are not on the grid anymore
+        affine = None
+    return coord_phy
+
+
+def grid_coordinates(shape, affine):
+    """
+    Physical coordinates (RAS) of all voxels of an image grid
+    :param shape: tuple: 3D shape
+    :param affine: 4x4 voxel to world matrix
+    :return: array of shape (3, nx, ny, nz)
+    """
+    coord_vox = np.indices(shape[:3], dtype=np.float64)
+    return np.tensordot(affine[:3, :3], coord_vox, axes=1) + affine[:3, 3].reshape(3, 1, 1, 1)
+
+
+def phys2vox(coord_phy, affine):
+    """
+    Convert physical coordinates (RAS) to (continuous) voxel coordinates of an image
+    :param coord_phy: array of shape (3, ...)
+    :param affine: 4x4 voxel to world matrix
+    :return: array of shape (3, ...)
+    """
+    affine_inv = np.linalg.inv(affine)
+    shape = (3,) + (1,) * (coord_phy.ndim - 1)
+    return np.tensordot(affine_inv[:3, :3], coord_phy, axes=1) + affine_inv[:3, 3].reshape(shape)
+
+
+def apply_displacement_field(fname_warp, coord_phy, affine=None):
+    """
+    Map physical points through a displacement field, following ITK conventions: the field is defined on the fixed
+    (destination) grid and displacements are expressed in LPS coordinates. Points outside the field are not displaced.
+    :param fname_warp: displacement field
+    :param coord_phy: array of shape (3, nx, ny, nz): physical coordinates (RAS) of points in the fixed space
+    :param affine: voxel to world matrix of the grid of coord_phy, if any. Avoids interpolating the field when it is
+    defined on the same grid.
+    :return: array of shape (3, nx, ny, nz): physical coordinates (RAS) of the corresponding points in the moving space
+    """
+    im_warp = nib.load(fname_warp)
+    data_warp = np.asanyarray(im_warp.dataobj)[:, :, :, 0, :]
+    coord_out = np.empty_like(coord_phy)
+    coord_vox = None
+    if not (affine is not None and data_warp.shape[:3] == coord_phy.shape[1:] and np.allclose(affine, im_warp.affine)):
+        # field and points are on different grids: interpolate the field
+        coord_vox = phys2vox(coord_phy, im_warp.affine)
+    for i, sign in enumerate(RAS2LPS):  # LPS --> RAS
+        if coord_vox is None:
+            displacement = data_warp[..., i]
+        else:
+            displacement = interpolate(data_warp[..., i], coord_vox, order=1)
+        coord_out[i] = coord_phy[i] + sign * displacement
+    return coord_out
+
+
+def resample_image(data, coord_vox, interp='Linear'):
+    """
+    Sample an image at continuous voxel coordinates. Points outside the image are set to 0.
+    :param data: 3D array
+    :param coord_vox: array of shape (3, nx, ny, nz)
+    :param interp: {'NearestNeighbor', 'Linear', 'BSpline'}
+    :return: array of shape (nx, ny, nz), float32
+    """
+    return interpolate(np.asanyarray(data, dtype=np.float32), coord_vox, order=INTERP_ORDER[interp], output=np.float32)
+
+
+def interpolate(data, coord_vox, order=1, output=None):
+    """
+    Interpolate an image at continuous voxel coordinates, as ITK does: points less than half a voxel outside of the
+    image are interpolated using the border values, points further away are set to 0. This avoids losing border voxels
+    because of rounding errors in the coordinates.
+    :param data: 3D array
+    :param coord_vox: array of shape (3, ...)
+    :param order: spline interpolation order
+    :param output: dtype of the output
+    :return: array of shape coord_vox.shape[1:]
+    """
+    data_out = ndimage.map_coordinates(data, coord_vox, output=output, order=order, mode='nearest')
+    for i, n in enumerate(data.shape):
+        data_out[(coord_vox[i] < -0.5) | (coord_vox[i] > n - 0.5)] = 0
+    return data_out
+
+
+class DisplacementFieldWriter(object):
+    """
+    Write an ITK displacement field (float32, shape: nx, ny, nz, 1, 3, vector intent), slab by slab: fill
+    writer.data[:, :, z0:z1, 0, :], then close(). The field is initialized to zero (identity).
+    Uncompressed (.nii) fields are filled through a memory map on the output file, so they never need to fit in memory.
+    Compressed (.nii.gz) fields are filled in memory and written on close.
+
+    Usage:
+        with DisplacementFieldWriter('warp.nii', header) as writer:
+            for iz in range(nz):
+                writer.data[:, :, iz, 0, 0] = ...
+    """
+    def __init__(self, fname_warp, header, compresslevel=None):
+        """
+        :param fname_warp: output file (.nii or .nii.gz)
+        :param header: NIfTI header of the image defining the grid of the field
+        :param compresslevel: gzip compression level of .nii.gz fields (0: no compression, which is fast and suited to
+        intermediate files). Default: see spinalcordtoolbox.utils.get_compresslevel.
+        """
+        self.fname_warp = fname_warp
+        self.compresslevel = compresslevel
+        # single-file NIfTI header, without extensions (the data starts right after the header) nor scaling
+        self.header = nib.Nifti1Header.from_header(header)
+        del self.header.extensions[:]
+        self.header.set_data_shape(tuple(header.get_data_shape()[:3]) + (1, 3))
+        self.header.set_data_dtype(np.float32)
+        self.header.set_slope_inter(np.nan, np.nan)
+        self.header.set_intent('vector', (), '')
+        shape = self.header.get_data_shape()
+        if fname_warp.endswith('.nii'):
+            # header, then data as a memory map on the (sparse) rest of the file
+            self.header['vox_offset'] = offset = 352
+            with open(fname_warp, 'wb') as f:
+                self.header.write_to(f)
+                f.truncate(offset + int(np.prod(shape)) * 4)
+            self.data = np.memmap(fname_warp, dtype=self.header.get_data_dtype(), mode='r+', offset=offset,
+                                  shape=shape, order='F')
+        else:
+            self.data = np.zeros(shape, dtype=np.float32)
+
+    def close(self):
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+        else:
+            save_nifti(nib.Nifti1Image(self.data, None, self.header), self.fname_warp, self.compresslevel)
+        self.data = None
+        logger.info("Warping field generated: %s", self.fname_warp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+class WarpChain(object):
+    """
+    Chain of transformations, composed once into sampling coordinates on the grid of a reference image. The composed
+    chain can be applied to several images, and saved as a single displacement field.
+    Chains are cached in memory (see get()), so that transformations are read and composed only once per process.
+    """
+    def __init__(self, list_transfo, fname_ref, memmap=False):
+        """
+        :param list_transfo: list of (fname, inverse), see transform_points()
+        :param fname_ref: reference image, defining the grid
+        :param memmap: store the composed coordinates in a float32 memory map on a temporary file, instead of in memory
+        """
+        self.list_transfo = [(os.path.abspath(fname), bool(inverse)) for fname, inverse in list_transfo]
+        im_ref = nib.load(fname_ref)
+        self.shape = im_ref.shape[:3]
+        self.affine = im_ref.affine
+        self.header = im_ref.header.copy()
+        self.memmap = memmap
+        self._coord_phy = None
+        self._dict_coord_vox = {}
+
+    @property
+    def coord_phy(self):
+        """
+        Physical coordinates (RAS) in the moving space of the voxels of the reference grid, array of shape
+        (3, nx, ny, nz). Computed on first access.
+        """
+        if self._coord_phy is None:
+            coord_phy = transform_points(self.list_transfo, grid_coordinates(self.shape, self.affine), self.affine)
+            if self.memmap:
+                # the temporary file is deleted when the memory map is released
+                import tempfile
+                self._coord_phy = np.memmap(tempfile.TemporaryFile(), dtype=np.float32, mode='w+',
+                                            shape=coord_phy.shape)
+                self._coord_phy[:] = coord_phy
+            else:
+                self._coord_phy = coord_phy.astype(np.float32)
+        return self._coord_phy
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the composed coordinates (memory maps excluded)
+        """
+        nbytes = sum(coord_vox.nbytes for coord_vox in list(self._dict_coord_vox.values()))
+        if self._coord_phy is not None and not isinstance(self._coord_phy, np.memmap):
+            nbytes += self._coord_phy.nbytes
+        return nbytes
+
+    def get_coord_vox(self, affine):
+        """
+        Sampling coordinates in the voxel space of a moving image. Cached for each image geometry, within the memory
+        budget of the cache (see _trim_cache()).
+        :param affine: voxel to world matrix of the moving image
+        :return: array of shape (3, nx, ny, nz)
+        """
+        key = tuple(np.round(affine, 6).ravel())
+        coord_vox = self._dict_coord_vox.get(key)
+        if coord_vox is None:
+            coord_vox = phys2vox(self.coord_phy, affine)
+            with _cache_lock:
+                if self.nbytes + coord_vox.nbytes > WARP_CHAIN_CACHE_BYTES:
+                    # only keep the coordinates of the last geometry
+                    self._dict_coord_vox.clear()
+                self._dict_coord_vox[key] = coord_vox
+            _trim_cache(self)
+        return coord_vox
+
+    def apply(self, fname_in, fname_out, interp='Linear', n_jobs=None):
+        """
+        Apply the chain to a 3D or 4D image. Volumes are resampled in parallel and written into a preallocated output
+        as they are done.
+        :param fname_in: input image
+        :param fname_out: output image (float32)
+        :param interp: interpolation name, see INTERP_ORDER
+        :param n_jobs: number of volumes resampled simultaneously. Default: number of CPUs
+        :return: fname_out
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        im_in = nib.load(fname_in)
+        coord_vox = self.get_coord_vox(im_in.affine)
+
+        # trailing singleton dimensions are dropped, as done by ANTs
+        shape_4d = im_in.shape[3:] if np.prod(im_in.shape[3:]) > 1 else ()
+        data_out = np.empty(self.shape + shape_4d, dtype=np.float32)
+
+        def resample_volume(index):
+            if shape_4d:
+                data_in = im_in.dataobj[(Ellipsis,) + index]
+            else:
+                data_in = np.asanyarray(im_in.dataobj).reshape(im_in.shape[:3])
+            data_out[(Ellipsis,) + index] = resample_image(data_in, coord_vox, interp)
+
+        list_index = list(np.ndindex(shape_4d))
+        if n_jobs is None:
+            n_jobs = multiprocessing.cpu_count()
+        with ThreadPoolExecutor(max_workers=max(1, min(n_jobs, len(list_index)))) as executor:
+            list(executor.map(resample_volume, list_index))
+
+        hdr_out = self.header.copy()
+        hdr_out.set_data_dtype(np.float32)
+        hdr_out.set_data_shape(data_out.shape)
+        if shape_4d:
+            # keep the temporal resolution of the input
+            hdr_out['pixdim'][4:4 + len(shape_4d)] = im_in.header['pixdim'][4:4 + len(shape_4d)]
+        save_nifti(nib.Nifti1Image(data_out, self.affine, hdr_out), fname_out)
+        logger.info("Transformed %s --> %s", fname_in, fname_out)
+        return fname_out
+
+    def save(self, fname_out):
+        """
+        Save the composed chain as an ITK displacement field (LPS, vector intent), defined on the reference grid.
+        Equivalent to isct_ComposeMultiTransform 3 fname_out -R fname_ref ...
+        :param fname_out: .nii or .nii.gz
+        :return: fname_out
+        """
+        displacement = self.coord_phy - grid_coordinates(self.shape, self.affine)
+        with DisplacementFieldWriter(fname_out, self.header) as writer:
+            for i in range(3):
+                writer.data[..., 0, i] = RAS2LPS[i] * displacement[i]
+        self.alias(fname_out)
+        return fname_out
+
+    def alias(self, fname_warp):
+        """
+        Register a displacement field equivalent to the chain (e.g. the output of save(), once moved to its final
+        location), so that get() returns the chain instead of reading the field
+        :param fname_warp: displacement field, defined on the reference grid
+        """
+        _cache_chain(WarpChain._get_key([(fname_warp, False)], self.shape, self.affine), self)
+
+    @staticmethod
+    def _get_key(list_transfo, shape, affine):
+        """
+        Identify a chain by its transformations (including the date of their last modification) and by its grid
+        """
+        list_key = []
+        for fname, inverse in list_transfo:
+            stat = os.stat(fname)
+            list_key.append((os.path.abspath(fname), bool(inverse), stat.st_mtime, stat.st_size))
+        return tuple(list_key), tuple(shape[:3]), tuple(np.round(affine, 6).ravel())
+
+    @classmethod
+    def get(cls, list_transfo, fname_ref):
+        """
+        Get a chain from the cache, or create it
+        :param list_transfo: list of (fname, inverse), see transform_points()
+        :param fname_ref: reference image, defining the grid
+        :return: WarpChain
+        """
+        im_ref = nib.load(fname_ref)
+        key = cls._get_key(list_transfo, im_ref.shape, im_ref.affine)
+        with _cache_lock:
+            if key in _cache_warp_chain:
+                logger.debug("Reusing composed transformations: %s", list_transfo)
+                _cache_warp_chain[key] = _cache_warp_chain.pop(key)
+                return _cache_warp_chain[key]
+        # large grids are composed into a memory map, to leave the memory to the resampling
+        memmap = 12 * int(np.prod(im_ref.shape[:3])) > WARP_CHAIN_MEMMAP_BYTES
+        return _cache_chain(key, cls(list_transfo, fname_ref, memmap=memmap))
+
+
+# composed chains of transformations, least recently used first. A chain can be cached under several keys (see alias())
+_cache_warp_chain = OrderedDict()
+_cache_lock = threading.RLock()
+# memory used by the cached chains (composed and sampling coordinates), in bytes
+WARP_CHAIN_CACHE_BYTES = 1 << 30
+# composed coordinates larger than this are stored in a memory map (see WarpChain)
+WARP_CHAIN_MEMMAP_BYTES = 1 << 30
+
+
+def _cache_chain(key, chain):
+    with _cache_lock:
+        _cache_warp_chain[key] = chain
+    _trim_cache(chain)
+    return chain
+
+
+def _trim_cache(chain_used):
+    """
+    Remove the least recently used chains from the cache, until the cached chains fit in WARP_CHAIN_CACHE_BYTES. The
+    chain being used is kept.
+    :param chain_used: WarpChain
+    """
+    with _cache_lock:
+        for key in list(_cache_warp_chain):
+            chains = dict((id(chain), chain) for chain in _cache_warp_chain.values())
+            if sum(chain.nbytes for chain in chains.values()) <= WARP_CHAIN_CACHE_BYTES:
+                break
+            if _cache_warp_chain[key] is not chain_used:
+                del _cache_warp_chain[key]
+
+
+def warp_images(list_fname_in, fname_ref, fname_warp, list_fname_out, list_interp, n_jobs=None):
+    """
+    Warp several images with the same displacement field, in a single pass: the field is read once and the sampling
+    coordinates are computed once per input geometry. Images are resampled in parallel and written as they are done.
+    Equivalent to calling isct_antsApplyTransforms -d 3 -i fname_in -r fname_ref -t fname_warp for each image.
+    :param list_fname_in: list of input images
+    :param fname_ref: reference image, defining the output grid
+    :param fname_warp: displacement field
+    :param list_fname_out: list of output images
+    :param list_interp: list of interpolation names, see INTERP_ORDER
+    :param n_jobs: number of images resampled simultaneously. Default: number of CPUs
+    :return:
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    chain = WarpChain.get([(fname_warp, False)], fname_ref)
+    # sampling coordinates are shared between inputs with the same geometry (e.g. template and atlas files)
+    for fname_in in list_fname_in:
+        chain.get_coord_vox(nib.load(fname_in).affine)
+
+    def warp_one(args):
+        fname_in, fname_out, interp = args
+        return chain.apply(fname_in, fname_out, interp, n_jobs=1)
+
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    with ThreadPoolExecutor(max_workers=max(1, min(n_jobs, len(list_fname_in)))) as executor:
+        return list(executor.map(warp_one, zip(list_fname_in, list_fname_out, list_interp)))
+
+
+def apply_transforms(fname_in, fname_ref, list_transfo, fname_out, interp='Linear', n_jobs=None):
+    """
+    Apply a chain of transformations to a 3D or 4D image. The chain is composed once into sampling coordinates, which
+    are used to resample all volumes, in parallel. See WarpChain.
+    Equivalent to isct_antsApplyTransforms -d 3 -i fname_in -r fname_ref -t ... (applied to each volume of 4D images).
+    :param fname_in: input image
+    :param fname_ref: reference image, defining the output grid
+    :param list_transfo: list of (fname, inverse), see transform_points()
+    :param fname_out: output image (float32)
+    :param interp: interpolation name, see INTERP_ORDER
+    :param n_jobs: number of volumes resampled simultaneously. Default: number of CPUs
+    :return: fname_out
+    """
+    return WarpChain.get(list_transfo, fname_ref).apply(fname_in, fname_out, interp, n_jobs)
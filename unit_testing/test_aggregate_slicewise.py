@@ -184,6 +184,27 @@ def test_extract_metric(dummy_data_and_labels):
     assert agg_metric[list(agg_metric)[0]]['MAX()'] == 41.0
 
 
+# noinspection 801,PyShadowingNames
+def test_extract_metric_ml_map_perslice():
+    """Test that per-slice ML and MAP computed from stacked normal equations match the per-slice estimation."""
+    rng = np.random.RandomState(0)
+    labels = np.zeros((6, 6, 4, 3))
+    labels[1:5, 1:5] = rng.dirichlet(np.ones(3), (4, 4, 4))
+    data = rng.rand(6, 6, 4)
+    data[2, 2, 1] = np.nan
+    map_clusters = [0, 1, 1]
+    agg_metric = aggregate_slicewise.aggregate_per_slice_or_level(
+        Metric(data=data), mask=Metric(data=labels, label='label_0'), perslice=True, map_clusters=map_clusters,
+        group_funcs=(('ML', aggregate_slicewise.func_ml), ('MAP', aggregate_slicewise.func_map)))
+    for iz in range(4):
+        data_slice, labels_slice = data[..., [iz]].copy(), labels[..., [iz], :].copy()
+        i_nonfinite = np.where(np.isfinite(data_slice) == False)
+        data_slice[i_nonfinite], labels_slice[i_nonfinite] = 0., 0.
+        assert agg_metric[(iz,)]['ML()'] == pytest.approx(aggregate_slicewise.func_ml(data_slice, labels_slice)[0])
+        assert agg_metric[(iz,)]['MAP()'] == \
+            pytest.approx(aggregate_slicewise.func_map(data_slice, labels_slice, map_clusters)[0])
+
+
 # noinspection 801,PyShadowingNames
 def test_extract_metric_2d(dummy_data_and_labels_2d):
     """Test different estimation methods."""
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.vertebrae.detect_c2c3
+
+from __future__ import absolute_import
+
+import sys, os
+
+import numpy as np
+import nibabel as nib
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+
+from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.vertebrae import detect_c2c3
+import sct_flatten_sagittal
+
+
+def dummy_cord(nx=21, ny=15, nz=30):
+    """Oblique cord, along the first (R-L) axis: image and segmentation"""
+    affine = np.eye(4)
+    data_seg = np.zeros((nx, ny, nz))
+    for iz in range(nz):
+        ix = 6 + iz // 4
+        data_seg[ix - 1:ix + 2, 6:9, iz] = 1
+    nii = nib.Nifti1Image(data_seg, affine)
+    im_seg = Image(data_seg, hdr=nii.header, dim=nii.header.get_data_shape())
+    data = 100 * data_seg
+    data[2:-2, 2:-2, :] += 50
+    im = Image(data, hdr=nii.header.copy(), dim=nii.header.get_data_shape())
+    return im, im_seg
+
+
+def test_flatten_sagittal():
+    im, im_seg = dummy_cord()
+    im_flat, translation_x = sct_flatten_sagittal.flatten_sagittal(im.copy(), im_seg.copy(), verbose=0,
+                                                                   return_translation=True)
+    # cord centered in the medial plane, intensities scaled between -1 and 1
+    assert np.all(np.abs(np.argmax(im_flat.data[:, 7, :], axis=0) - 10) <= 1)
+    assert im_flat.data.min() >= -1 and im_flat.data.max() <= 1
+    assert len(translation_x) == im.dim[2]
+
+
+def test_detect_c2c3(tmpdir, monkeypatch):
+    """Call path of detect_c2c3(), with the prediction of isct_spine_detect replaced by a peak on the cord"""
+    im, im_seg = dummy_cord()
+
+    def run(cmd, **kwargs):
+        # prediction on the mid-sagittal slice (PIR orientation): peak inside the cord mask, below the top of the cord
+        im_mid = nib.load('data_midSlice.nii')
+        assert im_mid.get_data().min() >= -1 and im_mid.get_data().max() <= 1
+        pred = np.zeros(im_mid.shape[:2], dtype=np.float32)
+        pred[7, 10] = 1
+        nib.save(nib.Nifti1Pair(pred, im_mid.affine), 'data_midSlice_pred_svm.hdr')
+        return 1, ''
+
+    monkeypatch.setattr(detect_c2c3.sct, 'run', run)
+    monkeypatch.chdir(str(tmpdir))
+    im_c2c3 = detect_c2c3.detect_c2c3(im.copy(), im_seg.copy(), 't2', verbose=0)
+    assert im_c2c3.orientation == im.orientation
+    assert np.sum(im_c2c3.data == 3) == 1
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for sct_dmri_* scripts
+
+from __future__ import absolute_import
+
+import sys, os
+
+import numpy as np
+import nibabel as nib
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+import sct_dmri_compute_dti
+
+from spinalcordtoolbox.image import Image
+
+
+def test_compute_dti(tmpdir):
+    """Fit a synthetic int16 DWI volume with a known tensor"""
+    bvals = np.array([0, 1000, 1000, 1000, 1000, 1000, 1000])
+    bvecs = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1],
+                      [1, 1, 0], [1, 0, 1], [0, 1, 1]], dtype=float)
+    bvecs[1:] /= np.linalg.norm(bvecs[1:], axis=1)[:, None]
+    evals = np.array([1.7e-3, 0.3e-3, 0.3e-3])
+    signal = 1000 * np.exp(-bvals * np.sum(bvecs ** 2 * evals, axis=1))
+    data = np.tile(signal, (4, 3, 2, 1)).astype(np.int16)
+    fname_in = str(tmpdir.join('dwi.nii.gz'))
+    nib.save(nib.Nifti1Image(data, np.eye(4)), fname_in)
+    fname_bvals, fname_bvecs = str(tmpdir.join('bvals.txt')), str(tmpdir.join('bvecs.txt'))
+    np.savetxt(fname_bvals, bvals[None], fmt='%d')
+    np.savetxt(fname_bvecs, bvecs.T)
+    prefix = str(tmpdir.join('dti_'))
+
+    sct_dmri_compute_dti.param = sct_dmri_compute_dti.Param()
+    assert sct_dmri_compute_dti.compute_dti(fname_in, fname_bvals, fname_bvecs, prefix, 'standard', True, '',
+                                            n_jobs=1)
+
+    fa_expected = np.sqrt(0.5 * ((evals[0] - evals[1]) ** 2 + (evals[1] - evals[2]) ** 2 + (evals[2] - evals[0]) ** 2)
+                          / np.sum(evals ** 2))
+    for metric in ['FA', 'MD', 'RD', 'AD', 'V1', 'V2', 'V3']:
+        assert nib.load(prefix + metric + '.nii.gz').get_data_dtype() == np.float32
+    assert np.allclose(Image(prefix + 'FA.nii.gz').data, fa_expected, atol=1e-3)
+    assert np.allclose(Image(prefix + 'MD.nii.gz').data, np.mean(evals), rtol=1e-2)
+    assert np.allclose(np.abs(Image(prefix + 'V1.nii.gz').data[..., 0]), 1, atol=1e-3)
+
+
+def test_separate_b0_and_dwi(tmpdir):
+    """Split a 4D volume into b=0 and DW volumes (b=5 is below bval_min) and average them"""
+    import sct_dmri_separate_b0_and_dwi
+    bvals = np.array([0, 1000, 5, 1000, 1000])
+    bvecs = np.array([[0, 0, 0], [1, 0, 0], [0, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=float)
+    data = (1000 * np.random.RandomState(0).rand(4, 3, 2, len(bvals))).astype(np.float32)
+    fname_bvals, fname_bvecs = str(tmpdir.join('bvals.txt')), str(tmpdir.join('bvecs.txt'))
+    np.savetxt(fname_bvals, bvals[None], fmt='%d')
+    np.savetxt(fname_bvecs, bvecs.T)
+    index_b0, index_dwi, nb_b0, nb_dwi = sct_dmri_separate_b0_and_dwi.identify_b0(fname_bvecs, fname_bvals, 100, 0)
+    assert (index_b0, index_dwi, nb_b0, nb_dwi) == ([0, 2], [1, 3, 4], 2, 3)
+    # without bvals, b=0 volumes are those with a null b-vector
+    assert sct_dmri_separate_b0_and_dwi.identify_b0(fname_bvecs, '', 100, 0)[:2] == ([0, 2], [1, 3, 4])
+
+    nii = nib.Nifti1Image(data, np.eye(4))
+    im_dmri = Image(data, hdr=nii.header, dim=nii.header.get_data_shape())
+    fname_b0, fname_dwi, fname_b0_mean, fname_dwi_mean = \
+        [str(tmpdir.join(f)) for f in ['b0.nii.gz', 'dwi.nii.gz', 'b0_mean.nii.gz', 'dwi_mean.nii.gz']]
+    # 4D b=0 subset and its mean, mean of DW volumes only (accumulated one volume at a time)
+    sct_dmri_separate_b0_and_dwi.separate_b0_and_dwi(im_dmri, index_b0, index_dwi, fname_b0=fname_b0,
+                                                     fname_b0_mean=fname_b0_mean, fname_dwi_mean=fname_dwi_mean,
+                                                     verbose=0)
+    assert not os.path.exists(fname_dwi)
+    assert np.array_equal(Image(fname_b0).data, data[..., [0, 2]])
+    assert np.allclose(Image(fname_b0_mean).data, np.mean(data[..., [0, 2]], 3))
+    assert np.allclose(Image(fname_dwi_mean).data, np.mean(data[..., [1, 3, 4]], 3))
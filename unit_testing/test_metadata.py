@@ -7,6 +7,7 @@ from __future__ import absolute_import
 import sys, io, os
 
 import pytest
+import numpy as np
 
 import spinalcordtoolbox.metadata
 
@@ -59,3 +60,43 @@ def test_get_file_label(info_labels):
         _in = spinalcordtoolbox.metadata.get_indiv_label_names(os.path.dirname(info_label))
         spinalcordtoolbox.metadata.get_file_label(os.path.dirname(info_label), _in[0], output="file")
         spinalcordtoolbox.metadata.get_file_label(os.path.dirname(info_label), _in[0], output="filewithpath")
+
+
+@pytest.fixture(scope="module")
+def dummy_atlas_folder(tmpdir_factory):
+    """Create a folder with 3 partial volume labels and an info_label.txt file"""
+    import nibabel as nib
+    path_atlas = str(tmpdir_factory.mktemp("atlas"))
+    rng = np.random.RandomState(0)
+    labels = np.zeros((10, 12, 5, 3), dtype=np.float32)
+    labels[2:6, 3:9] = rng.dirichlet(np.ones(3), (4, 6, 5))
+    il = spinalcordtoolbox.metadata.InfoLabel(indiv_labels=[(i, 'label {}'.format(i), 'label_{}.nii.gz'.format(i))
+                                                            for i in range(3)])
+    for i in range(3):
+        nib.save(nib.Nifti1Image(labels[..., i], np.eye(4)), os.path.join(path_atlas, 'label_{}.nii.gz'.format(i)))
+    il.save(os.path.join(path_atlas, 'info_label.txt'))
+    return path_atlas, labels
+
+
+def test_sparse_atlas(dummy_atlas_folder, tmpdir, monkeypatch):
+    path_atlas, labels = dummy_atlas_folder
+    path_cache = str(tmpdir.join('cache'))
+    monkeypatch.setenv('SCT_CACHE_DIR', path_cache)
+    atlas = spinalcordtoolbox.metadata.SparseAtlas.from_folder(path_atlas)
+    # cache written in the user cache folder, not in the atlas folder
+    assert sorted(os.listdir(path_atlas)) == ['info_label.txt', 'label_0.nii.gz', 'label_1.nii.gz', 'label_2.nii.gz']
+    assert len(os.listdir(os.path.join(path_cache, 'sparse_atlas'))) == 1
+    assert atlas.names == ['label 0', 'label 1', 'label 2']
+    assert np.array_equal(atlas.to_dense(), labels)
+    crop = atlas.bounding_box_xy()
+    assert crop == (slice(2, 6), slice(3, 9))
+    assert np.array_equal(atlas.to_dense(crop=crop), labels[2:6, 3:9])
+    # weighted operations
+    data = np.random.RandomState(1).rand(10, 12, 5)
+    assert np.allclose(atlas.weighted_sum(data), np.sum(labels * data[..., np.newaxis], axis=(0, 1, 2)))
+    assert np.allclose(atlas.weighted_average_per_slice(data),
+                       (np.sum(labels * data[..., np.newaxis], axis=(0, 1)) / np.sum(labels, axis=(0, 1))).T)
+    # second load comes from the cache
+    atlas_cached = spinalcordtoolbox.metadata.SparseAtlas.from_folder(path_atlas)
+    assert atlas_cached._cache_key is not None
+    assert np.array_equal(atlas_cached.to_dense(), labels)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for msct_register
+
+from __future__ import absolute_import
+
+import sys, os
+
+import pytest
+import numpy as np
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+import msct_register
+
+
+@pytest.fixture(scope="module")
+def dummy_ellipses():
+    """Rotated ellipses, with an empty slice and a slice with a single voxel"""
+    nx, ny, nz = 40, 36, 6
+    x, y = np.meshgrid(np.arange(nx), np.arange(ny), indexing='ij')
+    data = np.zeros((nx, ny, nz))
+    rng = np.random.RandomState(0)
+    for iz in range(nz):
+        angle = rng.uniform(-1, 1)
+        u = (x - 20) * np.cos(angle) + (y - 18) * np.sin(angle)
+        v = -(x - 20) * np.sin(angle) + (y - 18) * np.cos(angle)
+        data[..., iz] = (u / 9) ** 2 + (v / 4) ** 2 <= 1
+    data[..., 2] = 0
+    data[..., 4] = 0
+    data[10, 10, 4] = 1
+    return data
+
+
+def test_compute_pca_slicewise(dummy_ellipses):
+    centermass, eigenvectors, eigenvalues = msct_register.compute_pca_slicewise(dummy_ellipses)
+    assert np.all(np.isnan(centermass[[2, 4]]))
+    for iz in [0, 1, 3, 5]:
+        coord, pca, centermass_iz = msct_register.compute_pca(dummy_ellipses[..., iz])
+        assert np.allclose(centermass[iz], centermass_iz)
+        # same principal axes (up to the sign) and same ratio of explained variance
+        assert np.allclose(np.abs(eigenvectors[iz].T), np.abs(pca.components_))
+        assert np.isclose(eigenvalues[iz, 0] / eigenvalues[iz, 1],
+                          pca.explained_variance_ratio_[0] / pca.explained_variance_ratio_[1])
+
+
+def test_generate_warping_field_affine(tmpdir):
+    """Rotation about a center and translation, converted analytically to displacement fields (ITK/LPS convention)"""
+    import nibabel as nib
+    from scipy.io import savemat
+    nx, ny, nz = 9, 8, 3
+    affine_dest = np.diag([1., 1., 2., 1.])
+    affine_dest[:3, 3] = [-2, -3, 0]
+    fname_dest = str(tmpdir.join('dest.nii'))
+    nib.save(nib.Nifti1Image(np.zeros((nx, ny, nz), dtype=np.float32), affine_dest), fname_dest)
+    # 90 deg rotation about (-3, -2) in LPS, then translation of (1, 2)
+    matrix, translation, center = np.array([[0., -1.], [1., 0.]]), np.array([1., 2.]), np.array([-3., -2.])
+    fname_mat = str(tmpdir.join('affine.mat'))
+    savemat(fname_mat, {'AffineTransform_double_2_2': np.r_[matrix.ravel(), translation][:, None],
+                        'fixed': center[:, None]})
+    affine = msct_register.read_affine_2d(fname_mat)
+    assert np.allclose(affine[0], matrix) and np.allclose(affine[1], translation) and np.allclose(affine[2], center)
+    list_affine = [affine, None, affine]
+
+    fname_warp, fname_warp_inv = str(tmpdir.join('warp.nii')), str(tmpdir.join('warp_inv.nii'))
+    msct_register.generate_warping_field_affine(fname_dest, list_affine, fname_warp=fname_warp, verbose=0)
+    msct_register.generate_warping_field_affine(fname_dest, list_affine, fname_warp=fname_warp_inv, inverse=True,
+                                                verbose=0)
+    field = nib.load(fname_warp).get_fdata()
+    field_inv = nib.load(fname_warp_inv).get_fdata()
+    assert field.shape == (nx, ny, nz, 1, 3)
+    # identity for missing slices, no displacement along z
+    assert np.all(field[:, :, 1] == 0) and np.all(field_inv[:, :, 1] == 0)
+    assert np.all(field[..., 2] == 0)
+
+    # expected displacement at each voxel: T(p) - p, with T(p) = A.(p - c) + t + c, p in LPS
+    for ix, iy in [(0, 0), (4, 5), (8, 7), (2, 6)]:
+        p = -(affine_dest[:2, :2].dot([ix, iy]) + affine_dest[:2, 3])
+        q = matrix.dot(p - center) + translation + center
+        assert np.allclose(field[ix, iy, 0, 0, :2], q - p)
+        assert np.allclose(field[ix, iy, 2, 0, :2], q - p)
+
+    # forward then inverse: back to the starting point (transformed points that fall on the grid)
+    n_checked = 0
+    for ix, iy in np.ndindex(nx, ny):
+        p = -(affine_dest[:2, :2].dot([ix, iy]) + affine_dest[:2, 3])
+        q = p + field[ix, iy, 0, 0, :2]
+        jx, jy = np.round(np.linalg.solve(affine_dest[:2, :2], -q - affine_dest[:2, 3])).astype(int)
+        if 0 <= jx < nx and 0 <= jy < ny:
+            assert np.allclose(q + field_inv[jx, jy, 0, 0, :2], p)
+            n_checked += 1
+    assert n_checked > 10
+
+
+def test_register2d_columnwise_non_square(tmpdir, monkeypatch):
+    """Column-wise registration of non-square slices (nx != ny), with anisotropic voxels and an empty slice"""
+    import nibabel as nib
+    nx, ny, nz = 20, 30, 3
+    affine = np.diag([0.5, 0.8, 2., 1.])
+    data_src, data_dest = np.zeros((nx, ny, nz), dtype=np.float32), np.zeros((nx, ny, nz), dtype=np.float32)
+    data_src[5:15, 4:10, [0, 2]] = 1
+    data_dest[5:15, 6:16, [0, 2]] = 1
+    # input files are read from the working directory, as within the temporary folder of sct_register_multimodal
+    monkeypatch.chdir(str(tmpdir))
+    fname_src, fname_dest = 'src.nii', 'dest.nii'
+    nib.save(nib.Nifti1Image(data_src, affine), fname_src)
+    nib.save(nib.Nifti1Image(data_dest, affine), fname_dest)
+    fname_warp, fname_warp_inv = 'warp.nii', 'warp_inv.nii'
+    msct_register.register2d_columnwise(fname_src, fname_dest, fname_warp=fname_warp, fname_warp_inv=fname_warp_inv,
+                                        smoothWarpXY=0)
+    field = nib.load(fname_warp).get_fdata()
+    field_inv = nib.load(fname_warp_inv).get_fdata()
+    assert field.shape == field_inv.shape == (nx, ny, nz, 1, 3)
+    # same extent along x: no displacement along x and z, nor in the empty slice
+    assert np.allclose(field[..., [0, 2]], 0) and np.allclose(field_inv[..., [0, 2]], 0)
+    assert np.all(field[:, :, 1] == 0) and np.all(field_inv[:, :, 1] == 0)
+    # columns without data are left unchanged
+    assert np.all(field[:5, :, [0, 2], 0, 1] == 0) and np.all(field[15:, :, [0, 2], 0, 1] == 0)
+    # y-scaling of the columns with data (ITK fields are in LPS: opposite sign along y)
+    col = np.arange(ny)
+    for iz in [0, 2]:
+        assert np.allclose(field[5:15, :, iz, 0, 1], -0.8 * ((col - 10.5) * 0.6 + 6.5 - col))
+        assert np.allclose(field_inv[5:15, :, iz, 0, 1], -0.8 * ((col - 6.5) / 0.6 + 10.5 - col))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.profiling
+
+from __future__ import absolute_import
+
+import sys, os, json
+
+import pytest
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+from spinalcordtoolbox import profiling
+import sct_utils as sct
+
+
+@pytest.fixture
+def profile(tmpdir, monkeypatch):
+    """Record a profile without registering it to be written at exit"""
+    profile = profiling.Profile(str(tmpdir))
+    monkeypatch.setattr(profiling, '_profile', profile)
+    return profile
+
+
+def test_span(profile):
+    @profiling.span('outer', subject='sub-01')
+    def outer():
+        with profiling.span('inner'):
+            sct.run(['sleep', '0.1'], verbose=0)
+
+    outer()
+    assert [span['name'] for span in profile.spans] == ['outer', 'inner', 'sleep']
+    assert [span['parent'] for span in profile.spans] == [None, 0, 1]
+    assert profile.spans[0]['subject'] == 'sub-01'
+    assert profile.spans[2]['kind'] == 'subprocess'
+    assert profile.spans[0]['wall_time'] >= profile.spans[2]['wall_time'] >= 0.1
+    profile.save()
+    with open(profile.fname) as f:
+        assert len(json.load(f)['spans']) == 3
+
+
+def test_span_disabled():
+    assert not profiling.is_enabled()
+    with profiling.span('step'):
+        pass
+
+
+@pytest.mark.parametrize('arguments,fname_profile', [
+    (['-profile', 'prof.json', '-i', 't2.nii'], 'prof.json'),
+    (['-profile', '-i', 't2.nii'], None),
+    (['-i', 't2.nii', '-profile'], None),
+])
+def test_parser_profile(tmpdir, monkeypatch, arguments, fname_profile):
+    """-profile is available to all scripts, with an optional output path"""
+    import msct_parser
+    monkeypatch.chdir(str(tmpdir))
+    list_fname = []
+    monkeypatch.setattr(profiling, 'enable', list_fname.append)
+    parser = msct_parser.Parser(__file__)
+    parser.add_option(name="-i", type_value="str", description="Input", mandatory=True, example='t2.nii')
+    assert parser.parse(arguments) == {'-i': 't2.nii'}
+    assert list_fname == [fname_profile or os.getcwd()]
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for sct_flatten_sagittal
+
+from __future__ import absolute_import
+
+import sys, os
+
+import pytest
+import numpy as np
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+import sct_flatten_sagittal
+
+
+@pytest.mark.parametrize('n_jobs', [1, 3])
+def test_translate_slices(n_jobs):
+    """Integer translations should shift each axial slice exactly, for each volume of 4D data"""
+    rng = np.random.RandomState(0)
+    data = rng.rand(12, 5, 7, 2)
+    translation_x = rng.randint(-3, 4, 7)
+    data_out = sct_flatten_sagittal.translate_slices(data, translation_x, order=0, n_jobs=n_jobs)
+    assert data_out.shape == data.shape
+    for iz, tx in enumerate(translation_x):
+        for ix in range(12):
+            if 0 <= ix + tx < 12:
+                assert np.allclose(data_out[ix, :, iz], data[ix + tx, :, iz])
+            else:
+                assert np.all(data_out[ix, :, iz] == 0)
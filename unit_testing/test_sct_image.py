@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for sct_image
+
+from __future__ import absolute_import
+
+import sys, os
+
+import pytest
+import numpy as np
+import nibabel
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+from spinalcordtoolbox.image import Image
+import sct_image
+
+
+@pytest.fixture(scope="module")
+def dummy_image_4d():
+    data = np.random.RandomState(0).rand(6, 7, 8, 5).astype(np.float32)
+    return Image(data, hdr=nibabel.Nifti1Image(data, np.eye(4)).header, absolutepath='data.nii.gz')
+
+
+@pytest.mark.parametrize('dim', [0, 1, 2, 3])
+def test_split_concat_data(dummy_image_4d, dim):
+    im_split_list = sct_image.split_data(dummy_image_4d, dim)
+    assert len(im_split_list) == dummy_image_4d.data.shape[dim]
+    # split images are views on the input data
+    assert all(np.shares_memory(im.data, dummy_image_4d.data) for im in im_split_list)
+    im_concat = sct_image.concat_data(im_split_list, dim)
+    assert np.array_equal(im_concat.data, dummy_image_4d.data)
+
+
+def test_concat_data_memmap(dummy_image_4d, tmpdir):
+    fname_list = []
+    for im in sct_image.split_data(dummy_image_4d, 3, squeeze_data=False):
+        fname_list.append(str(tmpdir.join(os.path.basename(im.absolutepath))))
+        im.save(fname_list[-1], verbose=0)
+    im_concat = sct_image.concat_data(fname_list, 3, fname_memmap=str(tmpdir.join('concat.dat')))
+    assert isinstance(im_concat.data, np.memmap)
+    assert np.array_equal(im_concat.data, dummy_image_4d.data)
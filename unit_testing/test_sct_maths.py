@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for sct_maths
+
+from __future__ import absolute_import
+
+import sys, os
+
+import pytest
+import numpy as np
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+import sct_maths
+
+
+@pytest.fixture(scope="module")
+def dummy_mask():
+    """Sparse binary 3d mask"""
+    rng = np.random.RandomState(0)
+    return (rng.rand(30, 30, 20) > 0.97).astype(np.uint8)
+
+
+@pytest.mark.parametrize('radius', [1, 2, 4])
+def test_dilate_erode_edt(dummy_mask, radius):
+    """Distance-transform morphology should match sliding a ball structuring element"""
+    data_dil = sct_maths.dilate(dummy_mask, [radius])
+    assert np.array_equal(sct_maths.dilate(dummy_mask, [radius], use_edt=True), data_dil)
+    # compare away from the borders, where padding conventions differ
+    crop = (slice(radius, -radius),) * 3
+    assert np.array_equal(sct_maths.erode(data_dil, [radius], use_edt=True)[crop],
+                          sct_maths.erode(data_dil, [radius])[crop])
+
+
+@pytest.mark.parametrize('size', [[2, 2, 2], [4, 3, 2], [1, 3, 6]])
+def test_dilate_erode_box(size):
+    """Separable box filters (performance mode) should match sliding the box, including for even sizes"""
+    from skimage.morphology import dilation, erosion
+    data = np.random.RandomState(0).rand(12, 11, 10).astype(np.float32)
+    for func, func_ref in [(sct_maths.dilate, dilation), (sct_maths.erode, erosion)]:
+        data_ref = func_ref(data, np.ones(size))
+        assert np.array_equal(func(data, size), data_ref)
+        assert np.array_equal(func(data, size, use_edt=True), data_ref)
+
+
+def test_dilate_4d(dummy_mask):
+    data = np.stack([dummy_mask, 1 - dummy_mask], axis=3)
+    data_out = sct_maths.dilate(data, [2], use_edt=True, n_jobs=2)
+    for it in range(2):
+        assert np.array_equal(data_out[..., it], sct_maths.dilate(data[..., it], [2]))
+
+
+def test_accumulate():
+    """In-place accumulation should match concatenating along t then reducing"""
+    rng = np.random.RandomState(0)
+    data, data2 = rng.rand(5, 5, 5, 3), rng.rand(5, 5, 5)
+    for ufunc, reduce_func in [(np.add, np.sum), (np.multiply, np.prod)]:
+        for operands in [[data2], sct_maths.get_operands('2', data)]:
+            data_concat = data
+            for operand in operands:
+                data_concat = sct_maths.concatenate_along_4th_dimension(data_concat, operand)
+            assert np.allclose(sct_maths.accumulate(data, operands, ufunc), reduce_func(data_concat, axis=3))
+    assert sct_maths.accumulate(data, [data2], np.add, dtype=np.float32).dtype == np.float32
+
+
+def test_run_chain():
+    """Chained (and fused) operations should match running the operations one at a time"""
+    rng = np.random.RandomState(0)
+    data = rng.rand(10, 10, 50)
+    operations = sct_maths.parse_chain("thr=0.5;bin=0.6;mul=2;add=1;dilate=1", sct_maths.get_parser())
+    assert [op for op, _ in operations] == ['thr', 'bin', 'mul', 'add', 'dilate']
+    data_ref = data.copy()
+    for operation, param in operations:
+        data_ref = sct_maths.compute(data_ref, operation, param)
+    list_saved = []
+    data_out = sct_maths.run_chain(data.copy(), operations[:2] + [('o', 'bin.nii.gz')] + operations[2:],
+                                   save_func=lambda fname, data_tmp: list_saved.append((fname, data_tmp.copy())))
+    assert np.allclose(data_out, data_ref)
+    assert list_saved[0][0] == 'bin.nii.gz'
+    assert np.array_equal(list_saved[0][1], (np.where(data < 0.5, 0, data) > 0.6))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for sct_pipeline
+
+from __future__ import absolute_import
+
+import sys, os, time, subprocess, multiprocessing
+
+import psutil
+import pytest
+from pandas import DataFrame
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+import sct_pipeline
+
+
+def _dummy_launcher(args):
+    """Job which crashes on subject 'crash', and records each call in the file calls.txt of the working directory"""
+    subject = os.path.basename(args[1])
+    with open('calls.txt', 'a') as f:
+        f.write(subject + '\n')
+    return DataFrame(index=[subject], data={'status': int(subject == 'crash'), 'output': args[2]})
+
+
+def test_run_function_resume(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    monkeypatch.setattr(sct_pipeline, 'function_launcher', _dummy_launcher)
+    fname_ledger = 'ledger.jsonl'
+    list_subj = ['sub1', 'crash', 'sub2']
+
+    results = sct_pipeline.run_function('sct_dummy', str(tmpdir), list_subj, list_args=['-a 1'], nb_cpu=2,
+                                        verbose=0, fname_ledger=fname_ledger)['results']
+    assert list(results.index) == list_subj
+    ledger = sct_pipeline.JobLedger(fname_ledger)
+    assert len(ledger.entries) == 3
+    assert ledger.is_done(('sct_dummy', str(tmpdir.join('sub1')), '-a 1', 0))
+    assert not ledger.is_done(('sct_dummy', str(tmpdir.join('crash')), '-a 1', 0))
+
+    # resume: only the crashed job is run again, results of the previous run are read from the ledger
+    os.remove('calls.txt')
+    results = sct_pipeline.run_function('sct_dummy', str(tmpdir), list_subj, list_args=['-a 1'], nb_cpu=2,
+                                        verbose=0, fname_ledger=fname_ledger)['results']
+    with open('calls.txt') as f:
+        assert f.read().split() == ['crash']
+    assert list(results.index) == list_subj
+    assert list(results['status']) == [0, 1, 0]
+    assert list(results['output']) == ['-a 1'] * 3
+
+    # truncated last line (run killed while writing): the entry is ignored
+    with open(fname_ledger, 'a') as f:
+        f.write('{"job": ["sct_dummy"')
+    assert len(sct_pipeline.JobLedger(fname_ledger).entries) == 3
+
+
+def _spawn_and_sleep(fname_pid):
+    """Start a child process and an orphaned grandchild (in the same process group), then sleep"""
+    child = subprocess.Popen(['sleep', '60'])
+    grandchild = subprocess.check_output('sleep 60 > /dev/null 2>&1 & echo $!', shell=True)
+    with open(fname_pid, 'w') as f:
+        f.write('{} {}'.format(child.pid, int(grandchild)))
+    time.sleep(60)
+
+
+def _job_in_own_group(fname_pid, queue):
+    """Call _spawn_and_sleep() with a timeout, as a job within a worker of sct_pipeline"""
+    os.setpgrp()
+    time_start = time.time()
+    try:
+        sct_pipeline.call_with_timeout(_spawn_and_sleep, 1, fname_pid)
+        queue.put(('done', time.time() - time_start))
+    except sct_pipeline.JobTimeout:
+        queue.put(('timeout', time.time() - time_start))
+
+
+def _is_running(pid):
+    try:
+        return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+
+@pytest.mark.skipif(sys.platform.startswith('win'), reason="SIGALRM and process groups are not available on Windows")
+def test_call_with_timeout(tmpdir):
+    assert sct_pipeline.call_with_timeout(max, 0, 1, 2) == 2
+    assert sct_pipeline.call_with_timeout(max, 10, 1, 2) == 2
+
+    fname_pid = str(tmpdir.join('pid.txt'))
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_job_in_own_group, args=(fname_pid, queue))
+    process.start()
+    status, duration = queue.get(timeout=30)
+    process.join()
+    assert status == 'timeout' and duration < 10
+    # the child and the orphaned grandchild of the job were killed
+    with open(fname_pid) as f:
+        list_pid = [int(pid) for pid in f.read().split()]
+    for pid in list_pid:
+        assert not _is_running(pid)
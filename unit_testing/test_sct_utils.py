@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for sct_utils
+
+from __future__ import absolute_import
+
+import sys, os, logging
+
+import pytest
+
+from spinalcordtoolbox.utils import __sct_dir__
+sys.path.append(os.path.join(__sct_dir__, 'scripts'))
+import sct_utils as sct
+
+
+def test_run_inprocess(tmpdir):
+    cwd, handlers = os.getcwd(), logging.root.handlers[:]
+    status, output = sct.run(['sct_maths', '-h'], verbose=0, cwd=str(tmpdir))
+    assert status == 0
+    assert 'USAGE' in output
+    status, output = sct.run(['sct_maths', '-i', 'nofile.nii', '-add', '1', '-o', 'out.nii'], verbose=0,
+                             raise_exception=False, cwd=str(tmpdir))
+    assert status != 0
+    assert "doesn't exist: nofile.nii" in output
+    with pytest.raises(sct.RunError):
+        sct.run('sct_maths -i nofile.nii -add 1 -o out.nii', verbose=0)
+    # state of the caller is restored
+    assert os.getcwd() == cwd
+    assert logging.root.handlers == handlers
+
+
+def test_run_inprocess_output_max(tmpdir, monkeypatch):
+    """Only the end of the output of in-process scripts is kept, as for subprocesses"""
+    capture = sct._OutputCapture(maxsize=100)
+    for i in range(1000):
+        capture.write('line {}\n'.format(i))
+    output = capture.getvalue().splitlines()
+    assert output[0].startswith('[...') and output[-1] == 'line 999'
+    assert sum(len(line) + 1 for line in output[1:]) <= 100
+    monkeypatch.setattr(sct, 'RUN_OUTPUT_MAX', 200)
+    status, output = sct.run(['sct_maths', '-h'], verbose=0, cwd=str(tmpdir))
+    assert status == 0
+    assert output.startswith('[...') and len(output) < 300
+
+
+def test_get_inprocess_script(monkeypatch):
+    assert sct._get_inprocess_script(['sct_maths', '-h'])[1] == ['-h']
+    assert sct._get_inprocess_script('sct_maths -h | grep USAGE')[0] is None
+    assert sct._get_inprocess_script(['isct_antsRegistration'])[0] is None
+    monkeypatch.setenv('SCT_RUN_INPROCESS', '0')
+    assert sct._get_inprocess_script(['sct_maths', '-h'])[0] is None
+
+
+def test_compresslevel(tmpdir, monkeypatch):
+    import numpy as np
+    from spinalcordtoolbox.image import Image
+    from spinalcordtoolbox.utils import is_tmp_path, get_compresslevel
+    monkeypatch.delenv('SCT_COMPRESSLEVEL', raising=False)
+    monkeypatch.delenv('SCT_TMP_COMPRESSLEVEL', raising=False)
+    path_tmp = sct.tmp_create(verbose=0)
+    fname_tmp, fname_out = os.path.join(path_tmp, 'data.nii.gz'), str(tmpdir.join('data.nii.gz'))
+    assert is_tmp_path(fname_tmp) and not is_tmp_path(fname_out)
+    assert get_compresslevel(fname_tmp) == 0 and get_compresslevel(fname_out) is None
+    monkeypatch.setenv('SCT_COMPRESSLEVEL', '6')
+    assert get_compresslevel(fname_out) == 6
+    data = np.zeros((20, 20, 20), dtype=np.float32)
+    data[5:15, 5:15, 5:15] = 1
+    im = Image(data)
+    im.save(fname_tmp)
+    # files of temporary folders are not compressed, outputs are
+    assert os.path.getsize(fname_tmp) > data.nbytes
+    sct.generate_output_file(fname_tmp, fname_out, verbose=0)
+    assert not os.path.exists(fname_tmp)
+    assert os.path.getsize(fname_out) < data.nbytes / 10
+    assert np.array_equal(Image(fname_out).data, data)
+    # outputs copied or moved out of temporary folders are compressed too
+    im.save(fname_tmp)
+    path_out = str(tmpdir.mkdir('out'))
+    sct.copy(fname_tmp, path_out, verbose=0)
+    assert os.path.getsize(os.path.join(path_out, 'data.nii.gz')) < data.nbytes / 10
+    sct.copy(fname_tmp, os.path.join(path_tmp, 'copy.nii.gz'), verbose=0)
+    assert os.path.getsize(os.path.join(path_tmp, 'copy.nii.gz')) > data.nbytes
+    sct.mv(fname_tmp, os.path.join(path_out, 'mv.nii.gz'), verbose=0)
+    assert not os.path.exists(fname_tmp)
+    assert os.path.getsize(os.path.join(path_out, 'mv.nii.gz')) < data.nbytes / 10
+    assert np.array_equal(Image(os.path.join(path_out, 'mv.nii.gz')).data, data)
+    sct.rmtree(path_tmp)
+
+
+def test_tmp_create(tmpdir, monkeypatch):
+    import tempfile
+    import numpy as np
+    from spinalcordtoolbox.image import Image
+    path_fast = str(tmpdir.mkdir('fast'))
+    monkeypatch.setenv('SCT_TMPDIR', os.pathsep.join([str(tmpdir.join('nofolder')), path_fast]))
+    monkeypatch.delenv('SCT_KEEP_TMP', raising=False)
+    path_tmp = sct.tmp_create(verbose=0, size=1 << 20)
+    assert os.path.dirname(path_tmp) == path_fast
+    # not enough space: fall back to the system temporary folder
+    path_tmp_big = sct.tmp_create(verbose=0, size=1 << 60)
+    assert os.path.dirname(path_tmp_big) == tempfile.gettempdir()
+    # inputs are linked, and saving an image over a link does not modify the input
+    fname_in = str(tmpdir.join('in.nii'))
+    Image(np.ones((4, 4, 4))).save(fname_in)
+    sct.link(fname_in, path_tmp)
+    fname_tmp = os.path.join(path_tmp, 'in.nii')
+    assert os.path.getsize(fname_tmp) == os.path.getsize(fname_in)
+    assert sct.get_tmp_size(path_tmp) == 0
+    Image(np.zeros((4, 4, 4))).save(fname_tmp)
+    assert np.all(Image(fname_in).data == 1)
+    assert sct.get_tmp_size(path_tmp) == os.path.getsize(fname_tmp)
+    # failure: remove the remaining temporary folders
+    sct.tmp_cleanup(exclude=[path_tmp])
+    assert os.path.isdir(path_tmp) and not os.path.exists(path_tmp_big)
+    with sct.TempFolder() as tmp_folder:
+        assert os.path.isdir(tmp_folder.get_path())
+    assert not os.path.exists(tmp_folder.get_path())
+    sct.rmtree(path_tmp)
+
+
+def test_run_subprocess(tmpdir, monkeypatch):
+    import json
+    fname_log = str(tmpdir.join('run.log'))
+    monkeypatch.setenv('SCT_RUN_LOG', fname_log)
+    status, output = sct.run([sys.executable, '-c', 'for i in range(100000): print(" line %d " % i)'], verbose=0)
+    assert status == 0
+    assert output.splitlines() == ['line %d' % i for i in range(100000)]
+    # only the end of long outputs is kept
+    monkeypatch.setattr(sct, 'RUN_OUTPUT_MAX', 1000)
+    status, output = sct.run([sys.executable, '-c', 'for i in range(100000): print(i)'], verbose=0)
+    assert output.splitlines()[0].startswith('[...')
+    assert output.splitlines()[-1] == '99999' and len(output) < 1100
+    with open(fname_log) as f:
+        records = [json.loads(line) for line in f]
+    assert [x['status'] for x in records] == [0, 0]
+    assert records[1]['output_bytes'] > 1000
+
+
+def test_run_async(tmpdir):
+    cmd = [sys.executable, '-c', 'import sys; print(sys.argv[1]); sys.exit(int(sys.argv[1]))']
+    future = sct.run_async(cmd + ['0'], verbose=0)
+    assert future.result() == (0, '0')
+    assert sct.run_many([cmd + [str(i)] for i in range(4)], n_jobs=2, raise_exception=False, verbose=0) == \
+        [(i, str(i)) for i in range(4)]
+    with pytest.raises(sct.RunError):
+        sct.run_many([cmd + ['0'], cmd + ['1']], n_jobs=2, verbose=0)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# pytest unit tests for spinalcordtoolbox.warp
+
+from __future__ import absolute_import
+
+import shutil
+
+import pytest
+import numpy as np
+import nibabel as nib
+
+from spinalcordtoolbox import warp
+from spinalcordtoolbox.warp import is_displacement_field, warp_images
+
+
+@pytest.fixture(scope="module")
+def dummy_warp(tmpdir_factory):
+    """Reference image, two inputs with different grids and a translation warping field (ITK/LPS convention)"""
+    path = tmpdir_factory.mktemp('warp')
+    affine = np.diag([1., 1., 1., 1.])
+    rng = np.random.RandomState(0)
+    data = rng.rand(10, 12, 8).astype(np.float32)
+    nib.save(nib.Nifti1Image(np.zeros((10, 12, 8), np.float32), affine), str(path.join('ref.nii.gz')))
+    nib.save(nib.Nifti1Image(data, affine), str(path.join('in.nii.gz')))
+    # same data, sampled on a grid with half the resolution along z
+    affine_half = np.diag([1., 1., 0.5, 1.])
+    nib.save(nib.Nifti1Image(np.repeat(data, 2, axis=2), affine_half), str(path.join('in_half.nii.gz')))
+    # displacement of +2 voxels along L (i.e. -2 along R)
+    data_warp = np.zeros((10, 12, 8, 1, 3), np.float32)
+    data_warp[..., 0] = 2
+    im_warp = nib.Nifti1Image(data_warp, affine)
+    im_warp.header.set_intent('vector', (), '')
+    nib.save(im_warp, str(path.join('warp.nii.gz')))
+    return path, data
+
+
+def test_warp_images(dummy_warp):
+    path, data = dummy_warp
+    fname_warp = str(path.join('warp.nii.gz'))
+    assert is_displacement_field(fname_warp)
+    assert not is_displacement_field(str(path.join('ref.nii.gz')))
+    list_fname_out = [str(path.join('out_nn.nii.gz')), str(path.join('out_half.nii.gz'))]
+    warp_images([str(path.join('in.nii.gz')), str(path.join('in_half.nii.gz'))], str(path.join('ref.nii.gz')),
+                fname_warp, list_fname_out, ['NearestNeighbor', 'NearestNeighbor'], n_jobs=2)
+    for fname_out in list_fname_out:
+        data_out = nib.load(fname_out).get_fdata()
+        assert data_out.shape == (10, 12, 8)
+        assert np.allclose(data_out[2:], data[:-2])
+        assert np.all(data_out[:2] == 0)
+
+
+def write_affine_itk(fname, matrix, translation, center):
+    """Write a 3D affine transformation as ANTs does"""
+    if fname.endswith('.mat'):
+        from scipy.io import savemat
+        savemat(fname, {'AffineTransform_double_3_3': np.r_[matrix.ravel(), translation].reshape(12, 1),
+                        'fixed': np.reshape(center, (3, 1))}, format='4')
+    else:
+        with open(fname, 'w') as f:
+            f.write("#Insight Transform File V1.0\n#Transform 0\nTransform: AffineTransform_double_3_3\n")
+            f.write("Parameters: {}\n".format(' '.join(map(str, np.r_[matrix.ravel(), translation]))))
+            f.write("FixedParameters: {}\n".format(' '.join(map(str, center))))
+
+
+def test_apply_transforms(dummy_warp):
+    path, data = dummy_warp
+    fname_ref, fname_warp = str(path.join('ref.nii.gz')), str(path.join('warp.nii.gz'))
+    # translation of +2 voxels along L, as the warping field
+    fname_txt = str(path.join('affine.txt'))
+    write_affine_itk(fname_txt, np.eye(3), [2, 0, 0], [0, 0, 0])
+    # rotation around a center
+    fname_mat = str(path.join('affine.mat'))
+    write_affine_itk(fname_mat, np.array([[0.8, -0.6, 0], [0.6, 0.8, 0], [0, 0, 1]]), [1, -1, 2], [4, 5, 3])
+    # 4D input
+    fname_in = str(path.join('in_4d.nii.gz'))
+    nib.save(nib.Nifti1Image(np.stack([data, 2 * data], axis=3), np.eye(4)), fname_in)
+    for list_transfo in [[(fname_txt, False)], [(fname_mat, False), (fname_mat, True), (fname_warp, False)]]:
+        assert warp.is_supported(list_transfo)
+        fname_out = str(path.join('out_4d.nii.gz'))
+        warp.apply_transforms(fname_in, fname_ref, list_transfo, fname_out, interp='Linear', n_jobs=2)
+        data_out = nib.load(fname_out).get_fdata()
+        assert data_out.shape == (10, 12, 8, 2)
+        assert np.allclose(data_out[2:, ..., 0], data[:-2], atol=1e-5)
+        assert np.allclose(data_out[..., 1], 2 * data_out[..., 0], atol=1e-5)
+    assert not warp.is_supported([(fname_warp, True)])
+    assert not warp.is_supported([(fname_ref, False)])
+
+
+def test_warp_chain(dummy_warp):
+    path, data = dummy_warp
+    fname_ref, fname_warp = str(path.join('ref.nii.gz')), str(path.join('warp.nii.gz'))
+    fname_mat = str(path.join('affine.mat'))
+    write_affine_itk(fname_mat, np.array([[0.8, -0.6, 0], [0.6, 0.8, 0], [0, 0, 1]]), [1, -1, 2], [4, 5, 3])
+    list_transfo = [(fname_warp, False), (fname_mat, False)]
+    chain = warp.WarpChain.get(list_transfo, fname_ref)
+    # chains are composed once
+    assert warp.WarpChain.get(list_transfo, fname_ref) is chain
+    fname_in, fname_out = str(path.join('in.nii.gz')), str(path.join('out_chain.nii.gz'))
+    chain.apply(fname_in, fname_out)
+    # the composed field gives the same result as the chain, when read from disk
+    fname_composed = str(path.join('warp_composed.nii.gz'))
+    chain.save(fname_composed)
+    assert is_displacement_field(fname_composed)
+    assert warp.WarpChain.get([(fname_composed, False)], fname_ref) is chain
+    # equivalent field, once moved
+    fname_moved = str(path.join('warp_moved.nii.gz'))
+    shutil.copy(fname_composed, fname_moved)
+    assert warp.WarpChain.get([(fname_moved, False)], fname_ref) is not chain
+    chain.alias(fname_moved)
+    assert warp.WarpChain.get([(fname_moved, False)], fname_ref) is chain
+    warp._cache_warp_chain.clear()
+    fname_out_composed = str(path.join('out_composed.nii.gz'))
+    warp.apply_transforms(fname_in, fname_ref, [(fname_composed, False)], fname_out_composed)
+    assert np.allclose(nib.load(fname_out_composed).get_fdata(), nib.load(fname_out).get_fdata(), atol=1e-4)
+
+
+@pytest.mark.parametrize('fname, compresslevel', [('field.nii', None), ('field.nii.gz', None), ('field.nii.gz', 0)])
+def test_displacement_field_writer(tmpdir, fname, compresslevel):
+    header = nib.Nifti1Image(np.zeros((6, 7, 8), np.int16), np.diag([2., 2., 3., 1.])).header
+    header.set_slope_inter(2., 1.)
+    data = np.random.RandomState(0).rand(6, 7, 8, 1, 3).astype(np.float32)
+    fname = str(tmpdir.join(fname))
+    with warp.DisplacementFieldWriter(fname, header, compresslevel) as writer:
+        for iz in range(8):
+            writer.data[:, :, iz] = data[:, :, iz]
+    assert is_displacement_field(fname)
+    im = nib.load(fname)
+    assert im.get_data_dtype() == np.float32
+    assert im.header.get_intent()[0] == 'vector'
+    assert np.allclose(im.affine, np.diag([2., 2., 3., 1.]))
+    assert np.array_equal(im.get_fdata(), data)
+
+
+def test_warp_chain_cache(dummy_warp, monkeypatch):
+    path, data = dummy_warp
+    fname_ref, fname_warp = str(path.join('ref.nii.gz')), str(path.join('warp.nii.gz'))
+    fname_mat = str(path.join('affine.mat'))
+    write_affine_itk(fname_mat, np.eye(3), [1, 0, 0], [0, 0, 0])
+    fname_in = str(path.join('in.nii.gz'))
+    warp._cache_warp_chain.clear()
+    # room for the composed and sampling coordinates (float32 + float64) of a single chain
+    nbytes_chain = 36 * int(np.prod(data.shape))
+    monkeypatch.setattr(warp, 'WARP_CHAIN_CACHE_BYTES', nbytes_chain)
+    chain1 = warp.WarpChain.get([(fname_warp, False)], fname_ref)
+    chain1.apply(fname_in, str(path.join('out1.nii.gz')))
+    assert chain1.nbytes == nbytes_chain
+    chain2 = warp.WarpChain.get([(fname_mat, False)], fname_ref)
+    chain2.apply(fname_in, str(path.join('out2.nii.gz')))
+    # the least recently used chain is removed
+    assert list(warp._cache_warp_chain.values()) == [chain2]
+    # large grids are composed into a memory map, which is not counted
+    monkeypatch.setattr(warp, 'WARP_CHAIN_MEMMAP_BYTES', 0)
+    chain3 = warp.WarpChain.get([(fname_warp, False), (fname_mat, False)], fname_ref)
+    assert isinstance(chain3.coord_phy, np.memmap)
+    chain3.apply(fname_in, str(path.join('out3.nii.gz')))
+    assert chain3.nbytes == 24 * int(np.prod(data.shape))
+    warp._cache_warp_chain.clear()